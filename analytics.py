@@ -0,0 +1,80 @@
+import collections
+import csv
+import io
+import sqlite3
+
+# Виды событий
+VIEW = "view"
+DIGEST = "digest"
+
+
+class PromoAnalytics:
+    """Счетчики просмотров и доставок акций по (акция, чат, день).
+
+    События копятся в памяти простым увеличением счетчика и периодически
+    сбрасываются в SQLite одной транзакцией (flush), а не записью на каждое событие.
+    """
+
+    def __init__(self, filepath):
+        self._conn = sqlite3.connect(filepath, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS promo_stats ("
+            "day TEXT NOT NULL, promo_id TEXT NOT NULL, chat_id INTEGER NOT NULL, "
+            "views INTEGER NOT NULL DEFAULT 0, digests INTEGER NOT NULL DEFAULT 0, "
+            "PRIMARY KEY (day, promo_id, chat_id))"
+        )
+        self._pending = collections.Counter()
+
+    def record(self, event, promo_id, chat_id, day):
+        self._pending[(day, promo_id, chat_id, event)] += 1
+
+    def flush(self):
+        """Запись накопленных счетчиков. Возвращает число обновленных строк"""
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, collections.Counter()
+        rows = [
+            (str(day), str(promo_id), int(chat_id), count if event == VIEW else 0, count if event == DIGEST else 0)
+            for (day, promo_id, chat_id, event), count in pending.items()
+        ]
+        try:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT INTO promo_stats (day, promo_id, chat_id, views, digests) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(day, promo_id, chat_id) DO UPDATE SET "
+                "views = views + excluded.views, digests = digests + excluded.digests",
+                rows
+            )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            # Счетчики возвращаются и попадут в следующий сброс
+            self._pending.update(pending)
+            raise
+        return len(rows)
+
+    def export_csv(self, since=None, names=None, chunk_size=1000):
+        """Построчная выгрузка агрегатов в CSV начиная с дня since. names — promo_id -> название"""
+        self.flush()
+        names = names or {}
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(["day", "promo_id", "promo_name", "chat_id", "views", "digests"])
+        cursor = self._conn.execute(
+            "SELECT day, promo_id, chat_id, views, digests FROM promo_stats "
+            "WHERE day >= ? ORDER BY day, promo_id, chat_id",
+            (str(since) if since else "",)
+        )
+        # Строки читаются порциями, а не одним fetchall
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for day, promo_id, chat_id, views, digests in rows:
+                writer.writerow([day, promo_id, names.get(promo_id, ""), chat_id, views, digests])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.getvalue():
+            yield buffer.getvalue()
@@ -0,0 +1,68 @@
+import re
+import timeit
+from datetime import date
+
+from date_parser import parse_date_range
+
+try:
+    import dateparser
+except ImportError:
+    dateparser = None
+
+# Сравнение разбора дат акции: новый парсер с заранее скомпилированными
+# шаблонами, прежний разбор из handle_add_promotion_dates и dateparser,
+# если он установлен. Запуск: python bench_date_parser.py
+
+SAMPLES = [
+    "03.06.2025 - 31.07.2025",
+    "с 4 по 28 июля 2025 года",
+    "с 4 июня по 28 июля 2025",
+    "с 28 декабря 2025 по 5 января 2026",
+]
+NUMBER = 20_000
+
+
+def legacy_parse(text):
+    """Прежний разбор: шаблон и словарь месяцев создаются при каждом вызове"""
+    match = re.search(r"с\s+(\d{1,2})\s+по\s+(\d{1,2})\s+([а-яА-Я]+)\s+(\d{4})", text, re.IGNORECASE)
+    if not match:
+        raise ValueError(text)
+    month_map = {
+        "января": 1, "февраля": 2, "марта": 3, "апреля": 4,
+        "мая": 5, "июня": 6, "июля": 7, "августа": 8,
+        "сентября": 9, "октября": 10, "ноября": 11, "декабря": 12
+    }
+    month = month_map[match.group(3).lower()]
+    year = int(match.group(4))
+    return date(year, month, int(match.group(1))), date(year, month, int(match.group(2)))
+
+
+def dateparser_parse(text):
+    """Разбор dateparser: диапазон режется по разделителю, каждая дата разбирается отдельно"""
+    parts = re.split(r"\s+(?:по|-)\s+", re.sub(r"^с\s+", "", text))
+    return tuple(dateparser.parse(part, languages=["ru"]).date() for part in parts)
+
+
+def bench(name, parse):
+    supported = []
+    for text in SAMPLES:
+        try:
+            parse(text)
+            supported.append(text)
+        except Exception:
+            pass
+    if not supported:
+        print(f"{name:12} не разбирает ни один пример")
+        return
+    seconds = timeit.timeit(lambda: [parse(text) for text in supported], number=NUMBER // len(supported))
+    per_call = seconds / (NUMBER // len(supported) * len(supported)) * 1e6
+    print(f"{name:12} {per_call:8.2f} мкс на разбор, форматов {len(supported)} из {len(SAMPLES)}")
+
+
+if __name__ == "__main__":
+    bench("date_parser", parse_date_range)
+    bench("прежний", legacy_parse)
+    if dateparser is None:
+        print(f"{'dateparser':12} не установлен")
+    else:
+        bench("dateparser", dateparser_parse)
@@ -1,17 +1,24 @@
 import logging
 import os
-import json
+import io
 import asyncio
+import pickle
+import csv
+import hashlib
+import signal
 import pytz
 import random
 from pytz import timezone
-from datetime import datetime, time
+from datetime import datetime, time, timedelta
 from telegram import (
     Update,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
     BotCommandScopeDefault,
-    BotCommandScopeChat
+    BotCommandScopeChat,
+    InlineQueryResultArticle,
+    InlineQueryResultCachedPhoto,
+    InputTextMessageContent
 )
 from telegram.ext import (
     Application,
@@ -20,120 +27,59 @@ from telegram.ext import (
     ContextTypes,
     MessageHandler,
     filters,
-    ConversationHandler
+    ConversationHandler,
+    TypeHandler,
+    ApplicationHandlerStop,
+    InlineQueryHandler
 )
-import dateparser
+from telegram.error import BadRequest, ChatMigrated, Forbidden
+from telegram.request import HTTPXRequest
 
 # Добавляем импорт конфигурации
-from config import TOKEN, ADMIN_IDS
-
-# Применяем nest_asyncio для Jupyter Notebook и подобных сред
-
-DATA_FILE = "data.json"
-CHAT_IDS_FILE = "chat_ids.json"
-
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
+from config import (
+    TENANTS, HTTP_POOL_SIZE, LOG_LEVEL, LOG_LEVELS, LOG_FILE, LOG_RATE_LIMIT, LOG_RATE_WINDOW,
+    PROFILE_DEFAULT_SECONDS, PROFILE_MAX_SECONDS, LOOP_LAG_INTERVAL, LOOP_LAG_THRESHOLD,
+    CONVERSATION_TIMEOUT, CONVERSATION_SWEEP_INTERVAL, STATE_DB_FILE, IMPORT_PHOTO_CONCURRENCY,
+    JOURNAL_COMPACT_INTERVAL, INLINE_PAGE_SIZE, INLINE_CACHE_TIME,
+    DEFAULT_TIMEZONE, DIGEST_HOUR, DIGEST_MINUTE, DIGEST_WINDOW_SECONDS, SEND_RATE, SEND_INTERACTIVE_RESERVE,
+    ANALYTICS_FLUSH_INTERVAL, SENT_SYNC_INTERVAL, SENT_SYNC_CONCURRENCY, SENT_MESSAGE_RETENTION,
+    PINNED_DIGEST_MAX_BUTTONS, BROADCAST_CONCURRENCY, BROADCAST_PROGRESS_INTERVAL
 )
-logger = logging.getLogger(__name__)
-
-# Глобальные переменные
-promotions = {}
-chat_ids = {}
+import analytics
+import bulk_edit
+import bulk_io
+import profiler
+from broadcast import Broadcast
+from throttle import ALLOW, NOTIFY, REPEAT
+from date_parser import FORMAT_HINT, parse_date_range
+from callback_codec import Action, CallbackRouter, matches, pack, unpack
+from persistence import SQLitePersistence, StateApplication
+from tenant import DIGEST_MODES, SharedHTTPXRequest, Tenant, get_tenant
+from photo_cache import PhotoCache
+from timezones import is_valid_timezone, local_today
+from send_window import plan_offsets
+from shop_groups import ALL_SHOPS, group_ref, is_ref
+from loop_monitor import LoopMonitor
+from logging_setup import setup_logging, set_level, current_levels
+from rate_limiter import Lane, PriorityRateLimiter
+
+# Настройка логирования: JSON-строки через очередь и фоновый поток
+setup_logging(LOG_LEVEL, LOG_LEVELS, LOG_FILE, rate_limit=LOG_RATE_LIMIT, rate_window=LOG_RATE_WINDOW)
+logger = logging.getLogger("bot")
+# Подсистемы с частыми сообщениями; уровень меняется командой /loglevel
+send_logger = logging.getLogger("bot.send")
+promo_logger = logging.getLogger("bot.promo")
 
 # Вспомогательные функции
-def check_file_permissions():
-    if not os.access(CHAT_IDS_FILE, os.R_OK):
-        logger.error(f"Нет прав на чтение файла {CHAT_IDS_FILE}")
-        return False
-    return True
-
-def custom_serializer(obj):
-    """Кастомный сериализатор для JSON"""
-    if isinstance(obj, set):
-        return list(obj)
-    raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
-
-def save_data(data):
-    """Сохранение данных в файл"""
-    try:
-        with open(DATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False, default=custom_serializer)
-    except Exception as e:
-        logger.error(f"Ошибка при сохранении данных: {e}")
-
-def load_chat_ids():
-    if not os.path.exists(CHAT_IDS_FILE):
-        logger.error(f"Файл {CHAT_IDS_FILE} не найден")
-        return {}
-    
-    try:
-        with open(CHAT_IDS_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except UnicodeDecodeError:
-        try:
-            with open(CHAT_IDS_FILE, 'r', encoding='cp1251') as f:
-                return json.load(f)
-        except Exception as e:
-            logger.error(f"Ошибка при чтении файла chat_ids: {e}")
-            return {}
-    except Exception as e:
-        logger.error(f"Другая ошибка при загрузке chat_ids: {e}")
-        return {}
-
-def load_data():
-    """Загрузка данных"""
-    try:
-        with open(DATA_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except UnicodeDecodeError:
-        try:
-            with open(DATA_FILE, 'r', encoding='cp1251') as f:
-                return json.load(f)
-        except Exception as e:
-            logger.error(f"Не удалось прочитать файл даже в cp1251: {e}")
-            return {}
-    except Exception as e:
-        logger.error(f"Другая ошибка при чтении {DATA_FILE}: {e}")
-        return {}
-
-def save_chat_ids(chat_ids_data):
-    """Сохранение ID чатов"""
-    try:
-        with open(CHAT_IDS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(chat_ids_data, f, ensure_ascii=False, indent=4)
-    except Exception as e:
-        logger.error(f"Ошибка при сохранении ID чатов: {e}")
-
-def check_and_create_files():
-    if not os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump({}, f)
-        logger.info(f"Создан файл {DATA_FILE}")
-    
-    if not os.path.exists(CHAT_IDS_FILE):
-        with open(CHAT_IDS_FILE, 'w', encoding='utf-8') as f:
-            json.dump({}, f)  # Создаем пустой словарь
-        logger.info(f"Создан файл {CHAT_IDS_FILE}")
-    
-    if not os.path.exists('photos'):
-        os.makedirs('photos')
-        logger.info("Создана директория photos")
-
-def load_initial_data():
-    """Загрузка начальных данных"""
-    check_and_create_files()
-    return load_data(), load_chat_ids()
-
-def is_promotion_active(promotion):
+def is_promotion_active(promotion, today=None):
+    """Проверка активности акции на дату today (по умолчанию — сегодня в основном поясе)"""
     try:
         start = datetime.fromisoformat(promotion['start_date']).date()
         end = datetime.fromisoformat(promotion['end_date']).date()
-        now = datetime.now().date()
+        now = today or local_today(DEFAULT_TIMEZONE)
         result = start <= now <= end
-        logger.info(f"Проверка активности акции '{promotion['name']}': {result}")
+        if promo_logger.isEnabledFor(logging.DEBUG):
+            promo_logger.debug(f"Проверка активности акции '{promotion['name']}': {result}")
         return result
     except Exception as e:
         logger.error(f"Ошибка при проверке активности акции: {e}")
@@ -167,34 +113,50 @@ def build_menu(buttons, n_cols, header_buttons=None, footer_buttons=None):
         menu.append(footer_buttons)
     return menu
 
-# Загрузка начальных данных
-promotions, chat_ids = load_initial_data()
+# file_id уже загруженных фото акций, общий для всех ботов процесса
+photo_cache = PhotoCache(STATE_DB_FILE)
+
+# Задержка цикла событий, общая для всех ботов процесса
+loop_monitor = LoopMonitor(interval=LOOP_LAG_INTERVAL, threshold=LOOP_LAG_THRESHOLD)
 
 # Состояния для ConversationHandler
 SHOP_SELECTION, PROMO_NAME, PROMO_DATES, PROMO_PHOTO, PROMO_LINK, PROMO_SHOPS = range(6)
 EDIT_PROMO_SELECTION, EDIT_SHOP_SELECTION = range(2)
 SELECT_PROMO_FOR_SENDING, SELECT_SHOPS_FOR_SENDING = range(10, 12)
+IMPORT_FILE = 20
+
+# Коды кнопок выбора магазинов: (магазин, группа, все магазины, готово)
+ADD_SHOP_ACTIONS = (Action.SHOP, Action.SHOP_GROUP, Action.SHOP_ALL, Action.SHOPS_DONE)
+EDIT_SHOP_ACTIONS = (Action.EDIT_SHOP, Action.EDIT_GROUP, Action.EDIT_ALL, Action.EDIT_DONE)
+
+# Ключи user_data, которые живут только пока идет соответствующий диалог
+CONVERSATION_KEYS = ("add_promotion", "promo_sending", "edit_promotion", "bulk")
+# ConversationHandler, которому принадлежит ключ user_data (у /bulk диалога нет)
+CONVERSATION_NAMES = {"add_promotion": "add_promotion", "promo_sending": "send_promo", "edit_promotion": "edit_promotion"}
 
 # Обработчики команд
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
+    tenant = get_tenant(context)
     chat_id = str(update.effective_chat.id)
-    if chat_id not in chat_ids:
+    if chat_id not in tenant.chat_ids:
         await update.message.reply_text("Привет! Пожалуйста, укажите название магазина:")
         return "WAITING_FOR_STORE_NAME"
-    await update.message.reply_text(f"Привет, {chat_ids[chat_id]}! Используйте команду /promotions для просмотра акций.")
+    await update.message.reply_text(f"Привет, {tenant.chat_ids[chat_id]}! Используйте команду /promotions для просмотра акций.")
     return ConversationHandler.END
 
 async def handle_store_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка названия магазина"""
+    tenant = get_tenant(context)
     chat_id = str(update.effective_chat.id)
     store_name = update.message.text.strip()
     if not store_name:
         await update.message.reply_text("Название магазина не может быть пустым. Попробуйте снова.")
         return "WAITING_FOR_STORE_NAME"
     
-    chat_ids[chat_id] = store_name
-    save_chat_ids(chat_ids)
+    tenant.chat_ids[chat_id] = store_name
+    tenant.save_chat_ids()
+    tenant.chat_health.revive(chat_id)
     
     logger.info(f"Сохранен чат: {chat_id} - {store_name}")
     await update.message.reply_text(
@@ -204,14 +166,14 @@ async def handle_store_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def view_promotions(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Просмотр акций"""
+    tenant = get_tenant(context)
     chat_id = str(update.effective_chat.id)
-    all_promotions = load_data()
-    logger.info(f"Всего загружено акций: {len(all_promotions)}")
+    today = local_today(tenant.chat_timezone(chat_id))
     
     active_promotions = {
-        pid: p
-        for pid, p in all_promotions.items()
-        if is_promotion_active(p) and chat_id in p.get("shops", [])
+        pid: tenant.promotions[pid]
+        for pid in tenant.promotions_for_chat(chat_id)
+        if is_promotion_active(tenant.promotions[pid], today)
     }
     
     logger.info(f"Активных акций для чата {chat_id}: {len(active_promotions)}")
@@ -221,7 +183,7 @@ async def view_promotions(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     keyboard = [
-        [InlineKeyboardButton(p["name"], callback_data=f"promo_{pid}")]
+        [InlineKeyboardButton(p["name"], callback_data=pack(Action.PROMO, pid))]
         for pid, p in active_promotions.items()
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -229,20 +191,27 @@ async def view_promotions(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def handle_promotion_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка выбора акции"""
+    tenant = get_tenant(context)
     query = update.callback_query
     await query.answer()
+    callback = unpack(query.data)
+
+    # Закрепленная подборка остается в чате, удаляется только меню /promotions
+    if callback.action == Action.PROMO:
+        try:
+            await query.message.delete()
+        except Exception as e:
+            logger.error(f"Ошибка при удалении сообщения: {str(e)}")
     
-    try:
-        await query.message.delete()
-    except Exception as e:
-        logger.error(f"Ошибка при удалении сообщения: {str(e)}")
-    
-    promo_id = query.data.split("_")[1]
-    promotion = promotions.get(promo_id)
+    promo_id = str(callback.args[0])
+    promotion = tenant.promotions.get(promo_id)
     
     if not promotion:
         await query.message.reply_text("Акция не найдена.")
         return
+
+    chat_id = query.message.chat_id
+    tenant.analytics.record(analytics.VIEW, promo_id, chat_id, tenant.delivery_day(str(chat_id)))
     
     message = f"""
 <b>Акция:</b> {promotion['name']}
@@ -250,18 +219,12 @@ async def handle_promotion_selection(update: Update, context: ContextTypes.DEFAU
 <b>Ссылка:</b> {promotion['link']}
 """.strip()
     
+
     try:
-        photo_path = promotion["photo"]
         chat_id = query.message.chat_id
         parts = split_text_with_link(message)
         
-        with open(photo_path, "rb") as photo:
-            await context.bot.send_photo(
-                chat_id=chat_id, 
-                photo=photo, 
-                caption=parts[0], 
-                parse_mode="HTML"
-            )
+        await send_promo_photo(context.bot, chat_id, promotion, parts[0])
         
         for part in parts[1:]:
             await context.bot.send_message(chat_id=chat_id, text=part, parse_mode="HTML")
@@ -273,11 +236,81 @@ async def handle_promotion_selection(update: Update, context: ContextTypes.DEFAU
             text="Не удалось отправить фото акции"
         )
 
+# Inline-поиск акций
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Поиск активных акций по названию: @бот запрос.
+
+    Администраторы ищут по всему каталогу, остальные — только по акциям
+    магазинов, в чатах которых они замечены (remember_shop_member).
+    """
+    tenant = get_tenant(context)
+    query = update.inline_query
+    offset = int(query.offset) if query.offset.isdigit() else 0
+
+    allowed = None
+    if update.effective_user.id not in tenant.admin_ids:
+        shop_chats = [cid for cid in (context.user_data or {}).get("shop_chats", ()) if cid in tenant.chat_ids]
+        allowed = {pid for cid in shop_chats for pid in tenant.promotions_for_chat(cid)}
+
+    today = local_today(DEFAULT_TIMEZONE)
+    found = [
+        pid for pid in tenant.search_index.search(query.query)
+        if pid in tenant.promotions and (allowed is None or pid in allowed)
+        and is_promotion_active(tenant.promotions[pid], today)
+    ]
+    found.sort(key=int, reverse=True)
+    page = found[offset:offset + INLINE_PAGE_SIZE]
+
+    results = []
+    for pid in page:
+        promo = tenant.promotions[pid]
+        caption = (
+            f"📣 Акция: {promo['name']}\n"
+            f"📅 Даты проведения: {promo['start_date']} — {promo['end_date']}\n"
+            f"🔗 {promo['link']}"
+        )
+        file_id = photo_cache.get(context.bot.id, promo["photo"])
+        if file_id:
+            results.append(InlineQueryResultCachedPhoto(
+                id=pid, photo_file_id=file_id, title=promo["name"], caption=caption
+            ))
+        else:
+            results.append(InlineQueryResultArticle(
+                id=pid,
+                title=promo["name"],
+                description=f"{promo['start_date']} — {promo['end_date']}",
+                input_message_content=InputTextMessageContent(caption)
+            ))
+
+    next_offset = str(offset + INLINE_PAGE_SIZE) if offset + INLINE_PAGE_SIZE < len(found) else ""
+    # Выдача зависит от пользователя, кэш Telegram не должен делиться ею с другими
+    await query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=True, next_offset=next_offset)
+
+async def remember_shop_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Запоминание зарегистрированных чатов, в которых пользователь обращался к боту"""
+    tenant = get_tenant(context)
+    chat, user, message = update.effective_chat, update.effective_user, update.effective_message
+    if not chat or str(chat.id) not in tenant.chat_ids:
+        return
+    chat_id = str(chat.id)
+    if message and message.left_chat_member:
+        # Вышедший из чата пользователь теряет доступ к акциям магазина
+        data = context.application.user_data.get(message.left_chat_member.id)
+        if data and chat_id in data.get("shop_chats", ()):
+            data["shop_chats"].remove(chat_id)
+            context.application.mark_data_for_update_persistence(user_ids=message.left_chat_member.id)
+        return
+    if user and not user.is_bot and context.user_data is not None:
+        shop_chats = context.user_data.setdefault("shop_chats", [])
+        if chat_id not in shop_chats:
+            shop_chats.append(chat_id)
+
 # Обработчики для добавления акций
 async def add_promotion_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Начало добавления акции"""
+    tenant = get_tenant(context)
     user_id = update.effective_user.id
-    if user_id not in ADMIN_IDS:
+    if user_id not in tenant.admin_ids:
         await update.message.reply_text("Только администратор может добавлять акции.")
         return ConversationHandler.END
 
@@ -289,70 +322,37 @@ async def handle_add_promotion_name(update: Update, context: ContextTypes.DEFAUL
     """Обработка названия акции"""
     context.user_data["add_promotion"]["name"] = update.message.text
     await update.message.reply_text(
-        "Введите даты начала и окончания акции через тире (например: 03.06.2025 - 31.07.2025):"
+        f"Введите даты начала и окончания акции (например: {FORMAT_HINT}):"
     )
     return PROMO_DATES
 
 async def handle_add_promotion_dates(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка дат акции"""
-    import re
-
     try:
-        dates_text = update.message.text.strip()
-
-        # Пример: "с 4 по 28 июля 2025 года"
-        pattern = r"с\s+(\d{1,2})\s+по\s+(\d{1,2})\s+([а-яА-Я]+)\s+(\d{4})"
-        match = re.search(pattern, dates_text, re.IGNORECASE)
-
-        if not match:
-            raise ValueError("Формат должен быть: с 4 по 28 июля 2025 года")
-
-        day_start = int(match.group(1))
-        day_end = int(match.group(2))
-        month = match.group(3).lower()
-        year = int(match.group(4))
-
-        # Словарь месяцев
-        month_map = {
-            "января": 1, "февраля": 2, "марта": 3, "апреля": 4,
-            "мая": 5, "июня": 6, "июля": 7, "августа": 8,
-            "сентября": 9, "октября": 10, "ноября": 11, "декабря": 12
-        }
-
-        if month not in month_map:
-            raise ValueError("Неизвестный месяц")
-
-        month_num = month_map[month]
-
-        from datetime import date
-        start_date = date(year, month_num, day_start)
-        end_date = date(year, month_num, day_end)
-
-        if start_date > end_date:
-            raise ValueError("Дата начала позже даты окончания.")
-
-        context.user_data["add_promotion"]["start_date"] = start_date.isoformat()
-        context.user_data["add_promotion"]["end_date"] = end_date.isoformat()
-
-        await update.message.reply_text("Отправьте изображение акции:")
-        return PROMO_PHOTO
-
-    except Exception as e:
-        logger.error(f"Ошибка при обработке дат: {e}")
+        start_date, end_date = parse_date_range(update.message.text)
+    except ValueError as e:
+        logger.info(f"Не удалось разобрать даты акции «{update.message.text}»: {e}")
         await update.message.reply_text(
-            "Пожалуйста, введите даты в формате:\n<b>с 4 по 28 июля 2025 года</b>",
+            f"{e}\nПожалуйста, введите даты в формате:\n<b>{FORMAT_HINT}</b>",
             parse_mode="HTML"
         )
         return PROMO_DATES
 
+    context.user_data["add_promotion"]["start_date"] = start_date.isoformat()
+    context.user_data["add_promotion"]["end_date"] = end_date.isoformat()
+
+    await update.message.reply_text("Отправьте изображение акции:")
+    return PROMO_PHOTO
+
 async def handle_add_promotion_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка фото акции"""
+    tenant = get_tenant(context)
     if not update.message.photo:
         await update.message.reply_text("Пожалуйста, отправьте изображение.")
         return PROMO_PHOTO
 
     photo_file = await update.message.photo[-1].get_file()
-    photo_path = f"photos/{update.message.photo[-1].file_id}.jpg"
+    photo_path = os.path.join(tenant.photos_dir, f"{update.message.photo[-1].file_id}.jpg")
     await photo_file.download_to_drive(photo_path)
 
     context.user_data["add_promotion"]["photo"] = photo_path
@@ -361,6 +361,7 @@ async def handle_add_promotion_photo(update: Update, context: ContextTypes.DEFAU
 
 async def handle_add_promotion_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка ссылки акции"""
+    tenant = get_tenant(context)
     link = update.message.text.strip()
     if not link.startswith(('http://', 'https://')):
         await update.message.reply_text("Ссылка должна начинаться с http:// или https://")
@@ -369,69 +370,82 @@ async def handle_add_promotion_link(update: Update, context: ContextTypes.DEFAUL
     context.user_data["add_promotion"]["link"] = link
     context.user_data["add_promotion"]["selected_shops"] = set()
 
-    # Кнопки магазинов + отправить во все
-    buttons = []
-    for cid, name in chat_ids.items():
-        buttons.append([InlineKeyboardButton(name, callback_data=f"shop_{cid}")])
-    buttons.append([
-        InlineKeyboardButton("📢 Отправить во все", callback_data="shop_all"),
-        InlineKeyboardButton("✅ Готово", callback_data="shops_done")
-    ])
-
+    # Кнопки групп, магазинов + отправить во все
     await update.message.reply_text(
-        "Выберите магазины, куда добавить акцию. Нажмите ✅ когда закончите:",
-        reply_markup=InlineKeyboardMarkup(buttons)
+        "Выберите магазины или группы, куда добавить акцию. Нажмите ✅ когда закончите:",
+        reply_markup=shop_selection_keyboard(tenant, set(), ADD_SHOP_ACTIONS, "📢 Отправить во все")
     )
     return PROMO_SHOPS
 
+def shop_selection_keyboard(tenant, selected, actions, all_label):
+    """Клавиатура выбора групп и магазинов. actions — коды (магазин, группа, все, готово)"""
+    shop_action, group_action, all_action, done_action = actions
+    buttons = []
+    for gid, group in tenant.shop_groups.groups.items():
+        mark = "✅ " if group_ref(gid) in selected else ""
+        buttons.append([InlineKeyboardButton(
+            f"{mark}👥 {group['name']} ({len(group['shops'])})", callback_data=pack(group_action, gid)
+        )])
+    for cid, name in tenant.chat_ids.items():
+        mark = "✅ " if cid in selected else ""
+        buttons.append([InlineKeyboardButton(f"{mark}{name}", callback_data=pack(shop_action, cid))])
+    mark = "✅ " if ALL_SHOPS in selected else ""
+    buttons.append([
+        InlineKeyboardButton(f"{mark}{all_label}", callback_data=pack(all_action)),
+        InlineKeyboardButton("✅ Готово", callback_data=pack(done_action))
+    ])
+    return InlineKeyboardMarkup(buttons)
+
+def toggle_target(targets, callback, all_action, group_action):
+    """Выбор или снятие выбора магазина, группы или «всех магазинов»"""
+    if callback.action == all_action:
+        target = ALL_SHOPS
+    elif callback.action == group_action:
+        target = group_ref(callback.args[0])
+    else:
+        target = str(callback.args[0])
+    if target in targets:
+        targets.remove(target)
+    elif isinstance(targets, set):
+        targets.add(target)
+    else:
+        targets.append(target)
+
 async def handle_shop_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка выбора магазинов"""
+    tenant = get_tenant(context)
     query = update.callback_query
     await query.answer()
-    data = query.data
+    callback = unpack(query.data)
 
     selected_shops = context.user_data["add_promotion"]["selected_shops"]
 
-    if data == "shops_done":
+    if callback.action == Action.SHOPS_DONE:
         if not selected_shops:
             await query.message.edit_text("Вы не выбрали ни одного магазина.")
             return PROMO_SHOPS
 
         # Завершаем добавление
-        promo_id = str(len(promotions) + 1)
-        promo = context.user_data["add_promotion"]
-        promo["shops"] = list(selected_shops)
-        promotions[promo_id] = promo
-        save_data(promotions)
+        promo_id = tenant.next_promo_id()
+        promo = context.user_data.pop("add_promotion")
+        tenant.set_targets(promo, list(promo.pop("selected_shops")))
+        tenant.promotions[promo_id] = promo
+        tenant.journal.put(promo_id, promo)
 
         await query.message.edit_text("✅ Акция успешно добавлена!")
-        await notify_about_new_promotion(context, promo)
+        status_message = await query.message.reply_text("⏳ Рассылка новой акции...")
+        notify_about_new_promotion(context, promo_id, promo, status_message)
         return ConversationHandler.END
 
-    # 📢 Обработка "отправить во все"
-    if data == "shop_all":
-        selected_shops.update(chat_ids.keys())
-
-    # Добавление/удаление конкретного магазина
-    elif data.startswith("shop_"):
-        shop_id = data.split("_")[1]
-        if shop_id in selected_shops:
-            selected_shops.remove(shop_id)
-        else:
-            selected_shops.add(shop_id)
+    # 📢 "Отправить во все" сохраняется ссылкой на все магазины, а не списком чатов,
+    # поэтому акция достанется и магазинам, зарегистрированным позже
+    toggle_target(selected_shops, callback, Action.SHOP_ALL, Action.SHOP_GROUP)
 
     # Обновляем интерфейс
-    buttons = []
-    for cid, name in chat_ids.items():
-        mark = "✅ " if cid in selected_shops else ""
-        buttons.append([InlineKeyboardButton(f"{mark}{name}", callback_data=f"shop_{cid}")])
-    buttons.append([
-        InlineKeyboardButton("📢 Отправить во все", callback_data="shop_all"),
-        InlineKeyboardButton("✅ Готово", callback_data="shops_done")
-    ])
-
     try:
-        await query.message.edit_reply_markup(reply_markup=InlineKeyboardMarkup(buttons))
+        await query.message.edit_reply_markup(
+            reply_markup=shop_selection_keyboard(tenant, selected_shops, ADD_SHOP_ACTIONS, "📢 Отправить во все")
+        )
     except Exception as e:
         logger.warning(f"Ошибка при обновлении клавиатуры: {e}")
 
@@ -439,23 +453,25 @@ async def handle_shop_selection(update: Update, context: ContextTypes.DEFAULT_TY
 
 async def cancel_add_promotion(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Отмена добавления акции"""
+    context.user_data.pop("add_promotion", None)
     await update.message.reply_text("Добавление акции отменено.")
     return ConversationHandler.END
 
 # Обработчики для удаления акций
 async def delete_promotion_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Начало удаления акции"""
+    tenant = get_tenant(context)
     user_id = update.effective_user.id
-    if user_id not in ADMIN_IDS:
+    if user_id not in tenant.admin_ids:
         await update.message.reply_text("Только администратор может удалять акции.")
         return
     
     keyboard = []
-    for pid, promo in promotions.items():
+    for pid, promo in tenant.promotions.items():
         keyboard.append(
             InlineKeyboardButton(
                 promo["name"], 
-                callback_data=f"delete_{pid}"
+                callback_data=pack(Action.DELETE, pid)
             )
         )
     
@@ -468,11 +484,12 @@ async def delete_promotion_start(update: Update, context: ContextTypes.DEFAULT_T
 
 async def handle_delete_promotion(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка выбора акции для удаления"""
+    tenant = get_tenant(context)
     query = update.callback_query
     await query.answer()
     
-    promo_id = query.data.split("_")[1]
-    promotion = promotions.get(promo_id)
+    promo_id = str(unpack(query.data).args[0])
+    promotion = tenant.promotions.get(promo_id)
     
     if not promotion:
         await query.edit_message_text("Акция не найдена.")
@@ -480,8 +497,8 @@ async def handle_delete_promotion(update: Update, context: ContextTypes.DEFAULT_
     
     keyboard = InlineKeyboardMarkup([
         [
-            InlineKeyboardButton("🗑 Удалить", callback_data=f"confirm_delete_{promo_id}"),
-            InlineKeyboardButton("Отмена", callback_data="cancel_delete")
+            InlineKeyboardButton("🗑 Удалить", callback_data=pack(Action.CONFIRM_DELETE, promo_id)),
+            InlineKeyboardButton("Отмена", callback_data=pack(Action.CANCEL_DELETE))
         ]
     ])
     
@@ -492,47 +509,141 @@ async def handle_delete_promotion(update: Update, context: ContextTypes.DEFAULT_
 
 async def confirm_delete_promotion(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Подтверждение удаления акции"""
+    tenant = get_tenant(context)
     query = update.callback_query
     await query.answer()
     
-    data = query.data
-    if data.startswith("confirm_delete"):
-        promo_id = data.split("_")[2]
+    callback = unpack(query.data)
+    if callback.action == Action.CONFIRM_DELETE:
+        promo_id = str(callback.args[0])
         
-        if promo_id in promotions:
-            # Удаляем файл с фото
-            photo_path = promotions[promo_id].get("photo")
-            if photo_path and os.path.exists(photo_path):
-                try:
-                    os.remove(photo_path)
-                except Exception as e:
-                    logger.error(f"Ошибка при удалении фото: {e}")
-            
-            # Удаляем акцию из базы
-            del promotions[promo_id]
-            save_data(promotions)
+        if promo_id in tenant.promotions:
+            # Фото остается на диске до истечения срока хранения истории,
+            # чтобы акцию можно было восстановить через /restore
+            del tenant.promotions[promo_id]
+            tenant.journal.delete(promo_id)
             
             await query.edit_message_text("Акция успешно удалена.")
         else:
             await query.edit_message_text("Акция уже удалена.")
-    elif data == "cancel_delete":
+    elif callback.action == Action.CANCEL_DELETE:
         await query.edit_message_text("Удаление отменено.")
 
+# Массовые изменения акций
+BULK_USAGE = (
+    "Использование:\n"
+    "/bulk extend <дней> <слова из названия|*> — продлить акции\n"
+    "/bulk delete name <слова из названия|*> — удалить акции по названию\n"
+    "/bulk delete link <часть ссылки> — удалить акции по ссылке\n"
+    "/bulk addshop <ID магазина|группа> <слова из названия|*> — добавить магазин в акции\n"
+    "/bulk removeshop <ID магазина|группа> [слова из названия] — убрать магазин из акций"
+)
+BULK_PREVIEW_LIMIT = 15
+
+def plan_bulk_operation(tenant, args):
+    """Разбор аргументов /bulk. Возвращает (операция, аргумент, ID акций, описание) или текст ошибки"""
+    if len(args) < 2:
+        return BULK_USAGE
+    op, rest = args[0].lower(), args[1:]
+
+    if op == bulk_edit.EXTEND:
+        if len(rest) < 2 or not rest[0].lstrip("-").isdigit() or int(rest[0]) == 0:
+            return BULK_USAGE
+        days = int(rest[0])
+        return op, days, bulk_edit.select_by_name(tenant, " ".join(rest[1:])), f"Продление на {days} дн."
+
+    if op == bulk_edit.DELETE:
+        if len(rest) < 2 or rest[0] not in ("name", "link"):
+            return BULK_USAGE
+        query = " ".join(rest[1:])
+        if rest[0] == "name":
+            return op, None, bulk_edit.select_by_name(tenant, query), "Удаление"
+        return op, None, bulk_edit.select_by_link(tenant, query), "Удаление"
+
+    if op in (bulk_edit.ADD_SHOP, bulk_edit.REMOVE_SHOP):
+        target = bulk_edit.resolve_target(tenant, rest[0])
+        if target is None:
+            return f"Магазин или группа «{rest[0]}» не найдены."
+        label = tenant.shop_groups.label(target, tenant.chat_ids)
+        targeted = bulk_edit.select_by_target(tenant, target)
+        if op == bulk_edit.ADD_SHOP:
+            if len(rest) < 2:
+                return BULK_USAGE
+            return op, target, bulk_edit.select_by_name(tenant, " ".join(rest[1:])) - targeted, f"Добавление: {label}"
+        if len(rest) > 1:
+            targeted &= bulk_edit.select_by_name(tenant, " ".join(rest[1:]))
+        return op, target, targeted, f"Удаление из адресатов: {label}"
+
+    return BULK_USAGE
+
+async def bulk_promotions(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Массовое изменение акций с предпросмотром: /bulk"""
+    tenant = get_tenant(context)
+    if update.effective_user.id not in tenant.admin_ids:
+        await update.message.reply_text("Только администратор может изменять акции.")
+        return
+
+    plan = plan_bulk_operation(tenant, context.args or [])
+    if isinstance(plan, str):
+        await update.message.reply_text(plan)
+        return
+    op, arg, promo_ids, title = plan
+    if not promo_ids:
+        await update.message.reply_text("Под условие не попала ни одна акция.")
+        return
+
+    promo_ids = sorted(promo_ids, key=int)
+    context.user_data["bulk"] = {"op": op, "arg": arg, "promo_ids": promo_ids}
+    names = [f"• {tenant.promotions[pid]['name']}" for pid in promo_ids[:BULK_PREVIEW_LIMIT]]
+    if len(promo_ids) > BULK_PREVIEW_LIMIT:
+        names.append(f"...и еще {len(promo_ids) - BULK_PREVIEW_LIMIT}")
+    keyboard = InlineKeyboardMarkup([[
+        InlineKeyboardButton("✅ Применить", callback_data=pack(Action.BULK_CONFIRM)),
+        InlineKeyboardButton("Отмена", callback_data=pack(Action.BULK_CANCEL))
+    ]])
+    if op == bulk_edit.EXTEND and arg < 0:
+        clamped = bulk_edit.clamped_by_extend(tenant, promo_ids, arg)
+        if clamped:
+            names.append(f"⚠️ Окончание станет равным дате начала у акций: {len(clamped)}")
+    await update.message.reply_text(
+        f"{title}. Будет изменено акций: {len(promo_ids)}\n" + "\n".join(names),
+        reply_markup=keyboard
+    )
+
+async def confirm_bulk_promotions(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Подтверждение массового изменения: все изменения пишутся в журнал одной записью"""
+    tenant = get_tenant(context)
+    query = update.callback_query
+    await query.answer()
+
+    plan = context.user_data.pop("bulk", None)
+    if unpack(query.data).action == Action.BULK_CANCEL:
+        await query.edit_message_text("Массовое изменение отменено.")
+        return
+    if update.effective_user.id not in tenant.admin_ids or not plan:
+        await query.edit_message_text("Изменение устарело, повторите команду /bulk.")
+        return
+
+    changed = bulk_edit.apply(tenant, plan["op"], plan["promo_ids"], plan["arg"])
+    logger.info(f"[{tenant.name}] Массовое изменение {plan['op']} {plan['arg']}: акций {changed}")
+    await query.edit_message_text(f"✅ Изменено акций: {changed}.")
+
 async def start_manual_promo_sending(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = get_tenant(context)
     user_id = update.effective_user.id
-    if user_id not in ADMIN_IDS:
+    if user_id not in tenant.admin_ids:
         await update.message.reply_text("Только администратор может рассылать акции.")
         return ConversationHandler.END
 
-    if not promotions:
+    if not tenant.promotions:
         await update.message.reply_text("Нет доступных акций для рассылки.")
         return ConversationHandler.END
 
     context.user_data["promo_sending"] = {}
 
     keyboard = [
-        [InlineKeyboardButton(promo["name"], callback_data=f"sendpromo_{pid}")]
-        for pid, promo in promotions.items()
+        [InlineKeyboardButton(promo["name"], callback_data=pack(Action.SEND_PROMO, pid))]
+        for pid, promo in tenant.promotions.items()
     ]
     await update.message.reply_text(
         "Выберите акцию для ручной рассылки:",
@@ -543,17 +654,18 @@ async def start_manual_promo_sending(update: Update, context: ContextTypes.DEFAU
 # Обработчики для редактирования акций
 async def edit_promotion_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Начало редактирования акции"""
+    tenant = get_tenant(context)
     user_id = update.effective_user.id
-    if user_id not in ADMIN_IDS:
+    if user_id not in tenant.admin_ids:
         await update.message.reply_text("Только администратор может редактировать акции.")
         return ConversationHandler.END
 
     keyboard = []
-    for pid, promo in promotions.items():
+    for pid, promo in tenant.promotions.items():
         keyboard.append(
             InlineKeyboardButton(
                 promo["name"], 
-                callback_data=f"edit_{pid}"
+                callback_data=pack(Action.EDIT, pid)
             )
         )
     
@@ -567,11 +679,12 @@ async def edit_promotion_start(update: Update, context: ContextTypes.DEFAULT_TYP
 
 
 async def handle_select_promo_for_sending(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = get_tenant(context)
     query = update.callback_query
     await query.answer()
 
-    promo_id = query.data.split("_")[1]
-    if promo_id not in promotions:
+    promo_id = str(unpack(query.data).args[0])
+    if promo_id not in tenant.promotions:
         await query.edit_message_text("Акция не найдена.")
         return ConversationHandler.END
 
@@ -581,12 +694,12 @@ async def handle_select_promo_for_sending(update: Update, context: ContextTypes.
     }
 
     buttons = []
-    for cid, name in chat_ids.items():
-        buttons.append([InlineKeyboardButton(name, callback_data=f"sendshop_{cid}")])
+    for cid, name in tenant.chat_ids.items():
+        buttons.append([InlineKeyboardButton(name, callback_data=pack(Action.SEND_SHOP, cid))])
 
     buttons.append([
-        InlineKeyboardButton("📢 Отправить во все", callback_data="sendshops_all"),
-        InlineKeyboardButton("✅ Готово", callback_data="sendshops_done")
+        InlineKeyboardButton("📢 Отправить во все", callback_data=pack(Action.SEND_ALL)),
+        InlineKeyboardButton("✅ Готово", callback_data=pack(Action.SEND_DONE))
     ])
 
     await query.edit_message_text(
@@ -596,56 +709,37 @@ async def handle_select_promo_for_sending(update: Update, context: ContextTypes.
     return SELECT_SHOPS_FOR_SENDING
 
 async def handle_shop_selection_for_sending(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = get_tenant(context)
     query = update.callback_query
     await query.answer()
 
-    data = query.data
+    callback = unpack(query.data)
     promo_id = context.user_data["promo_sending"]["promo_id"]
     selected = context.user_data["promo_sending"]["selected_shops"]
 
-    if data == "sendshops_done":
-        if not selected:
+    if callback.action in (Action.SEND_DONE, Action.SEND_ALL):
+        if callback.action == Action.SEND_DONE and not selected:
             await query.edit_message_text("Не выбрано ни одного магазина.")
             return SELECT_SHOPS_FOR_SENDING
 
-        # Отправка акции в выбранные магазины
-        promo = promotions[promo_id]
-        for cid in selected:
-            try:
-                with open(promo["photo"], "rb") as photo:
-                    await context.bot.send_photo(
-                        chat_id=cid,
-                        photo=photo,
-                        caption=f"📣 Акция: {promo['name']}\n📅 Даты: {promo['start_date']} — {promo['end_date']}",
-                        parse_mode="HTML"
-                    )
-            except Exception as e:
-                logger.error(f"Ошибка при отправке в {cid}: {e}")
-
-        await query.edit_message_text("✅ Акция успешно отправлена выбранным магазинам.")
-        return ConversationHandler.END
-
-    elif data == "sendshops_all":
-        # Выбираем все магазины и сразу отправляем
-        promo = promotions[promo_id]
-        for cid in chat_ids.keys():
-            try:
-                with open(promo["photo"], "rb") as photo:
-                    await context.bot.send_photo(
-                        chat_id=int(cid),  # 👈 приведение к int
-                        photo=photo,
-                        caption=f"📣 Акция: {promo['name']}\n📅 Даты: {promo['start_date']} — {promo['end_date']}",
-                        parse_mode="HTML"
-                    )
-            except Exception as e:
-                logger.error(f"Ошибка при отправке в {cid}: {e}")
-
-        await query.edit_message_text("✅ Акция успешно отправлена во все магазины.")
+        context.user_data.pop("promo_sending", None)
+        promo = tenant.promotions.get(promo_id)
+        if not promo:
+            await query.edit_message_text("Акция не найдена.")
+            return ConversationHandler.END
+
+        # Рассылка идет в фоне, ход показывается в этом же сообщении
+        chat_ids = list(selected) if callback.action == Action.SEND_DONE else list(tenant.chat_ids)
+        start_broadcast(
+            context, f"Акция «{promo['name']}»", chat_ids,
+            lambda cid: send_promotion(context, cid, promo_id, promo, kind="manual"),
+            status_message=query.message
+        )
         return ConversationHandler.END
 
     else:
         # Обработка выбора конкретного магазина
-        shop_id = data.split("_")[1]
+        shop_id = str(callback.args[0])
         if shop_id in selected:
             selected.remove(shop_id)
         else:
@@ -653,12 +747,12 @@ async def handle_shop_selection_for_sending(update: Update, context: ContextType
 
     # Обновляем интерфейс
     buttons = []
-    for cid, name in chat_ids.items():
+    for cid, name in tenant.chat_ids.items():
         mark = "✅ " if cid in selected else ""
-        buttons.append([InlineKeyboardButton(f"{mark}{name}", callback_data=f"sendshop_{cid}")])
+        buttons.append([InlineKeyboardButton(f"{mark}{name}", callback_data=pack(Action.SEND_SHOP, cid))])
 
-    buttons.append([InlineKeyboardButton("📢 Отправить во все", callback_data="sendshops_all")])
-    buttons.append([InlineKeyboardButton("✅ Готово", callback_data="sendshops_done")])
+    buttons.append([InlineKeyboardButton("📢 Отправить во все", callback_data=pack(Action.SEND_ALL))])
+    buttons.append([InlineKeyboardButton("✅ Готово", callback_data=pack(Action.SEND_DONE))])
 
     try:
         await query.message.edit_reply_markup(reply_markup=InlineKeyboardMarkup(buttons))
@@ -667,63 +761,65 @@ async def handle_shop_selection_for_sending(update: Update, context: ContextType
 
     return SELECT_SHOPS_FOR_SENDING
 
+async def cancel_promo_sending(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отмена ручной рассылки акции"""
+    context.user_data.pop("promo_sending", None)
+    await update.message.reply_text("Рассылка отменена.")
+    return ConversationHandler.END
+
 async def handle_edit_promotion_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка выбора акции для редактирования"""
+    tenant = get_tenant(context)
     query = update.callback_query
     await query.answer()
-    promo_id = query.data.split("_")[1]
-    promotion = promotions.get(promo_id)
+    promo_id = str(unpack(query.data).args[0])
+    promotion = tenant.promotions.get(promo_id)
     
     if not promotion:
         await query.edit_message_text("Акция не найдена.")
         return ConversationHandler.END
 
-    context.user_data["edit_promotion"] = {"promo_id": promo_id}
-    current_shops = "\n".join([chat_ids.get(cid, "Неизвестный магазин") for cid in promotion.get("shops", [])])
-    
-    buttons = []
-    for cid, name in chat_ids.items():
-        mark = "✅ " if cid in promotion.get("shops", []) else ""
-        buttons.append([InlineKeyboardButton(f"{mark}{name}", callback_data=f"edit_shop_{cid}")])
-    buttons.append([InlineKeyboardButton("✅ Готово", callback_data="edit_shops_done")])
+    # Правка идет над копией адресатов, в акцию она попадает по ✅ Готово
+    targets = tenant.target_list(promo_id)
+    context.user_data["edit_promotion"] = {"promo_id": promo_id, "targets": targets}
+    current_shops = "\n".join(tenant.shop_groups.label(target, tenant.chat_ids) for target in targets)
 
     await query.edit_message_text(
         f"Текущие магазины для акции '{promotion['name']}':\n{current_shops}\n\n"
-        "Выберите магазины для изменения:"
+        "Выберите магазины или группы для изменения:"
+    )
+    await query.message.edit_reply_markup(
+        reply_markup=shop_selection_keyboard(tenant, targets, EDIT_SHOP_ACTIONS, "📢 Все магазины")
     )
-    await query.message.edit_reply_markup(reply_markup=InlineKeyboardMarkup(buttons))
     return EDIT_SHOP_SELECTION
 
 async def handle_edit_shop_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка изменения списка магазинов"""
+    tenant = get_tenant(context)
     query = update.callback_query
     await query.answer()
-    data = query.data
+    callback = unpack(query.data)
 
     promo_id = context.user_data["edit_promotion"]["promo_id"]
-    promotion = promotions[promo_id]
+    targets = context.user_data["edit_promotion"]["targets"]
+    promotion = tenant.promotions.get(promo_id)
+    if not promotion:
+        context.user_data.pop("edit_promotion", None)
+        await query.edit_message_text("Акция не найдена.")
+        return ConversationHandler.END
 
-    if data == "edit_shops_done":
+    if callback.action == Action.EDIT_DONE:
+        context.user_data.pop("edit_promotion", None)
+        tenant.journal.patch(promo_id, {"targets": tenant.set_targets(promotion, targets)})
         await query.edit_message_text("✅ Список магазинов успешно обновлен!")
-        save_data(promotions)
         return ConversationHandler.END
 
-    shop_id = data.split("_")[2]
-    shops = promotion.setdefault("shops", [])
-    
-    if shop_id in shops:
-        shops.remove(shop_id)
-    else:
-        shops.append(shop_id)
-
-    buttons = []
-    for cid, name in chat_ids.items():
-        mark = "✅ " if cid in promotion.get("shops", []) else ""
-        buttons.append([InlineKeyboardButton(f"{mark}{name}", callback_data=f"edit_shop_{cid}")])
-    buttons.append([InlineKeyboardButton("✅ Готово", callback_data="edit_shops_done")])
+    toggle_target(targets, callback, Action.EDIT_ALL, Action.EDIT_GROUP)
 
     try:
-        await query.message.edit_reply_markup(reply_markup=InlineKeyboardMarkup(buttons))
+        await query.message.edit_reply_markup(
+            reply_markup=shop_selection_keyboard(tenant, targets, EDIT_SHOP_ACTIONS, "📢 Все магазины")
+        )
     except Exception as e:
         logger.warning(f"Ошибка при обновлении клавиатуры: {e}")
 
@@ -731,48 +827,436 @@ async def handle_edit_shop_selection(update: Update, context: ContextTypes.DEFAU
 
 async def cancel_edit_promotion(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Отмена редактирования акции"""
+    context.user_data.pop("edit_promotion", None)
     await update.message.reply_text("Редактирование отменено.")
     return ConversationHandler.END
 
+# Массовый импорт и экспорт
+async def import_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Начало массового импорта акций и магазинов"""
+    tenant = get_tenant(context)
+    user_id = update.effective_user.id
+    if user_id not in tenant.admin_ids:
+        await update.message.reply_text("Только администратор может импортировать акции.")
+        return ConversationHandler.END
+
+    await update.message.reply_text(
+        "Отправьте файл CSV, JSON или JSONL.\n"
+        "Поля акции: name, start_date, end_date, link, photo (ссылка или путь), shops.\n"
+        "В shops: ID чатов, * — все магазины, group:<id> — группа из /groups.\n"
+        "Поля магазина: chat_id, name.\n"
+        "Для отмены используйте /cancel."
+    )
+    return IMPORT_FILE
+
+async def handle_import_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Разбор, проверка и пакетное сохранение импортируемого файла"""
+    tenant = get_tenant(context)
+    document = update.message.document
+    tg_file = await document.get_file()
+    content = await tg_file.download_as_bytearray()
+    stream = io.TextIOWrapper(io.BytesIO(content), encoding="utf-8-sig", newline="")
+
+    new_shops = {}
+    new_promotions = []
+    errors = []
+    try:
+        for line_no, record in bulk_io.iter_records(stream, document.file_name or ""):
+            try:
+                if bulk_io.is_shop_record(record):
+                    shop_id, name = bulk_io.validate_shop(record)
+                    new_shops[shop_id] = name
+                else:
+                    new_promotions.append((line_no, bulk_io.validate_promotion(record)))
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                errors.append(f"запись {line_no}: {e}")
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        errors.append(f"Не удалось разобрать файл: {e}")
+
+    known_shops = tenant.chat_ids.keys() | new_shops.keys()
+    for line_no, promo in new_promotions:
+        unknown = [
+            target for target in promo["shops"]
+            if not (tenant.shop_groups.exists(target) if is_ref(target) else target in known_shops)
+        ]
+        if unknown:
+            errors.append(f"запись {line_no}: неизвестные магазины {', '.join(unknown)}")
+
+    if not errors and not new_shops and not new_promotions:
+        errors.append("Файл не содержит записей")
+
+    if not errors:
+        urls = [p["photo"] for _, p in new_promotions if p["photo"].startswith(("http://", "https://"))]
+        if urls:
+            paths, photo_errors = await bulk_io.fetch_photos(
+                urls, concurrency=IMPORT_PHOTO_CONCURRENCY, photos_dir=tenant.photos_dir
+            )
+            errors.extend(f"фото {url}: {error}" for url, error in photo_errors.items())
+            for _, promo in new_promotions:
+                promo["photo"] = paths.get(promo["photo"], promo["photo"])
+
+    if errors:
+        shown = "\n".join(errors[:20])
+        more = f"\n...и еще {len(errors) - 20}" if len(errors) > 20 else ""
+        await update.message.reply_text(
+            f"Импорт отменен, ничего не сохранено:\n{shown}{more}\n\n"
+            "Отправьте исправленный файл или /cancel."
+        )
+        return IMPORT_FILE
+
+    # Все изменения сохраняются одной записью
+    if new_shops:
+        tenant.chat_ids.update(new_shops)
+        tenant.save_chat_ids()
+    records = []
+    for _, promo in new_promotions:
+        promo_id = promo.pop("id", None) or tenant.next_promo_id()
+        tenant.set_targets(promo, promo.pop("shops"))
+        tenant.promotions[promo_id] = promo
+        records.append(tenant.journal.record("put", promo_id, promo, reason="import"))
+    if records:
+        tenant.journal.append(records)
+
+    logger.info(f"Импортировано акций: {len(new_promotions)}, магазинов: {len(new_shops)}")
+    await update.message.reply_text(
+        f"✅ Импорт завершен. Акций: {len(new_promotions)}, магазинов: {len(new_shops)}."
+    )
+    return ConversationHandler.END
+
+async def cancel_import(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отмена импорта"""
+    await update.message.reply_text("Импорт отменен.")
+    return ConversationHandler.END
+
+async def export_catalog(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выгрузка акций и магазинов файлом: /export [jsonl|csv]"""
+    tenant = get_tenant(context)
+    user_id = update.effective_user.id
+    if user_id not in tenant.admin_ids:
+        await update.message.reply_text("Только администратор может выгружать акции.")
+        return
+
+    fmt = context.args[0].lower() if context.args else "jsonl"
+    if fmt == "jsonl":
+        lines = bulk_io.export_jsonl(tenant.promotions, tenant.chat_ids, shops_of=tenant.target_list)
+        filename = "catalog.jsonl"
+    elif fmt == "csv":
+        lines, filename = bulk_io.export_csv(tenant.promotions, shops_of=tenant.target_list), "promotions.csv"
+    else:
+        await update.message.reply_text("Использование: /export [jsonl|csv]")
+        return
+
+    buffer = io.BytesIO()
+    for line in lines:
+        buffer.write(line.encode("utf-8"))
+    buffer.seek(0)
+    await update.message.reply_document(document=buffer, filename=filename)
+
 # Уведомления
-async def notify_about_new_promotion(context: ContextTypes.DEFAULT_TYPE, promotion):
-    """Уведомление о новой акции"""
-    for chat_id in promotion.get("shops", []):
+def read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+async def send_promo_photo(bot, chat_id, promo, caption, lane=Lane.INTERACTIVE):
+    """Отправка фото акции по file_id из кэша, а при его отсутствии — загрузкой файла"""
+    path = promo["photo"]
+    rate_limit_args = {"lane": lane}
+    file_id = photo_cache.get(bot.id, path)
+    if file_id:
         try:
-            with open(promotion["photo"], "rb") as photo:
-                await context.bot.send_photo(
-                    chat_id=chat_id, 
-                    photo=photo, 
-                    caption = (
-                        f"📣 Новая акция: {promotion['name']}\n"
-                        f"📅 Даты проведения: {promotion['start_date']} — {promotion['end_date']}"
-                    ),
-                    parse_mode="HTML"
-                )
+            return await bot.send_photo(
+                chat_id=chat_id, photo=file_id, caption=caption, parse_mode="HTML",
+                rate_limit_args=rate_limit_args
+            )
+        except BadRequest as e:
+            if "file" not in str(e).lower():
+                raise
+            photo_cache.discard(bot.id, path)
+
+    # Файл читается в отдельном потоке, чтобы не блокировать цикл событий
+    photo = await asyncio.to_thread(read_file, path)
+    message = await bot.send_photo(
+        chat_id=chat_id, photo=photo, caption=caption, parse_mode="HTML", rate_limit_args=rate_limit_args
+    )
+    photo_cache.put(bot.id, path, message.photo[-1].file_id)
+    return message
+
+# Не больше стольких акций перечисляется в одном сводном уведомлении
+SUMMARY_MAX_ITEMS = 50
+
+# Полоса исходящих запросов для каждого вида рассылки
+SEND_LANES = {"manual": Lane.ADMIN, "new": Lane.ADMIN, "digest": Lane.DIGEST, "expiring": Lane.DIGEST}
+
+def promo_caption(promo, kind):
+    """Подпись фото акции для вида рассылки"""
+    if kind == "new":
+        return f"📣 Новая акция: {promo['name']}\n📅 Даты проведения: {promo['start_date']} — {promo['end_date']}"
+    if kind == "expiring":
+        return (
+            f"⚠️ Внимание! Акция '{promo['name']}' завершается через 3 дня!\n"
+            f"📅 Последний день: {promo['end_date']}"
+        )
+    if kind == "manual":
+        return f"📣 Акция: {promo['name']}\n📅 Даты: {promo['start_date']} — {promo['end_date']}"
+    return f"📣 Акция: {promo['name']}\n📅 Даты проведения: {promo['start_date']} — {promo['end_date']}"
+
+async def send_promotion(context: ContextTypes.DEFAULT_TYPE, chat_id, promo_id, promo, kind):
+    """Отправка акции в чат не чаще одного раза в день для каждого вида рассылки"""
+    tenant = get_tenant(context)
+    if not tenant.chat_health.is_available(chat_id):
+        return False
+
+    key = tenant.delivery_ledger.key(chat_id, promo_id, kind, tenant.delivery_day(chat_id).isoformat())
+    if not tenant.delivery_ledger.claim(key):
+        send_logger.info(
+            f"Акция {promo_id} ({kind}) уже отправлена в чат {chat_id} сегодня, пропуск",
+            extra={"chat_id": chat_id, "promo_id": promo_id, "kind": kind}
+        )
+        return False
+
+    try:
+        message = await send_promo_photo(context.bot, chat_id, promo, promo_caption(promo, kind), SEND_LANES[kind])
+    except ChatMigrated as e:
+        tenant.delivery_ledger.release(key)
+        tenant.migrate_chat(chat_id, e.new_chat_id)
+        return await send_promotion(context, e.new_chat_id, promo_id, promo, kind)
+    except Forbidden as e:
+        tenant.delivery_ledger.release(key)
+        tenant.record_chat_failure(chat_id, e)
+        return False
+    except BadRequest as e:
+        tenant.delivery_ledger.release(key)
+        if "chat not found" in str(e).lower():
+            tenant.record_chat_failure(chat_id, e)
+            return False
+        raise
+    except Exception:
+        tenant.delivery_ledger.release(key)
+        raise
+
+    tenant.chat_health.record_success(chat_id)
+    tenant.delivery_ledger.confirm(key)
+    tenant.sent_messages.add(promo_id, chat_id, message.message_id, kind)
+    return True
+
+# Правка и отзыв уже разосланных акций
+async def update_sent_message(bot, tenant, chat_id, message_id, promo, kind):
+    """Новая подпись разосланного фото, а для удаленной акции (promo=None) — удаление сообщения"""
+    lane = {"lane": Lane.ADMIN}
+    try:
+        if promo is None:
+            await bot.delete_message(chat_id=chat_id, message_id=message_id, rate_limit_args=lane)
+            return True
+        # Предупреждение «завершается через 3 дня» после изменения дат заменяется обычной подписью
+        caption = promo_caption(promo, "digest" if kind == "expiring" else kind)
+        await bot.edit_message_caption(
+            chat_id=chat_id, message_id=message_id, caption=caption, parse_mode="HTML", rate_limit_args=lane
+        )
+        return True
+    except BadRequest as e:
+        if "not modified" in str(e).lower():
+            return True
+        # Сообщение уже удалено в чате или его больше нельзя изменить
+        tenant.sent_messages.forget(chat_id, message_id)
+        send_logger.info(f"Сообщение {message_id} в чате {chat_id} не изменено: {e}")
+    except Forbidden:
+        tenant.sent_messages.forget(chat_id, message_id)
+    except Exception as e:
+        send_logger.warning(f"Ошибка при изменении сообщения {message_id} в чате {chat_id}: {e}")
+    return False
+
+async def sync_sent_messages(context: ContextTypes.DEFAULT_TYPE):
+    """Перенос изменений каталога в разосланные сообщения"""
+    tenant = get_tenant(context)
+    semaphore = asyncio.Semaphore(SENT_SYNC_CONCURRENCY)
+
+    async def run(*args):
+        async with semaphore:
+            return await update_sent_message(context.bot, tenant, *args)
+
+    for promo_id in tenant.sent_messages.pop_dirty():
+        messages = tenant.sent_messages.messages(promo_id)
+        if not messages:
+            continue
+        promo = tenant.promotions.get(promo_id)
+        results = await asyncio.gather(*(
+            run(chat_id, message_id, promo, kind) for chat_id, message_id, kind in messages
+        ))
+        if promo is None:
+            for chat_id, message_id, _ in messages:
+                tenant.sent_messages.forget(chat_id, message_id)
+        logger.info(
+            f"Акция {promo_id} {'изменена' if promo else 'отозвана'} в разосланных сообщениях: "
+            f"{sum(results)} из {len(messages)}"
+        )
+
+async def prune_sent_messages(context: ContextTypes.DEFAULT_TYPE):
+    """Удаление из индекса сообщений, которые бот уже не может удалить"""
+    tenant = get_tenant(context)
+    removed = tenant.sent_messages.prune(SENT_MESSAGE_RETENTION)
+    if removed:
+        logger.info(f"Из индекса разосланных сообщений удалено записей: {removed}")
+
+def notify_about_new_promotion(context: ContextTypes.DEFAULT_TYPE, promo_id, promotion, status_message=None):
+    """Уведомление о новой акции фоновой рассылкой"""
+    tenant = get_tenant(context)
+    return start_broadcast(
+        context, f"Новая акция «{promotion['name']}»", tenant.promo_chats(promo_id),
+        lambda cid: send_promotion(context, cid, promo_id, promotion, kind="new"),
+        status_message=status_message
+    )
+
+# Фоновые рассылки
+def broadcast_keyboard(broadcast):
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("⛔ Остановить", callback_data=pack(Action.BROADCAST_CANCEL, broadcast.id))
+    ]])
+
+def start_broadcast(context: ContextTypes.DEFAULT_TYPE, title, chat_ids, send, status_message=None):
+    """Запуск рассылки отдельной задачей. Ход показывается в status_message, если оно задано"""
+    broadcast = Broadcast(title, chat_ids)
+    if status_message is not None:
+        broadcast.status = (status_message.chat_id, status_message.message_id)
+    context.application.create_task(run_broadcast(context, broadcast, send))
+    return broadcast
+
+async def run_broadcast(context: ContextTypes.DEFAULT_TYPE, broadcast, send):
+    """Выполнение рассылки с периодическим обновлением хода и итоговым отчетом"""
+    tenant = get_tenant(context)
+    tenant.broadcasts[broadcast.id] = broadcast
+    progress = None
+    if broadcast.status:
+        await edit_broadcast_status(context.bot, broadcast, broadcast.progress_text(), broadcast_keyboard(broadcast))
+        progress = asyncio.create_task(report_broadcast_progress(context.bot, broadcast))
+    try:
+        await broadcast.run(send, BROADCAST_CONCURRENCY)
+    finally:
+        tenant.broadcasts.pop(broadcast.id, None)
+        if progress:
+            progress.cancel()
+        report = broadcast.report_text(tenant.chat_ids)
+        send_logger.info(report.replace("\n", "; "), extra={"broadcast": broadcast.id})
+        if broadcast.status:
+            await edit_broadcast_status(context.bot, broadcast, report)
+    return broadcast
+
+async def report_broadcast_progress(bot, broadcast):
+    while not broadcast.finished:
+        await asyncio.sleep(BROADCAST_PROGRESS_INTERVAL)
+        await edit_broadcast_status(bot, broadcast, broadcast.progress_text(), broadcast_keyboard(broadcast))
+
+async def edit_broadcast_status(bot, broadcast, text, reply_markup=None):
+    chat_id, message_id = broadcast.status
+    try:
+        # Сообщение администратору не должно стоять в очереди за самой рассылкой
+        await bot.edit_message_text(
+            chat_id=chat_id, message_id=message_id, text=text, reply_markup=reply_markup,
+            rate_limit_args={"lane": Lane.INTERACTIVE}
+        )
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            logger.warning(f"Не удалось обновить ход рассылки {broadcast.id}: {e}")
+    except Exception as e:
+        logger.warning(f"Не удалось обновить ход рассылки {broadcast.id}: {e}")
+
+async def cancel_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопка «Остановить» под ходом рассылки"""
+    tenant = get_tenant(context)
+    query = update.callback_query
+    if update.effective_user.id not in tenant.admin_ids:
+        await query.answer("Только администратор может останавливать рассылки.")
+        return
+    broadcast = tenant.broadcasts.get(unpack(query.data).args[0])
+    if not broadcast:
+        await query.answer("Рассылка уже завершена.")
+        return
+    broadcast.cancel()
+    logger.info(f"Рассылка {broadcast.id} ({broadcast.title}) остановлена администратором {update.effective_user.id}")
+    if broadcast.scheduled:
+        # Плановую рассылку никто не доводит до конца: снимаем ее задачи и подводим итог сразу
+        for job in context.job_queue.jobs():
+            if isinstance(job.data, dict) and job.data.get("broadcast") == broadcast.id:
+                job.schedule_removal()
+        finish_scheduled_broadcast(tenant, broadcast)
+    await query.answer("Рассылка останавливается...")
+
+async def list_broadcasts(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Идущие рассылки, в том числе ежедневные, с кнопками остановки: /broadcasts"""
+    tenant = get_tenant(context)
+    if update.effective_user.id not in tenant.admin_ids:
+        await update.message.reply_text("Только администратор может смотреть рассылки.")
+        return
+    if not tenant.broadcasts:
+        await update.message.reply_text("Сейчас рассылок нет.")
+        return
+    for broadcast in list(tenant.broadcasts.values()):
+        await update.message.reply_text(broadcast.progress_text(), reply_markup=broadcast_keyboard(broadcast))
+
+def finish_scheduled_broadcast(tenant, broadcast):
+    if tenant.broadcasts.pop(broadcast.id, None) is not None:
+        send_logger.info(broadcast.report_text(tenant.chat_ids).replace("\n", "; "), extra={"broadcast": broadcast.id})
+
+def scheduled_broadcast_job(send):
+    """Задача отправки в один чат плановой рассылки: результат send(context)
+    учитывается в рассылке job.data["broadcast"], остановленная рассылка не отправляется"""
+    async def job(context: ContextTypes.DEFAULT_TYPE):
+        tenant = get_tenant(context)
+        broadcast = tenant.broadcasts.get(context.job.data["broadcast"])
+        if broadcast is None or broadcast.cancelled:
+            return
+        chat_id = context.job.data["chat_id"]
+        try:
+            broadcast.record(chat_id, await send(context))
         except Exception as e:
-            logger.warning(f"Ошибка отправки в чат {chat_id}: {e}")
+            logger.error(f"Ошибка плановой рассылки в чат {chat_id}: {e}")
+            broadcast.record(chat_id, False, str(e))
+        if broadcast.finished:
+            finish_scheduled_broadcast(tenant, broadcast)
+    return job
 
 import random  # Убедись, что этот импорт есть вверху файла
 
 import random
 
 async def notify_about_active_promotions(context: ContextTypes.DEFAULT_TYPE):
-    moscow_tz = pytz.timezone("Europe/Moscow")
-    now = datetime.now(moscow_tz)
-    logger.info(f"Запуск пятничной рассылки акций в {now.strftime('%Y-%m-%d %H:%M:%S')}")
-
-    active_promotions = {pid: p for pid, p in promotions.items() if is_promotion_active(p)}
+    """Ежедневная рассылка акций в чаты одного часового пояса"""
+    tenant = get_tenant(context)
+    tz_name = context.job.data if context.job and context.job.data else DEFAULT_TIMEZONE
+    now = datetime.now(pytz.timezone(tz_name))
+    logger.info(f"Запуск рассылки акций для пояса {tz_name} в {now.strftime('%Y-%m-%d %H:%M:%S')}")
+
+    today = local_today(tz_name)
+    active_promotions = {pid: p for pid, p in tenant.promotions.items() if is_promotion_active(p, today)}
     logger.info(f"Найдено активных акций: {len(active_promotions)}")
 
-    # Собираем доступные акции по магазинам
+    # Собираем доступные акции по магазинам этого пояса
     shop_to_promos = {}
+    ref_mask = tenant.ref_resolver()
     for pid, promo in active_promotions.items():
-        for shop_id in promo.get("shops", []):
-            shop_to_promos.setdefault(shop_id, []).append((pid, promo))
+        for shop_id in tenant.promo_chats(pid, ref_mask):
+            if tenant.chat_timezone(shop_id) == tz_name:
+                shop_to_promos.setdefault(shop_id, []).append((pid, promo))
+
+    # Чаты с закрепленной подборкой получают правку одного сообщения, и только если подборка изменилась
+    pinned_plan = {}
+    for chat_id in tenant.chat_ids:
+        if tenant.chat_timezone(chat_id) != tz_name or tenant.digest_mode(chat_id) != "pinned":
+            continue
+        promo_list = shop_to_promos.pop(chat_id, [])
+        if not tenant.chat_health.is_available(chat_id):
+            continue
+        promo_ids = sorted((pid for pid, _ in promo_list), key=int)
+        if pinned_digest_hash(tenant, promo_ids) != tenant.pinned_digest(chat_id).get("hash"):
+            pinned_plan[chat_id] = promo_ids
+    pinned_offsets = plan_offsets({cid: 1 for cid in pinned_plan}, DIGEST_WINDOW_SECONDS)
 
     used_promos = set()  # ID акций, уже отправленных в других чаты
+    plan = {}
 
     for chat_id, promo_list in shop_to_promos.items():
+        if not tenant.chat_health.is_available(chat_id):
+            continue
+
         available = [p for p in promo_list if p[0] not in used_promos]
 
         # Если есть хотя бы 3 уникальные — берем из них
@@ -786,33 +1270,293 @@ async def notify_about_active_promotions(context: ContextTypes.DEFAULT_TYPE):
             if others:
                 selected += random.sample(others, min(remaining_needed, len(others)))
 
-        # Отправляем акции
-        for pid, promo in selected:
+        plan[chat_id] = [pid for pid, _ in selected]
+        used_promos.update(plan[chat_id])
+
+    # Отправки равномерно распределяются по окну рассылки, а не уходят все разом
+    offsets = plan_offsets({cid: len(pids) for cid, pids in plan.items()}, DIGEST_WINDOW_SECONDS)
+
+    # Вся рассылка пояса видна в /broadcasts и может быть остановлена оттуда
+    broadcast = Broadcast(f"Ежедневная рассылка, пояс {tz_name}", [*pinned_plan, *plan], scheduled=True)
+    if broadcast.chat_ids:
+        tenant.broadcasts[broadcast.id] = broadcast
+    for chat_id, promo_ids in pinned_plan.items():
+        context.job_queue.run_once(
+            update_pinned_digest_job,
+            when=pinned_offsets[chat_id],
+            data={"chat_id": chat_id, "promo_ids": promo_ids, "broadcast": broadcast.id},
+            name=f"digest-pin:{chat_id}"
+        )
+    for chat_id, promo_ids in plan.items():
+        context.job_queue.run_once(
+            send_digest_to_chat_job,
+            when=offsets[chat_id],
+            data={"chat_id": chat_id, "promo_ids": promo_ids, "broadcast": broadcast.id},
+            name=f"digest-send:{chat_id}"
+        )
+    logger.info(
+        f"Рассылка акций для пояса {tz_name} запланирована: чатов {len(plan)}, "
+        f"закрепленных подборок к обновлению {len(pinned_plan)}, окно {DIGEST_WINDOW_SECONDS} сек."
+    )
+
+async def send_digest_to_chat(context: ContextTypes.DEFAULT_TYPE):
+    """Отправка запланированной подборки акций в один чат. True, если отправлена хотя бы одна акция"""
+    tenant = get_tenant(context)
+    chat_id = context.job.data["chat_id"]
+    delivered = False
+    for pid in context.job.data["promo_ids"]:
+        promo = tenant.promotions.get(pid)
+        if not promo:
+            continue
+        try:
+            sent = await send_promotion(context, chat_id, pid, promo, kind="digest")
+            if sent:
+                delivered = True
+                tenant.analytics.record(analytics.DIGEST, pid, chat_id, tenant.delivery_day(chat_id))
+                send_logger.info(
+                    f"Акция '{promo['name']}' отправлена в чат {chat_id}",
+                    extra={"chat_id": chat_id, "promo_id": pid, "kind": "digest"}
+                )
+        except Exception as e:
+            logger.error(f"Ошибка отправки акции в чат {chat_id}: {e}")
+    return delivered
+
+send_digest_to_chat_job = scheduled_broadcast_job(send_digest_to_chat)
+
+# Закрепленная подборка акций
+def pinned_digest_hash(tenant, promo_ids):
+    """Хэш состава подборки: ID, названия и даты акций"""
+    digest = hashlib.blake2b(digest_size=8)
+    for pid in promo_ids:
+        promo = tenant.promotions[pid]
+        digest.update(f"{pid}\x1f{promo['name']}\x1f{promo['start_date']}\x1f{promo['end_date']}\x1e".encode("utf-8"))
+    return digest.hexdigest()
+
+def pinned_digest_content(tenant, promo_ids):
+    """Текст и кнопки закрепленной подборки"""
+    if not promo_ids:
+        return "📌 Актуальных акций сейчас нет.", None
+    lines = ["📌 Актуальные акции:"]
+    for pid in promo_ids[:PINNED_DIGEST_MAX_BUTTONS]:
+        promo = tenant.promotions[pid]
+        lines.append(f"• {promo['name']} ({promo['start_date']} — {promo['end_date']})")
+    if len(promo_ids) > PINNED_DIGEST_MAX_BUTTONS:
+        lines.append(f"...и еще {len(promo_ids) - PINNED_DIGEST_MAX_BUTTONS}, все акции — /promotions")
+    buttons = [
+        [InlineKeyboardButton(tenant.promotions[pid]["name"], callback_data=pack(Action.DIGEST_PROMO, pid))]
+        for pid in promo_ids[:PINNED_DIGEST_MAX_BUTTONS]
+    ]
+    return "\n".join(lines), InlineKeyboardMarkup(buttons)
+
+async def update_pinned_digest(context: ContextTypes.DEFAULT_TYPE):
+    """Правка закрепленной подборки чата, а если ее нет — отправка и закрепление новой.
+    True, если подборка обновлена"""
+    tenant = get_tenant(context)
+    chat_id = context.job.data["chat_id"]
+    promo_ids = [pid for pid in context.job.data["promo_ids"] if pid in tenant.promotions]
+    text, reply_markup = pinned_digest_content(tenant, promo_ids)
+    lane = {"lane": Lane.DIGEST}
+    message_id = tenant.pinned_digest(chat_id).get("message_id")
+
+    try:
+        if message_id:
             try:
-                with open(promo["photo"], "rb") as photo:
-                    await context.bot.send_photo(
-                        chat_id=chat_id,
-                        photo=photo,
-                        caption=(
-                            f"📣 Акция: {promo['name']}\n"
-                            f"📅 Даты проведения: {promo['start_date']} — {promo['end_date']}"
-                        ),
-                        parse_mode="HTML"
-                    )
-                logger.info(f"Акция '{promo['name']}' отправлена в чат {chat_id}")
-                used_promos.add(pid)
-            except Exception as e:
-                logger.error(f"Ошибка отправки акции в чат {chat_id}: {e}")
+                await context.bot.edit_message_text(
+                    chat_id=chat_id, message_id=message_id, text=text,
+                    reply_markup=reply_markup, rate_limit_args=lane
+                )
+            except BadRequest as e:
+                if "not modified" not in str(e).lower():
+                    # Сообщение удалено в чате: закрепляем новое
+                    message_id = None
+        if not message_id:
+            message = await context.bot.send_message(
+                chat_id=chat_id, text=text, reply_markup=reply_markup, rate_limit_args=lane
+            )
+            message_id = message.message_id
+            try:
+                await context.bot.pin_chat_message(
+                    chat_id=chat_id, message_id=message_id, disable_notification=True, rate_limit_args=lane
+                )
+            except BadRequest as e:
+                send_logger.warning(f"Не удалось закрепить подборку в чате {chat_id}: {e}")
+    except ChatMigrated as e:
+        tenant.migrate_chat(chat_id, e.new_chat_id)
+        return False
+    except Forbidden as e:
+        tenant.record_chat_failure(chat_id, e)
+        return False
+
+    tenant.set_pinned_digest(chat_id, message_id, pinned_digest_hash(tenant, promo_ids))
+    send_logger.info(
+        f"Закрепленная подборка обновлена в чате {chat_id}, акций: {len(promo_ids)}",
+        extra={"chat_id": chat_id, "kind": "pinned"}
+    )
+    return True
+
+update_pinned_digest_job = scheduled_broadcast_job(update_pinned_digest)
+
+async def set_digest_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Вид ежедневной рассылки чата: /digest [photos|pinned]"""
+    tenant = get_tenant(context)
+    chat_id = str(update.effective_chat.id)
+    if chat_id not in tenant.chat_ids:
+        await update.message.reply_text("Чат не зарегистрирован. Используйте /start.")
+        return
+    if not context.args or context.args[0] not in DIGEST_MODES:
+        await update.message.reply_text(
+            f"Вид рассылки чата: {tenant.digest_mode(chat_id)}\n"
+            "/digest photos — три фото акций каждый день\n"
+            "/digest pinned — одно закрепленное сообщение со списком акций, меняется при изменении списка"
+        )
+        return
+
+    if update.effective_user.id not in tenant.admin_ids and update.effective_chat.type != "private":
+        member = await context.bot.get_chat_member(update.effective_chat.id, update.effective_user.id)
+        if member.status not in ("creator", "administrator"):
+            await update.message.reply_text("Вид рассылки может менять только администратор чата.")
+            return
+
+    mode = context.args[0]
+    tenant.chat_settings.setdefault(chat_id, {})["digest"] = mode
+    if mode != "pinned":
+        tenant.chat_settings[chat_id].pop("pinned_digest", None)
+    tenant.save_chat_settings()
+    logger.info(f"Вид рассылки чата {chat_id} изменен на {mode}")
+    await update.message.reply_text(f"✅ Вид рассылки: {mode}. Применится при следующей ежедневной рассылке.")
+
+def schedule_digest_jobs(tenant, job_queue):
+    """Ежедневная рассылка и уведомления об окончании акций на каждый используемый
+    часовой пояс в его местное время"""
+    daily_jobs = {"digest": notify_about_active_promotions, "expiring": notify_about_expiring_promotions}
+    timezones = tenant.used_timezones()
+    for job in job_queue.jobs():
+        if job.name and job.name.split(":")[0] in daily_jobs and job.data not in timezones:
+            job.schedule_removal()
+
+    for tz_name in timezones:
+        for prefix, callback in daily_jobs.items():
+            if job_queue.get_jobs_by_name(f"{prefix}:{tz_name}"):
+                continue
+            job_queue.run_daily(
+                callback,
+                time=time(hour=DIGEST_HOUR, minute=DIGEST_MINUTE, tzinfo=pytz.timezone(tz_name)),
+                days=(0, 1, 2, 3, 4, 5, 6),
+                data=tz_name,
+                name=f"{prefix}:{tz_name}"
+            )
+        logger.info(f"Запланирована рассылка для пояса {tz_name}")
+
+async def set_chat_timezone(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Часовой пояс чата: /timezone [Europe/Samara] или /timezone <chat_id> <пояс> для админа"""
+    tenant = get_tenant(context)
+    args = context.args
+    chat_id = str(update.effective_chat.id)
+    if len(args) == 2 and update.effective_user.id in tenant.admin_ids:
+        chat_id, args = args[0], args[1:]
+
+    if not args:
+        await update.message.reply_text(
+            f"Часовой пояс чата: {tenant.chat_timezone(chat_id)}\n"
+            "Изменить: /timezone Europe/Samara"
+        )
+        return
 
-    logger.info("Пятничная рассылка акций завершена.")
+    if update.effective_user.id not in tenant.admin_ids and update.effective_chat.type != "private":
+        member = await context.bot.get_chat_member(update.effective_chat.id, update.effective_user.id)
+        if member.status not in ("creator", "administrator"):
+            await update.message.reply_text("Часовой пояс может менять только администратор чата.")
+            return
+
+    tz_name = args[0]
+    if not is_valid_timezone(tz_name):
+        await update.message.reply_text(f"Неизвестный часовой пояс: {tz_name}")
+        return
+    if chat_id not in tenant.chat_ids:
+        await update.message.reply_text("Чат не зарегистрирован. Используйте /start.")
+        return
+
+    tenant.chat_settings.setdefault(chat_id, {})["timezone"] = tz_name
+    tenant.save_chat_settings()
+    schedule_digest_jobs(tenant, context.job_queue)
+    logger.info(f"Часовой пояс чата {chat_id} изменен на {tz_name}")
+    await update.message.reply_text(f"✅ Часовой пояс чата: {tz_name}")
+
+# Группы магазинов
+async def manage_shop_groups(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Группы магазинов: /groups, /groups add|remove <название> <chat_id>..., /groups delete <название>"""
+    tenant = get_tenant(context)
+    if update.effective_user.id not in tenant.admin_ids:
+        await update.message.reply_text("Только администратор может управлять группами магазинов.")
+        return
+
+    args = context.args
+    if not args:
+        groups = tenant.shop_groups.groups
+        if not groups:
+            text = "Групп магазинов нет."
+        else:
+            lines = []
+            for gid, group in groups.items():
+                names = ", ".join(tenant.chat_ids.get(cid, cid) for cid in group["shops"]) or "пусто"
+                lines.append(f"👥 {group['name']} (group:{gid}, магазинов: {len(group['shops'])}): {names}")
+            text = "\n".join(lines)
+        await update.message.reply_text(
+            f"{text}\n\n"
+            "/groups add <название> <chat_id>... — добавить магазины (группа создается)\n"
+            "/groups remove <название> <chat_id>... — убрать магазины\n"
+            "/groups delete <название> — удалить группу"
+        )
+        return
+
+    command, rest = args[0].lower(), args[1:]
+    # Название группы — слова до первого ID чата
+    name_parts = []
+    while rest and not rest[0].lstrip("-").isdigit():
+        name_parts.append(rest.pop(0))
+    name = " ".join(name_parts)
+    chat_ids = [str(int(cid)) for cid in rest]
+
+    if not name or command not in ("add", "remove", "delete") or (command != "delete" and not chat_ids):
+        await update.message.reply_text(
+            "Использование: /groups add|remove <название> <chat_id>... или /groups delete <название>"
+        )
+        return
+
+    try:
+        if command == "add":
+            unknown = [cid for cid in chat_ids if cid not in tenant.chat_ids]
+            if unknown:
+                await update.message.reply_text(f"Неизвестные магазины: {', '.join(unknown)}")
+                return
+            gid = tenant.shop_groups.add_shops(name, chat_ids)
+            text = f"✅ Группа «{name}» (group:{gid}): магазинов {len(tenant.shop_groups.groups[gid]['shops'])}"
+        elif command == "remove":
+            tenant.shop_groups.remove_shops(name, chat_ids)
+            text = f"✅ Магазины убраны из группы «{name}»"
+        else:
+            tenant.shop_groups.delete(name)
+            text = f"✅ Группа «{name}» удалена. Акции, адресованные ей, больше не рассылаются по этой группе."
+    except KeyError:
+        await update.message.reply_text(f"Группа «{name}» не найдена.")
+        return
+
+    logger.info(f"[{tenant.name}] Группы магазинов: {command} {name} {chat_ids}")
+    await update.message.reply_text(text)
 
 async def notify_about_expiring_promotions(context: ContextTypes.DEFAULT_TYPE):
-    logger.info("Проверка акций на завершение через 3 дня...")
+    """Уведомления чатам одного часового пояса об акциях, завершающихся через 3 дня"""
+    tenant = get_tenant(context)
+    tz_name = context.job.data if context.job and context.job.data else DEFAULT_TIMEZONE
+    logger.info(f"Проверка акций на завершение через 3 дня для пояса {tz_name}...")
     
-    # Получаем текущую дату
-    now = datetime.now().date()
+    # Дни до окончания считаются по местной дате пояса
+    now = local_today(tz_name)
     
-    for promo_id, promo in promotions.items():
+    # Уведомления копятся по чатам: один чат получает одно сообщение за запуск
+    chat_to_promos = {}
+    ref_mask = tenant.ref_resolver()
+    for promo_id, promo in tenant.promotions.items():
         try:
             end_date = datetime.fromisoformat(promo["end_date"]).date()
             days_left = (end_date - now).days
@@ -820,100 +1564,482 @@ async def notify_about_expiring_promotions(context: ContextTypes.DEFAULT_TYPE):
             # Если до окончания акции осталось 3 дня
             if days_left == 3:
                 logger.info(f"Акция '{promo['name']}' завершается через 3 дня.")
-                
-                # Отправляем уведомление в каждый связанный чат
-                for chat_id in promo.get("shops", []):
-                    try:
-                        with open(promo["photo"], "rb") as photo:
-                            await context.bot.send_photo(
-                                chat_id=chat_id,
-                                photo=photo,
-                                caption=(
-                                    f"⚠️ Внимание! Акция '{promo['name']}' завершается через 3 дня!\n"
-                                    f"📅 Последний день: {promo['end_date']}"
-                                ),
-                                parse_mode="HTML",
-                            )
-                        logger.info(f"Уведомление об окончании акции отправлено в чат {chat_id}.")
-                    except Exception as e:
-                        logger.error(f"Ошибка отправки в чат {chat_id}: {e}")
+                for chat_id in tenant.promo_chats(promo_id, ref_mask):
+                    if tenant.chat_timezone(chat_id) == tz_name:
+                        chat_to_promos.setdefault(chat_id, []).append((promo_id, promo))
         except Exception as e:
             logger.error(f"Ошибка при проверке акции {promo_id}: {e}")
 
+    async def send(chat_id):
+        sent = await send_expiring_notice(context, chat_id, chat_to_promos[chat_id])
+        if sent:
+            send_logger.info(
+                f"Уведомление об окончании акций отправлено в чат {chat_id}, акций: {sent}.",
+                extra={"chat_id": chat_id, "kind": "expiring"}
+            )
+        return bool(sent)
+
+    # Рассылка видна в /broadcasts и может быть остановлена оттуда
+    if chat_to_promos:
+        await run_broadcast(context, Broadcast("Уведомления об окончании акций", chat_to_promos), send)
+
+async def send_expiring_notice(context: ContextTypes.DEFAULT_TYPE, chat_id, items):
+    """Одно уведомление чату обо всех завершающихся акциях. Возвращает число акций в нем.
+
+    Одна акция отправляется фото, как раньше; несколько — одним списком
+    с кнопками, по которым открывается каждая акция.
+    """
+    tenant = get_tenant(context)
+    if not tenant.chat_health.is_available(chat_id):
+        return 0
+    day = tenant.delivery_day(chat_id).isoformat()
+    claimed = []
+    for pid, promo in items:
+        key = tenant.delivery_ledger.key(chat_id, pid, "expiring", day)
+        if tenant.delivery_ledger.claim(key):
+            claimed.append((key, pid, promo))
+    if not claimed:
+        return 0
+    if len(claimed) == 1:
+        key, pid, promo = claimed[0]
+        tenant.delivery_ledger.release(key)
+        return int(await send_promotion(context, chat_id, pid, promo, kind="expiring"))
+
+    lines = ["⚠️ Через 3 дня завершаются акции:"]
+    lines += [
+        f"• {promo['name']} — последний день {promo['end_date']}" for _, _, promo in claimed[:SUMMARY_MAX_ITEMS]
+    ]
+    if len(claimed) > SUMMARY_MAX_ITEMS:
+        lines.append(f"...и еще {len(claimed) - SUMMARY_MAX_ITEMS}")
+    buttons = [
+        [InlineKeyboardButton(promo["name"], callback_data=pack(Action.DIGEST_PROMO, pid))]
+        for _, pid, promo in claimed[:SUMMARY_MAX_ITEMS]
+    ]
+
+    def release():
+        for key, _, _ in claimed:
+            tenant.delivery_ledger.release(key)
+
+    try:
+        await context.bot.send_message(
+            chat_id=chat_id, text="\n".join(lines), reply_markup=InlineKeyboardMarkup(buttons),
+            rate_limit_args={"lane": Lane.DIGEST}
+        )
+    except ChatMigrated as e:
+        release()
+        tenant.migrate_chat(chat_id, e.new_chat_id)
+        return await send_expiring_notice(context, e.new_chat_id, items)
+    except Forbidden as e:
+        release()
+        tenant.record_chat_failure(chat_id, e)
+        return 0
+    except BadRequest as e:
+        release()
+        if "chat not found" in str(e).lower():
+            tenant.record_chat_failure(chat_id, e)
+            return 0
+        raise
+    except Exception:
+        release()
+        raise
+
+    tenant.chat_health.record_success(chat_id)
+    for key, _, _ in claimed:
+        tenant.delivery_ledger.confirm(key)
+    return len(claimed)
+
+# Ограничение частоты пользовательских запросов
+THROTTLED_ACTIONS = (Action.PROMO, Action.DIGEST_PROMO)
+THROTTLED_COMMANDS = ("/promotions",)
+THROTTLE_REPLY = "⏳ Слишком много запросов, попробуйте через несколько секунд."
+
+async def throttle_user_requests(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отбрасывание слишком частых /promotions и нажатий на кнопки акций"""
+    user, chat = update.effective_user, update.effective_chat
+    if user is None or chat is None:
+        return
+    query = update.callback_query
+    if query:
+        callback = unpack(query.data)
+        if callback is None or callback.action not in THROTTLED_ACTIONS:
+            return
+    else:
+        text = update.message.text if update.message else None
+        if not text or text.split(maxsplit=1)[0].split("@")[0] not in THROTTLED_COMMANDS:
+            return
+
+    tenant = get_tenant(context)
+    if user.id in tenant.admin_ids:
+        return
+    verdict = tenant.throttle.check(user.id, chat.id, repeat_key=query.data if query else None)
+    if verdict == ALLOW:
+        return
+
+    if query:
+        # Ответ на нажатие обязателен, иначе у пользователя крутится индикатор загрузки
+        await query.answer(THROTTLE_REPLY if verdict == NOTIFY else None)
+    elif verdict == NOTIFY:
+        await update.message.reply_text(THROTTLE_REPLY)
+    if verdict != REPEAT:
+        logger.debug(f"Запрос пользователя {user.id} в чате {chat.id} отброшен ограничением частоты")
+    raise ApplicationHandlerStop
+
+# Учет обработанных обновлений между перезапусками
+async def skip_processed_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Пропуск обновлений, которые уже были обработаны до перезапуска"""
+    if context.application.persistence.skip_update(update.update_id):
+        logger.info(f"Пропущено уже обработанное обновление {update.update_id}")
+        raise ApplicationHandlerStop
+
+async def remember_processed_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Сохранение смещения после обработки обновления"""
+    context.application.persistence.mark_update_processed(update.update_id)
+
+# Истечение незавершенных диалогов
+def conversation_timeout_handler(user_data_key, command):
+    """Обработчик истечения диалога: очистка его user_data и сообщение пользователю"""
+    async def on_timeout(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if user_data_key and context.user_data is not None:
+            context.user_data.pop(user_data_key, None)
+        if update.effective_chat:
+            await context.bot.send_message(
+                chat_id=update.effective_chat.id,
+                text=f"⌛ Время ожидания истекло, действие отменено. Чтобы начать заново, используйте /{command}."
+            )
+    return TypeHandler(Update, on_timeout)
+
+async def touch_conversation_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отметка времени последнего действия пользователя с незавершенным диалогом"""
+    if context.user_data is not None and any(key in context.user_data for key in CONVERSATION_KEYS):
+        context.user_data["last_activity"] = datetime.now().timestamp()
+
+def conversation_memory(application):
+    """Незавершенные диалоги и примерный объем user_data"""
+    user_data_bytes = 0
+    flows = 0
+    for data in application.user_data.values():
+        user_data_bytes += len(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+        flows += sum(key in data for key in CONVERSATION_KEYS)
+    return {
+        "conversations": application.persistence.count_conversations(),
+        "users": len(application.user_data),
+        "flows": flows,
+        "bytes": user_data_bytes,
+    }
+
+def end_user_conversation(application, name, user_id):
+    """Завершение диалога пользователя во всех чатах.
+
+    Таймер conversation_timeout не восстанавливается после перезапуска, и без
+    этого диалог остался бы в состоянии, обработчики которого ждут удаленные
+    данные user_data. Удаление ключа сохраняется в persistence как None.
+    """
+    conversations = application._conversation_handler_conversations.get(name, {})
+    for key in [key for key in conversations if key[-1] == user_id]:
+        del conversations[key]
+
+async def expire_conversation_data(context: ContextTypes.DEFAULT_TYPE):
+    """Удаление user_data диалогов, брошенных дольше CONVERSATION_TIMEOUT"""
+    application = context.application
+    cutoff = datetime.now().timestamp() - CONVERSATION_TIMEOUT
+    expired = 0
+    changed = []
+    for user_id, data in list(application.user_data.items()):
+        # Пользователи без незавершенных диалогов не трогаются
+        if "last_activity" not in data and not any(key in data for key in CONVERSATION_KEYS):
+            continue
+        if data.get("last_activity", 0) >= cutoff:
+            continue
+        removed = data.pop("last_activity", None) is not None
+        for key in CONVERSATION_KEYS:
+            if data.pop(key, None) is not None:
+                expired += 1
+                removed = True
+                if key in CONVERSATION_NAMES:
+                    end_user_conversation(application, CONVERSATION_NAMES[key], user_id)
+        if not removed:
+            continue
+        if not data:
+            application.drop_user_data(user_id)
+        else:
+            changed.append(user_id)
+    if changed:
+        application.mark_data_for_update_persistence(user_ids=changed)
+
+    stats = conversation_memory(application)
+    logger.info(
+        f"[{get_tenant(context).name}] Истекло диалогов: {expired}; незавершенных: "
+        f"{sum(stats['conversations'].values())}, user_data: {stats['users']} польз., ~{stats['bytes'] // 1024} КБ",
+        extra={"expired": expired, **stats}
+    )
+
+async def memory_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Незавершенные диалоги и объем их состояния: /memstats"""
+    tenant = get_tenant(context)
+    if update.effective_user.id not in tenant.admin_ids:
+        await update.message.reply_text("Только администратор может смотреть статистику.")
+        return
+
+    stats = conversation_memory(context.application)
+    lines = ["Незавершенные диалоги:"]
+    lines += [f"{name}: {count}" for name, count in sorted(stats["conversations"].items())] or ["нет"]
+    lines.append(f"\nuser_data: {stats['users']} польз., данных диалогов: {stats['flows']}")
+    lines.append(f"Примерный объем user_data: {stats['bytes'] / 1024:.1f} КБ")
+    await update.message.reply_text("\n".join(lines))
+
 # Обработчик ошибок
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик ошибок"""
     logger.error("Exception while handling an update:", exc_info=context.error)
 
 async def auto_delete_expired_promotions(context: ContextTypes.DEFAULT_TYPE):
+    tenant = get_tenant(context)
     logger.info("Автоудаление завершившихся акций...")
 
-    today = datetime.now().date()
+    # Акция удаляется, когда закончился ее последний день во всех используемых поясах
+    today = min(local_today(tz_name) for tz_name in tenant.used_timezones())
     expired_ids = []
     expired_names = {}
 
-    for promo_id, promo in promotions.copy().items():
+    for promo_id, promo in tenant.promotions.copy().items():
         try:
             end_date = datetime.fromisoformat(promo["end_date"]).date()
-            if end_date == today:
+            if end_date < today:
                 expired_ids.append(promo_id)
                 expired_names[promo_id] = promo["name"]
-
-                # Удалим фото
-                photo_path = promo.get("photo")
-                if photo_path and os.path.exists(photo_path):
-                    try:
-                        os.remove(photo_path)
-                        logger.info(f"Удалено фото для акции {promo['name']}")
-                    except Exception as e:
-                        logger.warning(f"Ошибка при удалении фото: {e}")
         except Exception as e:
             logger.warning(f"Ошибка обработки даты окончания у акции {promo_id}: {e}")
 
     for promo_id in expired_ids:
         try:
-            del promotions[promo_id]
+            del tenant.promotions[promo_id]
             logger.info(f"Удалена акция: {expired_names[promo_id]}")
         except Exception as e:
             logger.error(f"Ошибка при удалении акции {promo_id}: {e}")
 
     if expired_ids:
-        save_data(promotions)
+        tenant.journal.append([tenant.journal.record("delete", pid, reason="expire") for pid in expired_ids])
         logger.info(f"Сохранены изменения. Удалено акций: {len(expired_ids)}")
 
-        # Уведомление всем администраторам
-        for admin_id in ADMIN_IDS:
-            for pid, name in expired_names.items():
-                await context.bot.send_message(
-                    chat_id=admin_id,
-                    text=f"❌ Акция '{name}' была автоматически удалена после завершения."
-                )
+        # Одно сообщение каждому администратору со всеми удаленными акциями
+        names = list(expired_names.values())
+        if len(names) == 1:
+            text = f"❌ Акция '{names[0]}' была автоматически удалена после завершения."
+        else:
+            lines = [f"❌ Автоматически удалены завершившиеся акции ({len(names)}):"]
+            lines += [f"• {name}" for name in names[:SUMMARY_MAX_ITEMS]]
+            if len(names) > SUMMARY_MAX_ITEMS:
+                lines.append(f"...и еще {len(names) - SUMMARY_MAX_ITEMS}")
+            text = "\n".join(lines)
+        for admin_id in tenant.admin_ids:
+            try:
+                await context.bot.send_message(chat_id=admin_id, text=text, rate_limit_args={"lane": Lane.ADMIN})
+            except Exception as e:
+                logger.error(f"Ошибка отправки уведомления админу {admin_id}: {e}")
     else:
         logger.info("Нет акций для удаления.")
 
-async def main():
-    # Добавляем проверку существования токена
-    if not TOKEN:
-        logger.error("Токен не определен в config.py!")
+async def report_chat_health(context: ContextTypes.DEFAULT_TYPE):
+    """Отчет администраторам об исключенных и перенесенных чатах"""
+    tenant = get_tenant(context)
+    events = tenant.chat_health.pop_events()
+    if not events:
         return
-    
-    if not ADMIN_IDS:
-        logger.error("ID администратора не определен в config.py!")
+
+    lines = ["🩺 Изменения в списке чатов:"]
+    for kind, chat_id, name, detail in events:
+        label = f"{name} ({chat_id})" if name else str(chat_id)
+        if kind == "dead":
+            lines.append(f"❌ {label} исключен из рассылок: {detail}")
+        else:
+            lines.append(f"🔁 {label} перенесен в {detail}")
+
+    for admin_id in tenant.admin_ids:
+        try:
+            await context.bot.send_message(
+                chat_id=admin_id, text="\n".join(lines), rate_limit_args={"lane": Lane.ADMIN}
+            )
+        except Exception as e:
+            logger.error(f"Ошибка отправки отчета админу {admin_id}: {e}")
+
+async def expire_delivery_ledger(context: ContextTypes.DEFAULT_TYPE):
+    """Очистка устаревших записей журнала доставок"""
+    tenant = get_tenant(context)
+    removed = tenant.delivery_ledger.expire(tenant.delivery_day())
+    logger.info(f"Из журнала доставок удалено записей: {removed}")
+
+# Журнал изменений каталога
+async def compact_catalog_journal(context: ContextTypes.DEFAULT_TYPE):
+    """Фоновое сжатие журнала в новый снимок data.json"""
+    tenant = get_tenant(context)
+    try:
+        if await tenant.journal.compact(tenant.promotions):
+            logger.info("Журнал изменений каталога сжат в новый снимок.")
+    except Exception as e:
+        logger.error(f"Ошибка при сжатии журнала: {e}")
+
+# Статистика акций
+async def flush_analytics(context: ContextTypes.DEFAULT_TYPE):
+    """Сброс накопленных счетчиков просмотров и доставок в базу"""
+    tenant = get_tenant(context)
+    try:
+        rows = tenant.analytics.flush()
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении статистики акций: {e}")
         return
-    
-    application = Application.builder().token(TOKEN).build()
-    
-    # Регистрация обработчиков ошибок
-    application.add_error_handler(error_handler)
+    if rows:
+        logger.debug(f"Статистика акций сохранена, строк: {rows}")
+
+async def promo_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выгрузка просмотров и доставок акций по дням в CSV: /stats [дней]"""
+    tenant = get_tenant(context)
+    if update.effective_user.id not in tenant.admin_ids:
+        await update.message.reply_text("Только администратор может выгружать статистику.")
+        return
+
+    try:
+        days = int(context.args[0]) if context.args else None
+    except ValueError:
+        await update.message.reply_text("Использование: /stats [дней]")
+        return
+    since = tenant.delivery_day() - timedelta(days=days - 1) if days else None
+    names = {pid: p["name"] for pid, p in tenant.promotions.items()}
+
+    buffer = io.BytesIO()
+    for line in tenant.analytics.export_csv(since, names):
+        buffer.write(line.encode("utf-8"))
+    buffer.seek(0)
+    await update.message.reply_document(document=buffer, filename="promo_stats.csv")
+
+# Профилирование по запросу
+async def profile_bot(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Профиль CPU и памяти за N секунд: /profile 30"""
+    tenant = get_tenant(context)
+    if update.effective_user.id not in tenant.admin_ids:
+        await update.message.reply_text("Только администратор может запускать профилирование.")
+        return
+
+    try:
+        seconds = int(context.args[0]) if context.args else PROFILE_DEFAULT_SECONDS
+    except ValueError:
+        await update.message.reply_text("Использование: /profile [секунды]")
+        return
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+
+    # Профилирование идет в отдельной задаче, чтобы не задерживать другие обновления
+    context.application.create_task(
+        run_profile(context.bot, update.effective_chat.id, seconds), update=update
+    )
+    await update.message.reply_text(f"⏱ Профилирование на {seconds} сек...")
 
-    # Установка команд бота
+async def run_profile(bot, chat_id, seconds):
+    try:
+        report = await profiler.profile(seconds)
+    except RuntimeError as e:
+        await bot.send_message(chat_id=chat_id, text=str(e))
+        return
+    filename = f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+    await bot.send_document(chat_id=chat_id, document=io.BytesIO(report.encode("utf-8")), filename=filename)
+    logger.info(f"Профиль за {seconds} сек отправлен в чат {chat_id}")
+
+async def loop_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Перцентили задержки цикла событий: /loopstats"""
+    tenant = get_tenant(context)
+    if update.effective_user.id not in tenant.admin_ids:
+        await update.message.reply_text("Только администратор может смотреть статистику.")
+        return
+    await update.message.reply_text(loop_monitor.summary())
+
+async def send_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Очереди и ожидание по полосам исходящих запросов: /sendstats"""
+    tenant = get_tenant(context)
+    if update.effective_user.id not in tenant.admin_ids:
+        await update.message.reply_text("Только администратор может смотреть статистику.")
+        return
+    await update.message.reply_text(
+        f"{context.bot.rate_limiter.summary()}\n"
+        f"Запросов отброшено ограничением частоты: {tenant.throttle.throttled}"
+    )
+
+# Уровни логирования
+async def set_log_level(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Уровень логирования подсистемы: /loglevel [подсистема уровень]"""
+    tenant = get_tenant(context)
+    if update.effective_user.id not in tenant.admin_ids:
+        await update.message.reply_text("Только администратор может менять уровень логирования.")
+        return
+
+    if len(context.args) != 2:
+        levels = "\n".join(f"{name}: {level}" for name, level in current_levels().items())
+        await update.message.reply_text(
+            f"Уровни логирования:\n{levels}\n\n"
+            "Изменить: /loglevel bot.send WARNING (root — корневой логгер)"
+        )
+        return
+
+    name, level = context.args
+    try:
+        set_level(name, level)
+    except ValueError as e:
+        await update.message.reply_text(str(e))
+        return
+    logger.warning(f"Уровень логирования {name} изменен на {level.upper()} администратором {update.effective_user.id}")
+    await update.message.reply_text(f"✅ {name}: {level.upper()}")
+
+def parse_restore_time(text):
+    """Разбор момента восстановления в московском времени"""
+    for fmt in ("%Y-%m-%d %H:%M", "%d.%m.%Y %H:%M", "%Y-%m-%d", "%d.%m.%Y"):
+        try:
+            return pytz.timezone(DEFAULT_TIMEZONE).localize(datetime.strptime(text, fmt))
+        except ValueError:
+            continue
+    raise ValueError(f"Неверный формат времени: {text}")
+
+async def restore_catalog(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Восстановление каталога на момент времени: /restore 01.07.2025 12:00"""
+    tenant = get_tenant(context)
+    user_id = update.effective_user.id
+    if user_id not in tenant.admin_ids:
+        await update.message.reply_text("Только администратор может восстанавливать акции.")
+        return
+
+    try:
+        moment = parse_restore_time(" ".join(context.args))
+    except ValueError:
+        await update.message.reply_text(
+            "Использование: /restore ДД.ММ.ГГГГ [ЧЧ:ММ] (московское время)"
+        )
+        return
+
+    restored = await asyncio.to_thread(tenant.journal.restore, moment.timestamp())
+    # Снимки до перехода на битовые маски хранят магазины списками
+    for promo in restored.values():
+        tenant.upgrade_promotion(promo)
+    missing_photos = [p["name"] for p in restored.values() if not os.path.exists(p.get("photo", ""))]
+
+    # Само восстановление тоже попадает в журнал, поэтому его можно отменить
+    tenant.promotions.clear()
+    tenant.promotions.update(restored)
+    tenant.journal.reset(tenant.promotions, reason="restore")
+
+    text = f"✅ Каталог восстановлен на {moment.strftime('%d.%m.%Y %H:%M')}. Акций: {len(tenant.promotions)}."
+    if missing_photos:
+        text += "\nНет фото у акций: " + ", ".join(missing_photos)
+    logger.info(f"Каталог восстановлен на {moment.isoformat()}, акций: {len(tenant.promotions)}")
+    await update.message.reply_text(text)
+
+async def set_bot_commands(application):
+    """Меню команд бота для всех пользователей и для администраторов"""
+    tenant = application.bot_data["tenant"]
     await application.bot.set_my_commands([
         ("start", "Запустить бота"),
         ("promotions", "Посмотреть акции"),
+        ("timezone", "Часовой пояс чата"),
+        ("digest", "Вид ежедневной рассылки"),
     ], scope=BotCommandScopeDefault())
 
     # Установка команд для администраторов
-    for admin_id in ADMIN_IDS:
+    for admin_id in tenant.admin_ids:
         try:
             await application.bot.set_my_commands([
                 ("start", "Запустить бота"),
@@ -921,43 +2047,110 @@ async def main():
                 ("add_promotion", "Добавить акцию"),
                 ("delete_promotion", "Удалить акцию"),
                 ("edit_promotion", "Редактировать акцию"),
+                ("bulk", "Массовое изменение акций"),
                 ("send_promo", "Отправить акцию вручную"),
+                ("broadcasts", "Идущие рассылки"),
+                ("import", "Импорт акций и магазинов из файла"),
+                ("export", "Выгрузка акций и магазинов"),
+                ("restore", "Восстановить акции на дату"),
+                ("timezone", "Часовой пояс чата"),
+                ("digest", "Вид ежедневной рассылки"),
+                ("groups", "Группы магазинов"),
+                ("loglevel", "Уровни логирования"),
+                ("profile", "Профиль CPU и памяти"),
+                ("loopstats", "Задержка цикла событий"),
+                ("memstats", "Незавершенные диалоги и память"),
+                ("sendstats", "Очереди исходящих сообщений"),
+                ("stats", "Просмотры и доставки акций (CSV)"),
             ], scope=BotCommandScopeChat(chat_id=admin_id))
         except Exception as e:
-            logger.error(f"Ошибка при установке команд для админа {admin_id}: {e}")
+            logger.error(f"[{tenant.name}] Ошибка при установке команд для админа {admin_id}: {e}")
+
+def build_application(tenant, shared_request):
+    """Приложение одного бота: свои обработчики, задачи и состояние, общий пул соединений"""
+    # Состояния диалогов, user_data и смещение обновлений переживают перезапуск
+    persistence = SQLitePersistence(tenant.state_db_file, conversation_ttl=CONVERSATION_TIMEOUT)
+    application = (
+        Application.builder()
+        .token(tenant.token)
+        # Смещение обновлений фиксируется одной транзакцией с user_data и диалогами
+        .application_class(StateApplication)
+        .persistence(persistence)
+        .request(shared_request)
+        # Долгий опрос держит соединение, поэтому у каждого бота он свой
+        .get_updates_request(HTTPXRequest())
+        # Ответы пользователям идут раньше рассылок и не ждут их окончания
+        .rate_limiter(PriorityRateLimiter(rate=SEND_RATE, interactive_reserve=SEND_INTERACTIVE_RESERVE))
+        .build()
+    )
+    application.bot_data["tenant"] = tenant
+
+    # Регистрация обработчиков ошибок
+    application.add_error_handler(error_handler)
+
+    # Обработанные до перезапуска обновления отбрасываются до всех остальных групп
+    application.add_handler(TypeHandler(Update, skip_processed_update), group=-2)
+    application.add_handler(TypeHandler(Update, throttle_user_requests), group=-1)
+    application.add_handler(TypeHandler(Update, remember_processed_update), group=1)
+    application.add_handler(TypeHandler(Update, touch_conversation_data), group=2)
+    application.add_handler(TypeHandler(Update, remember_shop_member), group=3)
 
     manual_send_handler = ConversationHandler(
         entry_points=[CommandHandler("send_promo", start_manual_promo_sending)],
         states={
+            ConversationHandler.TIMEOUT: [conversation_timeout_handler("promo_sending", "send_promo")],
             SELECT_PROMO_FOR_SENDING: [
-                CallbackQueryHandler(handle_select_promo_for_sending, pattern=r"^sendpromo_")
+                CallbackQueryHandler(handle_select_promo_for_sending, pattern=matches(Action.SEND_PROMO))
             ],
             SELECT_SHOPS_FOR_SENDING: [
-                CallbackQueryHandler(handle_shop_selection_for_sending, pattern=r"^(sendshop_|sendshops_done|sendshops_all)")
+                CallbackQueryHandler(
+                    handle_shop_selection_for_sending,
+                    pattern=matches(Action.SEND_SHOP, Action.SEND_DONE, Action.SEND_ALL)
+                )
             ]
         },
-        fallbacks=[]
+        fallbacks=[CommandHandler("cancel", cancel_promo_sending)],
+        name="send_promo",
+        persistent=True,
+        conversation_timeout=CONVERSATION_TIMEOUT
     )
     application.add_handler(manual_send_handler)
     # Обработчики команд
     application.add_handler(CommandHandler("promotions", view_promotions))
     application.add_handler(CommandHandler("delete_promotion", delete_promotion_start))
+    application.add_handler(CommandHandler("bulk", bulk_promotions))
     
-    # Обработчики callback-запросов
-    application.add_handler(CallbackQueryHandler(handle_promotion_selection, pattern=r"^promo_"))
-    application.add_handler(CallbackQueryHandler(handle_delete_promotion, pattern=r"^delete_"))
-    application.add_handler(CallbackQueryHandler(confirm_delete_promotion, pattern=r"^(confirm_delete_|cancel_delete)"))
+    # Обработчики callback-запросов вне диалогов: один маршрутизатор по коду действия
+    router = CallbackRouter()
+    router.add(Action.PROMO, handle_promotion_selection)
+    router.add(Action.DIGEST_PROMO, handle_promotion_selection)
+    router.add(Action.DELETE, handle_delete_promotion)
+    router.add(Action.CONFIRM_DELETE, confirm_delete_promotion)
+    router.add(Action.CANCEL_DELETE, confirm_delete_promotion)
+    router.add(Action.BULK_CONFIRM, confirm_bulk_promotions)
+    router.add(Action.BULK_CANCEL, confirm_bulk_promotions)
+    router.add(Action.BROADCAST_CANCEL, cancel_broadcast)
+    application.add_handler(CallbackQueryHandler(router.dispatch, pattern=router.pattern()))
     
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler("add_promotion", add_promotion_start)],
         states={
+            ConversationHandler.TIMEOUT: [conversation_timeout_handler("add_promotion", "add_promotion")],
             PROMO_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_add_promotion_name)],
             PROMO_DATES: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_add_promotion_dates)],
             PROMO_PHOTO: [MessageHandler(filters.PHOTO, handle_add_promotion_photo)],
             PROMO_LINK: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_add_promotion_link)],
-            PROMO_SHOPS: [CallbackQueryHandler(handle_shop_selection, pattern=r"^(shop_|shops_done)")]
+            PROMO_SHOPS: [
+                CallbackQueryHandler(
+                    handle_shop_selection,
+                    pattern=matches(*ADD_SHOP_ACTIONS)
+                )
+            ]
         },
-        fallbacks=[CommandHandler("cancel", cancel_add_promotion)]
+        fallbacks=[CommandHandler("cancel", cancel_add_promotion)],
+        name="add_promotion",
+        persistent=True,
+        conversation_timeout=CONVERSATION_TIMEOUT
     )
     application.add_handler(conv_handler)
     
@@ -965,9 +2158,13 @@ async def main():
     store_conv_handler = ConversationHandler(
         entry_points=[CommandHandler("start", start)],
         states={
+            ConversationHandler.TIMEOUT: [conversation_timeout_handler(None, "start")],
             "WAITING_FOR_STORE_NAME": [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_store_name)]
         },
-        fallbacks=[CommandHandler("cancel", cancel_add_promotion)]
+        fallbacks=[CommandHandler("cancel", cancel_add_promotion)],
+        name="store_registration",
+        persistent=True,
+        conversation_timeout=CONVERSATION_TIMEOUT
     )
     application.add_handler(store_conv_handler)
     
@@ -975,37 +2172,141 @@ async def main():
     edit_conv_handler = ConversationHandler(
         entry_points=[CommandHandler("edit_promotion", edit_promotion_start)],
         states={
-            EDIT_PROMO_SELECTION: [CallbackQueryHandler(handle_edit_promotion_selection, pattern=r"^edit_")],
-            EDIT_SHOP_SELECTION: [CallbackQueryHandler(handle_edit_shop_selection, pattern=r"^(edit_shop_|edit_shops_done)")]
+            ConversationHandler.TIMEOUT: [conversation_timeout_handler("edit_promotion", "edit_promotion")],
+            EDIT_PROMO_SELECTION: [
+                CallbackQueryHandler(handle_edit_promotion_selection, pattern=matches(Action.EDIT))
+            ],
+            EDIT_SHOP_SELECTION: [
+                CallbackQueryHandler(
+                    handle_edit_shop_selection,
+                    pattern=matches(*EDIT_SHOP_ACTIONS)
+                )
+            ]
         },
-        fallbacks=[CommandHandler("cancel", cancel_edit_promotion)]
+        fallbacks=[CommandHandler("cancel", cancel_edit_promotion)],
+        name="edit_promotion",
+        persistent=True,
+        conversation_timeout=CONVERSATION_TIMEOUT
     )
     application.add_handler(edit_conv_handler)
+
+    # Массовый импорт и экспорт
+    import_conv_handler = ConversationHandler(
+        entry_points=[CommandHandler("import", import_start)],
+        states={
+            ConversationHandler.TIMEOUT: [conversation_timeout_handler(None, "import")],
+            IMPORT_FILE: [MessageHandler(filters.Document.ALL, handle_import_file)]
+        },
+        fallbacks=[CommandHandler("cancel", cancel_import)],
+        name="import",
+        persistent=True,
+        conversation_timeout=CONVERSATION_TIMEOUT
+    )
+    application.add_handler(import_conv_handler)
+    application.add_handler(CommandHandler("export", export_catalog))
+    application.add_handler(CommandHandler("restore", restore_catalog))
+    application.add_handler(CommandHandler("timezone", set_chat_timezone))
+    application.add_handler(CommandHandler("digest", set_digest_mode))
+    application.add_handler(CommandHandler("groups", manage_shop_groups))
+    application.add_handler(CommandHandler("loglevel", set_log_level))
+    application.add_handler(CommandHandler("profile", profile_bot))
+    application.add_handler(CommandHandler("loopstats", loop_stats))
+    application.add_handler(CommandHandler("memstats", memory_stats))
+    application.add_handler(CommandHandler("sendstats", send_stats))
+    application.add_handler(CommandHandler("broadcasts", list_broadcasts))
+    application.add_handler(CommandHandler("stats", promo_stats))
+
+    # Inline-поиск акций (требует включенного inline-режима в @BotFather)
+    application.add_handler(InlineQueryHandler(inline_search))
     
     # Получаем планировщик
     job_queue = application.job_queue
 
-    # Устанавливаем время для рассылки в московском часовом поясе
-    moscow_tz = pytz.timezone("Europe/Moscow")
-    scheduled_time = time(hour=20, minute=39, tzinfo=moscow_tz)
-    # Добавляем задачу в планировщик
-    job_queue.run_daily(
-        notify_about_active_promotions,
-        time=scheduled_time,
-        days=(0, 1, 2, 3, 4, 5, 6)  # Каждый день
-    )
+    # Ежедневная рассылка в местное время каждого часового пояса
+    schedule_digest_jobs(tenant, job_queue)
  
-    # Автоудаление акций в 23:59
+    # Автоудаление акций, закончившихся во всех часовых поясах
+    job_queue.run_repeating(auto_delete_expired_promotions, interval=3600, first=60)
+
+    # Отчет об исключенных и перенесенных чатах
+    job_queue.run_repeating(report_chat_health, interval=3600, first=3600)
+
+    # Очистка журнала доставок после полуночи
     job_queue.run_daily(
-        auto_delete_expired_promotions,
-        time=time(hour=23, minute=59, tzinfo=timezone("Europe/Moscow")),
+        expire_delivery_ledger,
+        time=time(hour=0, minute=5, tzinfo=timezone(DEFAULT_TIMEZONE)),
         days=(0, 1, 2, 3, 4, 5, 6)
     )
 
-    logger.info("Планировщик уведомлений настроен.")
+    # Очистка данных брошенных диалогов
+    job_queue.run_repeating(
+        expire_conversation_data, interval=CONVERSATION_SWEEP_INTERVAL, first=CONVERSATION_SWEEP_INTERVAL
+    )
+
+    # Изменения и удаления акций переносятся в уже разосланные сообщения
+    job_queue.run_repeating(sync_sent_messages, interval=SENT_SYNC_INTERVAL, first=SENT_SYNC_INTERVAL)
+    job_queue.run_repeating(prune_sent_messages, interval=3600, first=600)
+
+    # Счетчики статистики акций пишутся в базу пачками
+    job_queue.run_repeating(flush_analytics, interval=ANALYTICS_FLUSH_INTERVAL, first=ANALYTICS_FLUSH_INTERVAL)
+
+    # Фоновое сжатие журнала изменений каталога
+    job_queue.run_repeating(compact_catalog_journal, interval=JOURNAL_COMPACT_INTERVAL, first=JOURNAL_COMPACT_INTERVAL)
 
-    # Запуск бота
-    await application.run_polling()
+    logger.info(f"[{tenant.name}] Планировщик уведомлений настроен.")
+    return application
+
+async def main():
+    tenants = []
+    for settings in TENANTS:
+        # Добавляем проверку существования токена
+        if not settings.get("token"):
+            logger.error(f"Токен бота {settings.get('name')} не определен в config.py!")
+            return
+        if not settings.get("admin_ids"):
+            logger.error(f"ID администратора бота {settings.get('name')} не определен в config.py!")
+            return
+        tenants.append(Tenant(**settings))
+
+    # Один пул HTTP-соединений на все боты процесса
+    shared_request = SharedHTTPXRequest(connection_pool_size=HTTP_POOL_SIZE)
+    applications = [build_application(tenant, shared_request) for tenant in tenants]
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Windows: остановка только через KeyboardInterrupt
+            pass
+
+    # Запуск ботов
+    loop_monitor.start()
+    started = []
+    try:
+        for application in applications:
+            await application.initialize()
+            started.append(application)
+            await set_bot_commands(application)
+            await application.updater.start_polling()
+            await application.start()
+            logger.info(f"[{application.bot_data['tenant'].name}] Бот запущен.")
+        await stop_event.wait()
+    finally:
+        for application in reversed(started):
+            if application.updater.running:
+                await application.updater.stop()
+            if application.running:
+                await application.stop()
+            await application.shutdown()
+        for tenant in tenants:
+            tenant.analytics.flush()
+            tenant.journal.close()
+        await loop_monitor.stop()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,108 @@
+import asyncio
+import itertools
+import time
+
+_ids = itertools.count(1)
+
+
+def _duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes} мин {seconds} сек" if minutes else f"{seconds} сек"
+
+
+class Broadcast:
+    """Фоновая рассылка по списку чатов с учетом хода и отменой.
+
+    send(chat_id) возвращает True, если сообщение доставлено, и False,
+    если чат пропущен (уже получил акцию сегодня или недоступен).
+    Исключение считается ошибкой доставки.
+
+    Плановая рассылка (scheduled) идет отдельными задачами планировщика,
+    которые сами сообщают результат через record.
+    """
+
+    def __init__(self, title, chat_ids, scheduled=False):
+        self.id = next(_ids)
+        self.title = title
+        self.chat_ids = list(chat_ids)
+        self.sent = 0
+        self.skipped = 0
+        self.failed = []
+        self.cancelled = False
+        self.finished = False
+        self.started = time.monotonic()
+        self.status = None  # (chat_id, message_id) сообщения с ходом рассылки
+        self.scheduled = scheduled
+
+    @property
+    def processed(self):
+        return self.sent + self.skipped + len(self.failed)
+
+    @property
+    def remaining(self):
+        return len(self.chat_ids) - self.processed
+
+    def cancel(self):
+        self.cancelled = True
+
+    def record(self, chat_id, delivered, error=None):
+        """Учет результата отправки в один чат"""
+        if error is not None:
+            self.failed.append((chat_id, error))
+        elif delivered:
+            self.sent += 1
+        else:
+            self.skipped += 1
+        if not self.remaining:
+            self.finished = True
+
+    def eta(self):
+        """Оценка оставшегося времени в секундах по средней скорости с начала рассылки"""
+        if not self.processed:
+            return None
+        return (time.monotonic() - self.started) / self.processed * self.remaining
+
+    async def run(self, send, concurrency=1):
+        chat_ids = iter(self.chat_ids)
+
+        async def worker():
+            # Общий итератор: каждый чат берет ровно один обработчик
+            for chat_id in chat_ids:
+                if self.cancelled:
+                    return
+                try:
+                    self.record(chat_id, await send(chat_id))
+                except Exception as e:
+                    self.record(chat_id, False, str(e))
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+        finally:
+            self.finished = True
+
+    # Тексты для администратора
+    def progress_text(self):
+        eta = self.eta()
+        lines = [
+            f"⏳ {self.title}",
+            f"Отправлено: {self.sent}, пропущено: {self.skipped}, ошибок: {len(self.failed)}",
+            f"Осталось: {self.remaining} из {len(self.chat_ids)}"
+            + (f", примерно {_duration(eta)}" if eta is not None else ""),
+        ]
+        return "\n".join(lines)
+
+    def report_text(self, names=None, limit=20):
+        names = names or {}
+        title = "⛔ Рассылка остановлена" if self.cancelled else "✅ Рассылка завершена"
+        lines = [
+            f"{title}: {self.title}",
+            f"Отправлено: {self.sent}, пропущено: {self.skipped}, ошибок: {len(self.failed)}"
+            + (f", не отправлено после отмены: {self.remaining}" if self.cancelled and self.remaining else ""),
+            f"Время: {_duration(time.monotonic() - self.started)}",
+        ]
+        if self.failed:
+            lines.append("Ошибки:")
+            lines += [f"• {names.get(cid, cid)}: {error}" for cid, error in self.failed[:limit]]
+            if len(self.failed) > limit:
+                lines.append(f"...и еще {len(self.failed) - limit}")
+        return "\n".join(lines)
@@ -0,0 +1,103 @@
+from datetime import date, timedelta
+
+from shop_groups import group_ref
+
+# Массовые изменения каталога администратором.
+#
+# Выборка акций идет по индексам: названия — по поисковому индексу,
+# адресаты — по битовым маскам PromotionTargets. Все изменения одной
+# команды собираются в записи журнала и дописываются одной операцией.
+
+EXTEND = "extend"
+DELETE = "delete"
+ADD_SHOP = "addshop"
+REMOVE_SHOP = "removeshop"
+
+ALL = "*"
+
+
+def select_by_name(tenant, query):
+    """Акции, в названии которых есть слова запроса; "*" — все акции"""
+    if query.strip() == ALL:
+        return set(tenant.promotions)
+    return {pid for pid in tenant.search_index.search(query) if pid in tenant.promotions}
+
+
+def select_by_link(tenant, pattern):
+    """Акции, в ссылке которых есть подстрока pattern (без учета регистра)"""
+    pattern = pattern.strip().lower()
+    return {pid for pid, promo in tenant.promotions.items() if pattern in promo.get("link", "").lower()}
+
+
+def select_by_target(tenant, target):
+    """Акции, адресованные чату напрямую или ссылке (группе, всем магазинам)"""
+    bit = tenant.chat_index.bit(target)
+    return {
+        pid for pid in tenant.promotions
+        if tenant.targets.mask(pid) & bit or target in tenant.targets.refs(pid)
+    }
+
+
+def resolve_target(tenant, text):
+    """ID зарегистрированного магазина или название группы -> адресат. None, если не найден"""
+    text = text.strip()
+    if text in tenant.chat_ids:
+        return text
+    gid = tenant.shop_groups.find(text)
+    return group_ref(gid) if gid is not None else None
+
+
+def _new_end(promo, days):
+    """Дата окончания после сдвига на days дней, не раньше даты начала"""
+    end = date.fromisoformat(promo["end_date"]) + timedelta(days=days)
+    return max(end, date.fromisoformat(promo["start_date"]))
+
+
+def clamped_by_extend(tenant, promo_ids, days):
+    """Акции, у которых сдвиг окончания уперся бы в дату начала"""
+    return {
+        pid for pid in promo_ids
+        if date.fromisoformat(tenant.promotions[pid]["end_date"]) + timedelta(days=days)
+        < date.fromisoformat(tenant.promotions[pid]["start_date"])
+    }
+
+
+def _extend(tenant, promo_id, days):
+    promo = tenant.promotions[promo_id]
+    end = _new_end(promo, days).isoformat()
+    if end == promo["end_date"]:
+        return None
+    fields = {"end_date": end}
+    tenant.promotions[promo_id].update(fields)
+    return tenant.journal.record("patch", promo_id, fields, reason="bulk")
+
+
+def _change_targets(tenant, promo_id, target, add):
+    targets = tenant.target_list(promo_id)
+    if add == (target in targets):
+        return None
+    targets = targets + [target] if add else [t for t in targets if t != target]
+    fields = {"targets": tenant.set_targets(tenant.promotions[promo_id], targets)}
+    return tenant.journal.record("patch", promo_id, fields, reason="bulk")
+
+
+def apply(tenant, op, promo_ids, arg=None):
+    """Применение операции к акциям одной записью в журнал. Возвращает число измененных акций"""
+    records = []
+    for promo_id in sorted(promo_ids, key=int):
+        if promo_id not in tenant.promotions:
+            continue
+        if op == EXTEND:
+            record = _extend(tenant, promo_id, arg)
+        elif op == DELETE:
+            del tenant.promotions[promo_id]
+            record = tenant.journal.record("delete", promo_id, reason="bulk")
+        elif op in (ADD_SHOP, REMOVE_SHOP):
+            record = _change_targets(tenant, promo_id, arg, add=op == ADD_SHOP)
+        else:
+            raise ValueError(op)
+        if record:
+            records.append(record)
+    if records:
+        tenant.journal.append(records)
+    return len(records)
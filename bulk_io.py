@@ -0,0 +1,213 @@
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import os
+from datetime import datetime
+
+import httpx
+
+from shop_groups import is_ref
+
+PROMOTION_FIELDS = ["id", "name", "start_date", "end_date", "link", "photo", "shops"]
+
+_DATE_FORMATS = ("%Y-%m-%d", "%d.%m.%Y")
+_CHUNK_SIZE = 64 * 1024
+
+
+def _iter_json_array(stream):
+    """Потоковый разбор JSON-массива объектов без загрузки файла целиком"""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    started = False
+    index = 0
+    while True:
+        chunk = stream.read(_CHUNK_SIZE)
+        buffer += chunk
+        while True:
+            buffer = buffer.lstrip()
+            if not started:
+                if not buffer:
+                    break
+                if buffer[0] != "[":
+                    raise ValueError("JSON-файл должен содержать массив записей")
+                buffer = buffer[1:]
+                started = True
+                continue
+            if buffer[:1] == ",":
+                buffer = buffer[1:]
+                continue
+            if buffer[:1] == "]":
+                return
+            try:
+                record, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if not chunk:
+                    raise
+                break
+            index += 1
+            yield index, record
+            buffer = buffer[end:]
+        if not chunk:
+            raise ValueError("Неожиданный конец JSON-массива")
+
+
+def iter_records(stream, filename):
+    """Последовательное чтение записей (номер, словарь) из CSV, JSON или JSONL"""
+    ext = os.path.splitext(filename.lower())[1]
+    if ext == ".csv":
+        for index, row in enumerate(csv.DictReader(stream), start=2):
+            yield index, row
+    elif ext in (".jsonl", ".ndjson"):
+        for index, line in enumerate(stream, start=1):
+            line = line.strip()
+            if line:
+                yield index, json.loads(line)
+    elif ext == ".json":
+        yield from _iter_json_array(stream)
+    else:
+        raise ValueError("Поддерживаются только файлы .csv, .json и .jsonl")
+
+
+def is_shop_record(record):
+    return "chat_id" in record
+
+
+def _parse_date(value):
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(str(value).strip(), fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"Неверная дата '{value}', ожидается ГГГГ-ММ-ДД или ДД.ММ.ГГГГ")
+
+
+def _parse_chat_id(value):
+    try:
+        return str(int(str(value).strip()))
+    except ValueError:
+        raise ValueError(f"Неверный ID чата '{value}'") from None
+
+
+def _parse_target(value):
+    """ID чата или ссылка на группу / все магазины"""
+    value = str(value).strip()
+    return value if is_ref(value) else _parse_chat_id(value)
+
+
+def validate_shop(record):
+    """Проверка записи магазина, возвращает (chat_id, name)"""
+    name = str(record.get("name") or "").strip()
+    if not name:
+        raise ValueError("Пустое название магазина")
+    return _parse_chat_id(record["chat_id"]), name
+
+
+def validate_promotion(record):
+    """Проверка записи акции, возвращает нормализованную акцию"""
+    name = str(record.get("name") or "").strip()
+    if not name:
+        raise ValueError("Пустое название акции")
+
+    start_date = _parse_date(record.get("start_date", ""))
+    end_date = _parse_date(record.get("end_date", ""))
+    if start_date > end_date:
+        raise ValueError("Дата начала позже даты окончания")
+
+    link = str(record.get("link") or "").strip()
+    if not link.startswith(("http://", "https://")):
+        raise ValueError("Ссылка должна начинаться с http:// или https://")
+
+    photo = str(record.get("photo") or "").strip()
+    if not photo:
+        raise ValueError("Не указано фото")
+    if not photo.startswith(("http://", "https://")) and not os.path.isfile(photo):
+        raise ValueError(f"Файл фото '{photo}' не найден")
+
+    shops = record.get("shops") or []
+    if isinstance(shops, str):
+        shops = [s for s in shops.replace(",", ";").split(";") if s.strip()]
+    if not shops:
+        raise ValueError("Не указаны магазины")
+
+    promo = {
+        "name": name,
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "photo": photo,
+        "link": link,
+        "shops": list(dict.fromkeys(_parse_target(s) for s in shops)),
+    }
+    if record.get("id"):
+        promo_id = str(record["id"]).strip()
+        if not promo_id.isdigit():
+            raise ValueError(f"Неверный ID акции '{promo_id}'")
+        promo["id"] = str(int(promo_id))
+    return promo
+
+
+def photo_path_for_url(url, photos_dir="photos"):
+    digest = hashlib.sha1(url.encode("utf-8")).hexdigest()
+    return os.path.join(photos_dir, f"import_{digest}.jpg")
+
+
+async def fetch_photos(urls, concurrency=8, timeout=30, photos_dir="photos"):
+    """Параллельная загрузка фото с ограничением числа одновременных запросов.
+
+    Возвращает словарь url -> локальный путь и словарь url -> ошибка.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    paths, errors = {}, {}
+
+    async def fetch(client, url):
+        path = photo_path_for_url(url, photos_dir)
+        if os.path.exists(path):
+            paths[url] = path
+            return
+        async with semaphore:
+            try:
+                response = await client.get(url)
+                response.raise_for_status()
+            except httpx.HTTPError as e:
+                errors[url] = str(e)
+                return
+        await asyncio.to_thread(_write_file, path, response.content)
+        paths[url] = path
+
+    async with httpx.AsyncClient(timeout=timeout, follow_redirects=True) as client:
+        await asyncio.gather(*(fetch(client, url) for url in set(urls)))
+    return paths, errors
+
+
+def _write_file(path, content):
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+def export_jsonl(promotions, chat_ids, shops_of):
+    """Построчная выгрузка магазинов и акций в JSONL. shops_of(promo_id) — адресаты акции списком"""
+    for chat_id, name in chat_ids.items():
+        yield json.dumps({"chat_id": chat_id, "name": name}, ensure_ascii=False) + "\n"
+    for pid, promo in promotions.items():
+        record = {"id": pid}
+        record.update({field: promo.get(field) for field in PROMOTION_FIELDS[1:]})
+        record["shops"] = shops_of(pid)
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def export_csv(promotions, shops_of):
+    """Построчная выгрузка акций в CSV. shops_of(promo_id) — адресаты акции списком"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=PROMOTION_FIELDS)
+    writer.writeheader()
+    for pid, promo in promotions.items():
+        row = {field: promo.get(field, "") for field in PROMOTION_FIELDS[1:]}
+        row["id"] = pid
+        row["shops"] = ";".join(shops_of(pid))
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.getvalue():
+        yield buffer.getvalue()
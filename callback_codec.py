@@ -0,0 +1,156 @@
+import base64
+import re
+from collections import namedtuple
+from functools import lru_cache
+from enum import IntEnum
+
+# Версия формата callback_data. Кнопки со старой версией считаются устаревшими.
+VERSION = 1
+
+# Ограничение Telegram на длину callback_data
+MAX_CALLBACK_BYTES = 64
+
+CallbackData = namedtuple("CallbackData", ["action", "args", "version"])
+
+
+class Action(IntEnum):
+    """Короткие коды действий для inline-кнопок"""
+    PROMO = 1
+    DELETE = 2
+    CONFIRM_DELETE = 3
+    CANCEL_DELETE = 4
+    SHOP = 5
+    SHOP_ALL = 6
+    SHOPS_DONE = 7
+    SEND_PROMO = 8
+    SEND_SHOP = 9
+    SEND_ALL = 10
+    SEND_DONE = 11
+    EDIT = 12
+    EDIT_SHOP = 13
+    EDIT_DONE = 14
+    SHOP_GROUP = 15
+    EDIT_ALL = 16
+    EDIT_GROUP = 17
+    BULK_CONFIRM = 18
+    BULK_CANCEL = 19
+    DIGEST_PROMO = 20
+    BROADCAST_CANCEL = 21
+
+
+# Старые строковые форматы, которые ещё остались на кнопках в чатах
+_LEGACY_PATTERNS = [
+    (re.compile(r"^confirm_delete_(-?\d+)$"), Action.CONFIRM_DELETE),
+    (re.compile(r"^cancel_delete$"), Action.CANCEL_DELETE),
+    (re.compile(r"^promo_(-?\d+)$"), Action.PROMO),
+    (re.compile(r"^delete_(-?\d+)$"), Action.DELETE),
+]
+
+
+def _zigzag(value):
+    return -value * 2 - 1 if value < 0 else value * 2
+
+
+def _unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def _write_varint(buf, value):
+    while value > 0x7F:
+        buf.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def _read_varints(raw, pos):
+    values = []
+    value = shift = 0
+    for byte in raw[pos:]:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        values.append(value)
+        value = shift = 0
+    if shift:
+        raise ValueError("Обрезанный varint в callback_data")
+    return values
+
+
+def pack(action, *args):
+    """Упаковка действия и целочисленных аргументов в callback_data"""
+    buf = bytearray((VERSION, int(action)))
+    for value in args:
+        _write_varint(buf, _zigzag(int(value)))
+
+    data = base64.urlsafe_b64encode(bytes(buf)).rstrip(b"=").decode("ascii")
+    if len(data) > MAX_CALLBACK_BYTES:
+        raise ValueError(f"callback_data длиннее {MAX_CALLBACK_BYTES} байт: {len(data)}")
+    return data
+
+
+@lru_cache(maxsize=1024)
+def unpack(data):
+    """Распаковка callback_data. Возвращает None для неизвестных данных"""
+    if not isinstance(data, str) or not data:
+        return None
+
+    for pattern, action in _LEGACY_PATTERNS:
+        match = pattern.match(data)
+        if match:
+            return CallbackData(action, tuple(int(g) for g in match.groups()), 0)
+
+    try:
+        raw = base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+        if len(raw) < 2 or raw[0] != VERSION:
+            return None
+        action = Action(raw[1])
+        args = tuple(_unzigzag(v) for v in _read_varints(raw, 2))
+    except ValueError:
+        return None
+    return CallbackData(action, args, raw[0])
+
+
+def matches(*actions):
+    """Фильтр для CallbackQueryHandler по набору кодов действий"""
+    allowed = frozenset(actions)
+
+    def check(data):
+        callback = unpack(data)
+        return callback is not None and callback.action in allowed
+
+    return check
+
+
+class CallbackRouter:
+    """Единый маршрутизатор callback-запросов по коду действия"""
+
+    def __init__(self):
+        self._routes = {}
+
+    def add(self, action, callback):
+        if action in self._routes:
+            raise ValueError(f"Для действия {action!r} уже зарегистрирован обработчик")
+        self._routes[action] = callback
+
+    def route(self, action):
+        def decorator(callback):
+            self.add(action, callback)
+            return callback
+        return decorator
+
+    def pattern(self):
+        """Фильтр, пропускающий только зарегистрированные действия"""
+        def check(data):
+            callback = unpack(data)
+            return callback is not None and callback.action in self._routes
+
+        return check
+
+    async def dispatch(self, update, context):
+        callback = unpack(update.callback_query.data)
+        handler = self._routes.get(callback.action) if callback else None
+        if handler is None:
+            await update.callback_query.answer("Кнопка устарела.")
+            return None
+        return await handler(update, context)
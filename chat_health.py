@@ -0,0 +1,82 @@
+import sqlite3
+import time
+
+
+class ChatHealth:
+    """Учет доступности чатов для рассылок.
+
+    После каждой ошибки доступа чат исключается из рассылок на
+    экспоненциально растущий срок, а после max_failures ошибок подряд
+    помечается как недоступный до повторной регистрации.
+    """
+
+    def __init__(self, filepath, base_delay=3600, max_failures=5):
+        self.base_delay = base_delay
+        self.max_failures = max_failures
+        self._conn = sqlite3.connect(filepath, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chat_health ("
+            "chat_id INTEGER PRIMARY KEY, failures INTEGER NOT NULL, "
+            "retry_at REAL NOT NULL, dead INTEGER NOT NULL, reason TEXT)"
+        )
+        self._state = {
+            chat_id: [failures, retry_at, bool(dead), reason]
+            for chat_id, failures, retry_at, dead, reason in self._conn.execute(
+                "SELECT chat_id, failures, retry_at, dead, reason FROM chat_health"
+            )
+        }
+        self._events = []
+
+    def _save(self, chat_id):
+        failures, retry_at, dead, reason = self._state[chat_id]
+        self._conn.execute(
+            "INSERT INTO chat_health (chat_id, failures, retry_at, dead, reason) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(chat_id) DO UPDATE SET failures = excluded.failures, "
+            "retry_at = excluded.retry_at, dead = excluded.dead, reason = excluded.reason",
+            (chat_id, failures, retry_at, int(dead), reason)
+        )
+
+    def _forget(self, chat_id):
+        if self._state.pop(chat_id, None) is not None:
+            self._conn.execute("DELETE FROM chat_health WHERE chat_id = ?", (chat_id,))
+
+    def is_available(self, chat_id, now=None):
+        state = self._state.get(int(chat_id))
+        if state is None:
+            return True
+        return not state[2] and state[1] <= (now or time.time())
+
+    def is_dead(self, chat_id):
+        state = self._state.get(int(chat_id))
+        return bool(state and state[2])
+
+    def record_success(self, chat_id):
+        self._forget(int(chat_id))
+
+    def record_failure(self, chat_id, reason, name=None):
+        """Учет ошибки доступа. Возвращает True, если чат стал недоступным"""
+        chat_id = int(chat_id)
+        state = self._state.setdefault(chat_id, [0, 0.0, False, None])
+        state[0] += 1
+        state[3] = reason
+        if state[0] >= self.max_failures:
+            state[2] = True
+            self._events.append(("dead", chat_id, name, reason))
+        else:
+            state[1] = time.time() + self.base_delay * 2 ** (state[0] - 1)
+        self._save(chat_id)
+        return state[2]
+
+    def record_migration(self, old_chat_id, new_chat_id, name=None):
+        self._forget(int(old_chat_id))
+        self._events.append(("migrated", int(old_chat_id), name, int(new_chat_id)))
+
+    def revive(self, chat_id):
+        """Сброс состояния после повторной регистрации чата"""
+        self._forget(int(chat_id))
+
+    def pop_events(self):
+        """События (dead/migrated) с момента прошлого отчета"""
+        events, self._events = self._events, []
+        return events
@@ -8,3 +8,109 @@ ADMIN_IDS = [474524297, 498555520]
 # Пути к файлам
 DATA_FILE = "data.json"
 CHAT_IDS_FILE = "chat_ids.json"
+CHAT_SETTINGS_FILE = "chat_settings.json"
+
+# База состояний диалогов, user_data и смещения обновлений
+STATE_DB_FILE = "bot_state.sqlite3"
+
+# Число одновременных загрузок фото при массовом импорте
+IMPORT_PHOTO_CONCURRENCY = 8
+
+# Журнал изменений каталога: каталог истории, срок хранения и период сжатия (сек)
+HISTORY_DIR = "history"
+HISTORY_RETENTION_DAYS = 30
+JOURNAL_COMPACT_INTERVAL = 600
+
+# Сколько дней хранить записи журнала доставок
+LEDGER_RETENTION_DAYS = 7
+
+# Доступность чатов: первая пауза после ошибки доступа (сек) и число ошибок до исключения
+CHAT_RETRY_BASE_DELAY = 3600
+CHAT_MAX_FAILURES = 5
+
+# Inline-поиск: результатов на страницу и время кэширования ответа на стороне Telegram (сек)
+INLINE_PAGE_SIZE = 20
+INLINE_CACHE_TIME = 60
+
+# Часовой пояс по умолчанию и местное время ежедневной рассылки
+DEFAULT_TIMEZONE = "Europe/Moscow"
+DIGEST_HOUR = 20
+DIGEST_MINUTE = 39
+
+# Окно, по которому распределяется ежедневная рассылка (сек)
+DIGEST_WINDOW_SECONDS = 900
+
+# Вид ежедневной рассылки по умолчанию: "photos" — три фото акций,
+# "pinned" — одно закрепленное сообщение, которое правится при изменении списка.
+# Акций в закрепленной подборке не больше PINNED_DIGEST_MAX_BUTTONS
+DEFAULT_DIGEST_MODE = "photos"
+PINNED_DIGEST_MAX_BUTTONS = 50
+
+# Боты, обслуживаемые одним процессом. У каждого свои токен, администраторы
+# и каталог данных (data_dir) с акциями, магазинами и базой состояний.
+TENANTS = [
+    {"name": "main", "token": TOKEN, "admin_ids": ADMIN_IDS, "data_dir": "."},
+]
+
+# Размер общего пула HTTP-соединений к Bot API для всех ботов процесса
+HTTP_POOL_SIZE = 64
+
+# Логирование: общий уровень, уровни подсистем, файл (None — только stderr)
+# и ограничение частых сообщений: не более LOG_RATE_LIMIT записей
+# за LOG_RATE_WINDOW секунд с одного места в коде
+LOG_LEVEL = "INFO"
+LOG_LEVELS = {"httpx": "WARNING", "apscheduler": "WARNING"}
+LOG_FILE = None
+LOG_RATE_LIMIT = 20
+LOG_RATE_WINDOW = 60
+
+# Профилирование командой /profile: длительность по умолчанию и максимальная (сек)
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_MAX_SECONDS = 300
+
+# Контроль задержки цикла событий: период замера и порог блокировки,
+# после которого в лог пишется стек блокирующего вызова (сек)
+LOOP_LAG_INTERVAL = 0.1
+LOOP_LAG_THRESHOLD = 0.25
+
+# Незавершенный диалог отменяется после стольких секунд бездействия;
+# период проверки брошенных данных диалогов (сек)
+CONVERSATION_TIMEOUT = 900
+CONVERSATION_SWEEP_INTERVAL = 300
+
+# Группы магазинов (регион, город, формат), на которые можно ссылаться в акциях
+SHOP_GROUPS_FILE = "shop_groups.json"
+
+# Таблица интернирования ID чатов для битовых масок адресатов акций
+CHAT_INDEX_FILE = "chat_index.json"
+
+# Исходящие запросы к Bot API: общий лимит в секунду и запас из него,
+# который рассылки оставляют для ответов пользователям
+SEND_RATE = 30
+SEND_INTERACTIVE_RESERVE = 5
+
+# Период сброса счетчиков просмотров и доставок акций в базу (сек)
+ANALYTICS_FLUSH_INTERVAL = 60
+
+# Правка подписей и отзыв разосланных акций: период проверки изменений (сек),
+# число одновременных запросов и срок хранения записей — окно, в котором
+# Telegram позволяет боту удалять свои сообщения (сек)
+SENT_SYNC_INTERVAL = 15
+SENT_SYNC_CONCURRENCY = 8
+SENT_MESSAGE_RETENTION = 48 * 3600
+
+# Фоновые рассылки: число одновременных отправок и период обновления
+# сообщения с ходом рассылки у администратора (сек)
+BROADCAST_CONCURRENCY = 4
+BROADCAST_PROGRESS_INTERVAL = 5
+
+# Ограничение частоты /promotions и нажатий на кнопки акций: пополнение
+# корзины в запросах в секунду и ее объем для пользователя и для чата,
+# окно, в котором повтор того же нажатия игнорируется (сек), и число
+# корзин в памяти, после которого вытесняются давно не использованные
+THROTTLE_USER_RATE = 0.5
+THROTTLE_USER_BURST = 5
+THROTTLE_CHAT_RATE = 2
+THROTTLE_CHAT_BURST = 20
+THROTTLE_REPEAT_WINDOW = 3
+THROTTLE_MAX_KEYS = 10_000
@@ -0,0 +1,83 @@
+import re
+from datetime import date
+
+# Разбор диапазона дат акции из сообщения администратора.
+#
+# Поддерживаются:
+#   03.06.2025 - 31.07.2025, 03.06 - 31.07.2025, с 3.6.25 по 31.7.25
+#   с 4 по 28 июля 2025 года, 4-28 июля
+#   с 4 июня по 28 июля 2025, с 28 декабря 2025 по 5 января 2026
+# Месяц — в любом падеже или сокращением (июль, июля, июле, июл.).
+# Без года берется текущий; начало без года, которое позже конца,
+# относится к предыдущему году. Все шаблоны компилируются один раз.
+
+_SEPARATOR = r"\s*(?:по|до|-|–|—)\s*"
+_YEAR = r"(?:\d{4}|\d{2})"
+_YEAR_SUFFIX = r"(?:\s*(?:года|год|гг|г)\.?)?"
+
+_NUMERIC_RE = re.compile(
+    rf"^(?:с\s*)?(?P<d1>\d{{1,2}})\.(?P<m1>\d{{1,2}})(?:\.(?P<y1>{_YEAR}){_YEAR_SUFFIX})?"
+    rf"{_SEPARATOR}"
+    rf"(?P<d2>\d{{1,2}})\.(?P<m2>\d{{1,2}})(?:\.(?P<y2>{_YEAR}){_YEAR_SUFFIX})?$"
+)
+_WORDS_RE = re.compile(
+    rf"^(?:с\s+)?(?P<d1>\d{{1,2}})(?:\s+(?P<m1>[а-я]+)\.?)?(?:\s+(?P<y1>\d{{4}}){_YEAR_SUFFIX})?"
+    rf"{_SEPARATOR}"
+    rf"(?P<d2>\d{{1,2}})\s+(?P<m2>[а-я]+)\.?(?:\s+(?P<y2>\d{{4}}){_YEAR_SUFFIX})?$"
+)
+
+# Основа месяца -> номер; «мар» проверяется отдельно от «ма[йяе]»
+_MONTH_RE = re.compile(r"^(янв|фев|мар|апр|ма[йяе]|июн|июл|авг|сен|окт|ноя|дек)")
+_MONTHS = {
+    "янв": 1, "фев": 2, "мар": 3, "апр": 4, "май": 5, "мая": 5, "мае": 5, "июн": 6,
+    "июл": 7, "авг": 8, "сен": 9, "окт": 10, "ноя": 11, "дек": 12,
+}
+
+FORMAT_HINT = "03.06.2025 - 31.07.2025 или с 4 июня по 28 июля 2025 года"
+
+
+def month_number(word):
+    """Номер месяца по названию в любом падеже или сокращению"""
+    match = _MONTH_RE.match(word)
+    if not match:
+        raise ValueError(f"Неизвестный месяц: {word}")
+    return _MONTHS[match.group(1)]
+
+
+def _normalize(text):
+    return " ".join(text.lower().replace("ё", "е").split()).rstrip(". ")
+
+
+def _full_year(value):
+    year = int(value)
+    return year + 2000 if year < 100 else year
+
+
+def parse_date_range(text, today=None):
+    """Текст -> (дата начала, дата окончания). ValueError, если формат не распознан"""
+    text = _normalize(text)
+    match = _NUMERIC_RE.match(text)
+    if match:
+        m1, m2 = int(match["m1"]), int(match["m2"])
+    else:
+        match = _WORDS_RE.match(text)
+        if not match:
+            raise ValueError("Не удалось распознать даты.")
+        m2 = month_number(match["m2"])
+        m1 = month_number(match["m1"]) if match["m1"] else m2
+
+    d1, d2 = int(match["d1"]), int(match["d2"])
+    y2 = _full_year(match["y2"]) if match["y2"] else (today or date.today()).year
+    if match["y1"]:
+        y1 = _full_year(match["y1"])
+    else:
+        # «с 28 декабря по 5 января 2026» — начало в предыдущем году
+        y1 = y2 - 1 if m1 > m2 else y2
+
+    try:
+        start, end = date(y1, m1, d1), date(y2, m2, d2)
+    except ValueError:
+        raise ValueError("Такой даты не существует.") from None
+    if start > end:
+        raise ValueError("Дата начала позже даты окончания.")
+    return start, end
@@ -0,0 +1,90 @@
+import hashlib
+import math
+import sqlite3
+from datetime import date, timedelta
+
+
+class BloomFilter:
+    """Компактный фильтр Блума: ложные срабатывания возможны, пропуски — нет"""
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class DeliveryLedger:
+    """Журнал доставок (чат, акция, вид рассылки, день) для защиты от дублей.
+
+    Проверка идет сначала по фильтру Блума в памяти, и только при возможном
+    совпадении — по таблице SQLite. Ключи, отправка которых еще идет,
+    держатся в памяти, чтобы параллельные рассылки не отправили акцию дважды.
+    """
+
+    def __init__(self, filepath, retention_days=7, capacity=100_000):
+        self.retention_days = retention_days
+        self.capacity = capacity
+        self._conn = sqlite3.connect(filepath, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS deliveries (key TEXT PRIMARY KEY, day TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS deliveries_day ON deliveries (day)")
+        self._in_flight = set()
+        self._rebuild_filter()
+
+    @staticmethod
+    def key(chat_id, promo_id, kind, day):
+        return f"{int(chat_id)}:{promo_id}:{kind}:{day}"
+
+    def _rebuild_filter(self):
+        self._filter = BloomFilter(self.capacity)
+        for (key,) in self._conn.execute("SELECT key FROM deliveries"):
+            self._filter.add(key)
+
+    def was_sent(self, key):
+        if key not in self._filter:
+            return False
+        row = self._conn.execute("SELECT 1 FROM deliveries WHERE key = ?", (key,)).fetchone()
+        return row is not None
+
+    def claim(self, key):
+        """Резервирует доставку. False, если она уже выполнена или выполняется"""
+        if key in self._in_flight or self.was_sent(key):
+            return False
+        self._in_flight.add(key)
+        return True
+
+    def confirm(self, key):
+        """Отмечает доставку выполненной"""
+        self._in_flight.discard(key)
+        day = key.rsplit(":", 1)[1]
+        self._conn.execute("INSERT OR IGNORE INTO deliveries (key, day) VALUES (?, ?)", (key, day))
+        self._filter.add(key)
+
+    def release(self, key):
+        """Снимает резерв после неудачной отправки"""
+        self._in_flight.discard(key)
+
+    def expire(self, today=None):
+        """Удаление записей старше срока хранения и перестройка фильтра"""
+        cutoff = (today or date.today()) - timedelta(days=self.retention_days)
+        removed = self._conn.execute(
+            "DELETE FROM deliveries WHERE day < ?", (cutoff.isoformat(),)
+        ).rowcount
+        self._rebuild_filter()
+        return removed
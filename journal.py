@@ -0,0 +1,266 @@
+import asyncio
+import json
+import os
+import time
+
+# Журнал изменений каталога акций.
+#
+# Каждое изменение (добавление, удаление, правка, истечение) дописывается
+# в конец файла журнала одной JSON-строкой. Снимок каталога (data.json)
+# переписывается только при фоновом сжатии. Все операции идемпотентны,
+# поэтому повторное применение записи поверх снимка безопасно.
+
+
+def _default(obj):
+    if isinstance(obj, set):
+        return list(obj)
+    raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
+
+
+def _dumps(obj, **kwargs):
+    return json.dumps(obj, ensure_ascii=False, default=_default, **kwargs)
+
+
+def apply_record(catalog, record):
+    """Применение одной записи журнала к каталогу"""
+    op = record["op"]
+    if op == "put":
+        catalog[record["id"]] = record["data"]
+    elif op == "patch":
+        if record["id"] in catalog:
+            catalog[record["id"]].update(record["data"])
+    elif op == "delete":
+        catalog.pop(record["id"], None)
+    elif op == "reset":
+        catalog.clear()
+        catalog.update(record["data"])
+    else:
+        raise ValueError(f"Неизвестная операция журнала: {op}")
+
+
+def _iter_file(path):
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # Недописанная последняя строка после аварийной остановки
+                continue
+
+
+def _stamp(ts):
+    return f"{int(ts * 1000):015d}"
+
+
+def _photo_key(path):
+    """Путь к фото в одном виде: /import сохраняет пути вида ./photos/x.jpg"""
+    return os.path.realpath(path)
+
+
+def _record_photos(record):
+    data = record.get("data") or {}
+    promos = data.values() if record["op"] == "reset" else [data]
+    return [p.get("photo") for p in promos]
+
+
+class CatalogJournal:
+    """Журнал изменений каталога со сжатием и восстановлением на момент времени"""
+
+    def __init__(self, snapshot_path, history_dir, photos_dir=None, retention_days=30):
+        self.snapshot_path = snapshot_path
+        self.journal_path = os.path.splitext(snapshot_path)[0] + ".journal"
+        self.history_dir = history_dir
+        self.photos_dir = photos_dir
+        self.retention = retention_days * 86400
+        self.pending = 0
+        # Подписчики, получающие каждую пачку записей после ее сохранения
+        self.listeners = []
+        self._compacting_path = self.journal_path + ".compacting"
+        self._compacting = False
+        self._file = None
+        # Фото -> время последней ссылки на него в снимке или записи журнала.
+        # Обновляется при каждой записи, чтобы сборка фото при сжатии
+        # не перечитывала всю историю
+        self._photo_refs = {}
+        self._history_start = 0
+
+    # Загрузка
+    def replay(self, catalog):
+        """Применение хвоста журнала к загруженному снимку и открытие журнала на запись"""
+        if os.path.exists(self._compacting_path):
+            # Сжатие было прервано: склеиваем незавершенный сегмент с текущим журналом
+            with open(self._compacting_path, "a", encoding="utf-8") as dst:
+                for record in _iter_file(self.journal_path):
+                    dst.write(_dumps(record) + "\n")
+            os.replace(self._compacting_path, self.journal_path)
+
+        for record in _iter_file(self.journal_path):
+            apply_record(catalog, record)
+            self.pending += 1
+
+        os.makedirs(self.history_dir, exist_ok=True)
+        if not self._history_files("snapshot-"):
+            self._write_history_snapshot(_dumps(catalog, indent=2), time.time())
+        if self.photos_dir:
+            self._load_photo_refs()
+
+        self._file = open(self.journal_path, "a", encoding="utf-8")
+        return catalog
+
+    # Запись изменений
+    def append(self, records):
+        """Дописывание пачки записей одной операцией записи"""
+        now = time.time()
+        lines = []
+        for record in records:
+            record.setdefault("ts", now)
+            lines.append(_dumps(record) + "\n")
+        self._file.write("".join(lines))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.pending += len(lines)
+        for record in records:
+            self._note_photos(_record_photos(record), record["ts"])
+        for listener in self.listeners:
+            listener(records)
+
+    def put(self, promo_id, promo, reason=None):
+        self.append([self.record("put", promo_id, promo, reason)])
+
+    def patch(self, promo_id, fields, reason=None):
+        self.append([self.record("patch", promo_id, fields, reason)])
+
+    def delete(self, promo_id, reason=None):
+        self.append([self.record("delete", promo_id, None, reason)])
+
+    def reset(self, catalog, reason=None):
+        self.append([self.record("reset", None, catalog, reason)])
+
+    @staticmethod
+    def record(op, promo_id, data=None, reason=None):
+        record = {"op": op, "id": promo_id, "data": data}
+        if reason:
+            record["reason"] = reason
+        return record
+
+    # Сжатие
+    async def compact(self, catalog):
+        """Запись нового снимка и перенос журнала в историю. Возвращает True, если сжатие выполнено"""
+        if self._compacting or not self.pending:
+            return False
+        self._compacting = True
+        try:
+            # Снимок и ротация журнала делаются в одной точке цикла событий,
+            # поэтому между ними не может попасть ни одна запись
+            snapshot = _dumps(catalog, indent=2)
+            ts = time.time()
+            self._note_photos((p.get("photo") for p in catalog.values()), ts)
+            # Ссылки до начала хранимой истории больше не нужны
+            self._photo_refs = {k: v for k, v in self._photo_refs.items() if v >= self._history_start}
+            photo_refs = dict(self._photo_refs)
+            self._file.close()
+            os.replace(self.journal_path, self._compacting_path)
+            self._file = open(self.journal_path, "a", encoding="utf-8")
+            self.pending = 0
+            await asyncio.to_thread(self._finish_compaction, snapshot, ts, photo_refs)
+        finally:
+            self._compacting = False
+        return True
+
+    def _finish_compaction(self, snapshot, ts, photo_refs):
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+        os.replace(self._compacting_path, os.path.join(self.history_dir, f"journal-{_stamp(ts)}.jsonl"))
+        self._write_history_snapshot(snapshot, ts)
+        self._prune_history(ts, photo_refs)
+
+    def _write_history_snapshot(self, snapshot, ts):
+        with open(os.path.join(self.history_dir, f"snapshot-{_stamp(ts)}.json"), "w", encoding="utf-8") as f:
+            f.write(snapshot)
+
+    def _history_files(self, prefix):
+        """Файлы истории с префиксом, отсортированные по времени: [(stamp, path)]"""
+        if not os.path.isdir(self.history_dir):
+            return []
+        files = []
+        for name in os.listdir(self.history_dir):
+            if name.startswith(prefix):
+                stamp = int(name[len(prefix):].split(".")[0]) / 1000
+                files.append((stamp, os.path.join(self.history_dir, name)))
+        return sorted(files)
+
+    def _prune_history(self, now, photo_refs):
+        """Удаление истории старше срока хранения и неиспользуемых фото"""
+        cutoff = now - self.retention
+        snapshots = self._history_files("snapshot-")
+        # Последний снимок до границы нужен как основа для восстановления
+        older = [s for s in snapshots if s[0] <= cutoff]
+        keep_from = older[-1][0] if older else cutoff
+        for stamp, path in snapshots + self._history_files("journal-"):
+            if stamp < keep_from:
+                os.remove(path)
+        self._history_start = keep_from
+
+        if self.photos_dir:
+            self._collect_photos(cutoff, keep_from, photo_refs)
+
+    def _note_photos(self, photos, ts):
+        for photo in photos:
+            if isinstance(photo, str):
+                key = _photo_key(photo)
+                if self._photo_refs.get(key, 0) < ts:
+                    self._photo_refs[key] = ts
+
+    def _load_photo_refs(self):
+        """Начальный набор ссылок на фото по всей хранимой истории (один раз при загрузке)"""
+        for stamp, path in self._history_files("snapshot-"):
+            with open(path, "r", encoding="utf-8") as f:
+                self._note_photos((p.get("photo") for p in json.load(f).values()), stamp)
+        sources = [path for _, path in self._history_files("journal-")] + [self.journal_path]
+        for path in sources:
+            for record in _iter_file(path):
+                self._note_photos(_record_photos(record), record.get("ts", 0))
+        snapshots = self._history_files("snapshot-")
+        self._history_start = snapshots[0][0] if snapshots else 0
+
+    def _collect_photos(self, cutoff, keep_from, photo_refs):
+        """Удаление фото, на которые не ссылается ни каталог, ни хранимая история"""
+        for name in os.listdir(self.photos_dir):
+            path = os.path.join(self.photos_dir, name)
+            if photo_refs.get(_photo_key(path), 0) < keep_from and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+
+    # Восстановление
+    def restore(self, ts):
+        """Состояние каталога на момент времени ts (unix time)"""
+        catalog = {}
+        base_ts = 0
+        for stamp, path in self._history_files("snapshot-"):
+            if stamp > ts:
+                break
+            base_ts = stamp
+            with open(path, "r", encoding="utf-8") as f:
+                catalog = json.load(f)
+
+        sources = [path for stamp, path in self._history_files("journal-") if stamp > base_ts]
+        sources += [self._compacting_path, self.journal_path]
+        for path in sources:
+            for record in _iter_file(path):
+                if base_ts < record["ts"] <= ts:
+                    apply_record(catalog, record)
+        return catalog
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
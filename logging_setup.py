@@ -0,0 +1,136 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from datetime import datetime, timezone
+
+# Асинхронное структурированное логирование.
+#
+# Обработчики в цикле событий только кладут запись в очередь, форматирование
+# в JSON и запись в stderr/файл выполняет фоновый поток QueueListener.
+# Частые сообщения из горячих мест ограничиваются по месту вызова, поэтому
+# отбрасываемые записи даже не попадают в очередь.
+
+LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+
+# Стандартные атрибуты LogRecord; все остальное — поля, переданные через extra=
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись: время, уровень, подсистема, сообщение и поля extra"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """Не более limit записей за window секунд с одного места вызова.
+
+    Ограничиваются только записи ниже max_level, предупреждения и ошибки
+    проходят всегда. Число пропущенных записей добавляется к следующей
+    пропущенной фильтром записи в поле suppressed.
+    """
+
+    def __init__(self, limit=20, window=60, max_level=logging.WARNING):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.max_level = max_level
+        # (модуль, строка) -> [начало окна, записей в окне, пропущено]
+        self._sites = {}
+
+    def filter(self, record):
+        if record.levelno >= self.max_level:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        site = self._sites.get(key)
+        if site is None or now - site[0] >= self.window:
+            suppressed = site[2] if site else 0
+            self._sites[key] = [now, 1, 0]
+            if suppressed:
+                record.suppressed = suppressed
+            return True
+        if site[1] < self.limit:
+            site[1] += 1
+            return True
+        site[2] += 1
+        return False
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    _exc_formatter = logging.Formatter()
+
+    def prepare(self, record):
+        # Сообщение и стек собираются в потоке вызова в текстовом виде,
+        # чтобы в очередь не попадали живые объекты
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(level="INFO", levels=None, log_file=None, rate_limit=20, rate_window=60):
+    """Настройка корневого логгера. Возвращает запущенный QueueListener"""
+    handlers = [logging.StreamHandler(sys.stderr)]
+    if log_file:
+        handlers.append(logging.handlers.WatchedFileHandler(log_file, encoding="utf-8"))
+    formatter = JsonFormatter()
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(rate_limit, rate_window))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    for name, subsystem_level in (levels or {}).items():
+        logging.getLogger(name).setLevel(subsystem_level)
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def set_level(name, level):
+    """Смена уровня подсистемы во время работы; name="root" — корневой логгер"""
+    level = level.upper()
+    if level not in LEVELS:
+        raise ValueError(f"Неизвестный уровень: {level}")
+    logging.getLogger(None if name == "root" else name).setLevel(level)
+
+
+def current_levels():
+    """Явно заданные уровни логгеров: {имя: уровень}"""
+    levels = {"root": logging.getLevelName(logging.getLogger().level)}
+    for name, item in sorted(logging.Logger.manager.loggerDict.items()):
+        if isinstance(item, logging.Logger) and item.level != logging.NOTSET:
+            levels[name] = logging.getLevelName(item.level)
+    return levels
@@ -0,0 +1,102 @@
+import asyncio
+import collections
+import logging
+import sys
+import threading
+import time
+import traceback
+
+logger = logging.getLogger("bot.loop")
+
+
+class LoopMonitor:
+    """Наблюдение за задержкой цикла событий.
+
+    Задача-пульс засыпает на interval и измеряет, насколько позже она
+    проснулась. Сторожевой поток проверяет пульс и, если цикл не отвечает
+    дольше threshold, записывает в лог стек вызова, который его держит.
+    """
+
+    def __init__(self, interval=0.1, threshold=0.25, history=3000):
+        self.interval = interval
+        self.threshold = threshold
+        self.lags = collections.deque(maxlen=history)
+        self.stalls = 0
+        self.max_lag = 0.0
+        self._beat = 0
+        self._beat_at = 0.0
+        self._reported_beat = -1
+        self._loop_thread = None
+        self._task = None
+        self._stop = threading.Event()
+        self._watchdog = None
+
+    def start(self):
+        """Запуск из работающего цикла событий"""
+        self._loop_thread = threading.get_ident()
+        self._beat_at = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._watchdog:
+            self._watchdog.join()
+
+    async def _heartbeat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - started - self.interval)
+            self.lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            self._beat += 1
+            self._beat_at = time.monotonic()
+            if lag >= self.threshold:
+                self.stalls += 1
+                logger.warning(
+                    f"Цикл событий был заблокирован на {lag * 1000:.0f} мс",
+                    extra={"lag_ms": round(lag * 1000)}
+                )
+
+    def _watch(self):
+        while not self._stop.wait(self.threshold / 2):
+            beat = self._beat
+            stalled = time.monotonic() - self._beat_at - self.interval
+            if stalled < self.threshold or beat == self._reported_beat:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            # Один стек на каждую блокировку: следующий — только после нового пульса
+            self._reported_beat = beat
+            stack = "".join(traceback.format_stack(frame))
+            logger.warning(
+                f"Цикл событий не отвечает {stalled * 1000:.0f} мс, блокирующий вызов:\n{stack}",
+                extra={"lag_ms": round(stalled * 1000)}
+            )
+
+    def percentiles(self, points=(50, 90, 99)):
+        """Перцентили задержки за последние измерения, в секундах"""
+        lags = sorted(self.lags)
+        if not lags:
+            return {p: 0.0 for p in points}
+        return {p: lags[min(len(lags) - 1, int(len(lags) * p / 100))] for p in points}
+
+    def summary(self):
+        """Текстовая сводка для администратора"""
+        values = self.percentiles()
+        lines = [f"Задержка цикла событий за последние {len(self.lags)} измерений:"]
+        lines += [f"p{p}: {lag * 1000:.1f} мс" for p, lag in values.items()]
+        lines.append(f"максимум с запуска: {self.max_lag * 1000:.1f} мс")
+        lines.append(f"блокировок дольше {self.threshold * 1000:.0f} мс: {self.stalls}")
+        return "\n".join(lines)
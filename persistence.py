@@ -0,0 +1,206 @@
+import json
+import pickle
+import sqlite3
+import time
+from copy import deepcopy
+
+from telegram.ext import Application, BasePersistence, PersistenceInput
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_data (user_id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS chat_data (chat_id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    state TEXT NOT NULL,
+    updated_at REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (name, key)
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value BLOB NOT NULL);
+"""
+
+# Сколько Telegram хранит неполученные обновления (сек). Сохраненное смещение
+# старше этого срока не используется: таких обновлений уже не придет, а после
+# недели без обновлений Telegram начинает нумерацию со случайного id
+UPDATE_RETENTION = 24 * 3600
+
+
+class SQLitePersistence(BasePersistence):
+    """Хранение состояний диалогов, user_data и смещения обновлений в SQLite.
+
+    В отличие от PicklePersistence, файл не переписывается целиком:
+    каждое изменение — это UPSERT одной строки. Изменения копятся в памяти
+    и записываются одной транзакцией вместе со смещением обработанных
+    обновлений при сбросе состояния (commit), так что после сбоя смещение
+    не опережает сохраненные user_data и диалоги.
+
+    Если задан conversation_ttl (сек), диалоги без изменений дольше этого
+    срока не восстанавливаются после перезапуска: их таймеры
+    conversation_timeout не переживают остановку процесса.
+    """
+
+    def __init__(self, filepath, store_data=None, update_interval=5, conversation_ttl=None):
+        super().__init__(
+            store_data=store_data or PersistenceInput(bot_data=False, callback_data=False),
+            update_interval=update_interval
+        )
+        self.filepath = filepath
+        self.conversation_ttl = conversation_ttl
+        self._conn = sqlite3.connect(filepath, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(conversations)")}
+        if "updated_at" not in columns:
+            self._conn.execute("ALTER TABLE conversations ADD COLUMN updated_at REAL NOT NULL DEFAULT 0")
+        self._pending = []
+        self._processed_offset = self._saved_offset = 0
+        # Смещение прошлого запуска: (id обновления, время сохранения)
+        saved = self._get_meta("update_offset")
+        fresh = isinstance(saved, tuple) and time.time() - saved[1] < UPDATE_RETENTION
+        self._restored_offset = saved[0] if fresh else 0
+
+    def _get_meta(self, key, default=None):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return pickle.loads(row[0]) if row else default
+
+    def _load_table(self, table, id_column):
+        rows = self._conn.execute(f"SELECT {id_column}, data FROM {table}").fetchall()
+        return {row_id: pickle.loads(blob) for row_id, blob in rows}
+
+    def _write(self, sql, params):
+        """Отложенная запись до следующего commit"""
+        self._pending.append((sql, params))
+
+    def _upsert(self, table, id_column, row_id, data):
+        self._write(
+            f"INSERT INTO {table} ({id_column}, data) VALUES (?, ?) "
+            f"ON CONFLICT({id_column}) DO UPDATE SET data = excluded.data",
+            (row_id, pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+        )
+
+    def _write_meta(self, key, value):
+        self._write(
+            "INSERT INTO meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        )
+
+    def commit(self):
+        """Запись накопленных изменений и смещения обновлений одной транзакцией"""
+        if self._processed_offset != self._saved_offset:
+            self._write_meta("update_offset", (self._processed_offset, time.time()))
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        self._conn.execute("BEGIN")
+        try:
+            for sql, params in pending:
+                self._conn.execute(sql, params)
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            self._pending = pending + self._pending
+            raise
+        self._conn.execute("COMMIT")
+        self._saved_offset = self._processed_offset
+
+    # Смещение обработанных обновлений
+    def skip_update(self, update_id):
+        """True, если обновление уже обработано до перезапуска.
+
+        Id сравниваются только с сохраненным смещением прошлого запуска и
+        только до первого нового обновления: дальше Telegram присылает
+        обновления по порядку, а нумерация между запусками может начаться заново.
+        """
+        if update_id <= self._restored_offset:
+            return True
+        self._restored_offset = 0
+        return False
+
+    def mark_update_processed(self, update_id):
+        """Запоминает id последнего полностью обработанного обновления"""
+        self._processed_offset = update_id
+
+    # user_data / chat_data
+    async def get_user_data(self):
+        return self._load_table("user_data", "user_id")
+
+    async def update_user_data(self, user_id, data):
+        self._upsert("user_data", "user_id", user_id, data)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def drop_user_data(self, user_id):
+        self._write("DELETE FROM user_data WHERE user_id = ?", (user_id,))
+
+    async def get_chat_data(self):
+        return self._load_table("chat_data", "chat_id")
+
+    async def update_chat_data(self, chat_id, data):
+        self._upsert("chat_data", "chat_id", chat_id, data)
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        self._write("DELETE FROM chat_data WHERE chat_id = ?", (chat_id,))
+
+    # bot_data / callback_data
+    async def get_bot_data(self):
+        return self._get_meta("bot_data", {})
+
+    async def update_bot_data(self, data):
+        self._write_meta("bot_data", data)
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def get_callback_data(self):
+        return deepcopy(self._get_meta("callback_data"))
+
+    async def update_callback_data(self, data):
+        self._write_meta("callback_data", data)
+
+    # Состояния ConversationHandler
+    async def get_conversations(self, name):
+        if self.conversation_ttl:
+            self._conn.execute(
+                "DELETE FROM conversations WHERE name = ? AND updated_at < ?",
+                (name, time.time() - self.conversation_ttl)
+            )
+        rows = self._conn.execute(
+            "SELECT key, state FROM conversations WHERE name = ?", (name,)
+        ).fetchall()
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+
+    async def update_conversation(self, name, key, new_state):
+        key_json = json.dumps(list(key))
+        if new_state is None:
+            self._write(
+                "DELETE FROM conversations WHERE name = ? AND key = ?", (name, key_json)
+            )
+            return
+        self._write(
+            "INSERT INTO conversations (name, key, state, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(name, key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+            (name, key_json, json.dumps(new_state), time.time())
+        )
+
+    def count_conversations(self):
+        """Число сохраненных незавершенных диалогов: {имя диалога: количество}"""
+        return dict(self._conn.execute("SELECT name, COUNT(*) FROM conversations GROUP BY name"))
+
+    async def flush(self):
+        self.commit()
+        self._conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+
+class StateApplication(Application):
+    """Application, который после каждого сброса состояния в persistence
+    фиксирует его одной транзакцией (SQLitePersistence.commit)"""
+
+    async def update_persistence(self):
+        await super().update_persistence()
+        if isinstance(self.persistence, SQLitePersistence):
+            self.persistence.commit()
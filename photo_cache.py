@@ -0,0 +1,43 @@
+import sqlite3
+
+
+class PhotoCache:
+    """Кэш file_id загруженных в Telegram фото акций.
+
+    file_id привязан к конкретному боту, поэтому ключ — пара (id бота, путь к файлу).
+    Повторные отправки идут по file_id без повторной загрузки файла.
+    """
+
+    def __init__(self, filepath):
+        self._conn = sqlite3.connect(filepath, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS photo_cache ("
+            "bot_id INTEGER NOT NULL, path TEXT NOT NULL, file_id TEXT NOT NULL, "
+            "PRIMARY KEY (bot_id, path))"
+        )
+        self._cache = {
+            (bot_id, path): file_id
+            for bot_id, path, file_id in self._conn.execute(
+                "SELECT bot_id, path, file_id FROM photo_cache"
+            )
+        }
+
+    def get(self, bot_id, path):
+        return self._cache.get((bot_id, path))
+
+    def put(self, bot_id, path, file_id):
+        if self._cache.get((bot_id, path)) == file_id:
+            return
+        self._cache[(bot_id, path)] = file_id
+        self._conn.execute(
+            "INSERT INTO photo_cache (bot_id, path, file_id) VALUES (?, ?, ?) "
+            "ON CONFLICT(bot_id, path) DO UPDATE SET file_id = excluded.file_id",
+            (bot_id, path, file_id)
+        )
+
+    def discard(self, bot_id, path):
+        if self._cache.pop((bot_id, path), None) is not None:
+            self._conn.execute(
+                "DELETE FROM photo_cache WHERE bot_id = ? AND path = ?", (bot_id, path)
+            )
@@ -0,0 +1,135 @@
+import asyncio
+import collections
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+# Профилирование работающего бота по команде администратора.
+#
+# CPU: отдельный поток периодически снимает стек потока цикла событий
+# (sys._current_frames) и считает, в каких функциях он находится.
+# Память: tracemalloc включается только на время профилирования.
+# Вне профилирования не работает ни поток, ни трассировка памяти.
+
+TOP_FUNCTIONS = 30
+TOP_ALLOCATIONS = 25
+TRACEMALLOC_FRAMES = 10
+
+# Снимок памяти прошлого профилирования для расчета прироста
+_last_snapshot = None
+_lock = threading.Lock()
+
+_SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def _frame_key(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Выборочный профилировщик одного потока"""
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        self.own = collections.Counter()
+        self.total = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            self.own[_frame_key(frame.f_code)] += 1
+            seen = set()
+            while frame is not None:
+                key = _frame_key(frame.f_code)
+                # Рекурсивная функция учитывается в выборке один раз
+                if key not in seen:
+                    seen.add(key)
+                    self.total[key] += 1
+                frame = frame.f_back
+
+    def report(self):
+        lines = [f"Выборок: {self.samples} (интервал {self.interval * 1000:.0f} мс)", ""]
+        if not self.samples:
+            return lines
+        for title, counter in (("Собственное время", self.own), ("Время с вложенными вызовами", self.total)):
+            lines.append(f"{title}:")
+            for key, count in counter.most_common(TOP_FUNCTIONS):
+                lines.append(f"{count / self.samples:7.1%} {count:7d}  {key}")
+            lines.append("")
+        return lines
+
+
+def _memory_report(snapshot, previous):
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [
+        f"Память под трассировкой: {current / 1024:.0f} КБ, пик {peak / 1024:.0f} КБ",
+        "",
+        "Живые блоки, выделенные за время профилирования:",
+    ]
+    for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+        lines.append(f"{stat.size / 1024:10.1f} КБ {stat.count:8d} блоков  {stat.traceback[0]}")
+    lines.append("")
+
+    if previous is None:
+        lines.append("Прирост: нет предыдущего снимка, он будет сравниваться со следующим профилированием.")
+        return lines
+    lines.append("Прирост с прошлого профилирования:")
+    for stat in snapshot.compare_to(previous, "lineno")[:TOP_ALLOCATIONS]:
+        lines.append(f"{stat.size_diff / 1024:+10.1f} КБ {stat.count_diff:+8d} блоков  {stat.traceback[0]}")
+    return lines
+
+
+async def profile(seconds, interval=0.005):
+    """Профилирование цикла событий в течение seconds секунд. Возвращает текст отчета"""
+    global _last_snapshot
+    if not _lock.acquire(blocking=False):
+        raise RuntimeError("Профилирование уже выполняется")
+    try:
+        started = time.time()
+        sampler = SamplingProfiler(threading.get_ident(), interval)
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            sampler.stop()
+            try:
+                snapshot = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+                memory = _memory_report(snapshot, _last_snapshot)
+            finally:
+                tracemalloc.stop()
+        _last_snapshot = snapshot
+
+        lines = [
+            f"Профиль за {seconds} сек, начало {datetime.fromtimestamp(started).strftime('%d.%m.%Y %H:%M:%S')}",
+            "",
+            "== CPU (поток цикла событий) ==",
+        ]
+        lines += sampler.report()
+        lines += ["== Память ==", *memory]
+        return "\n".join(lines) + "\n"
+    finally:
+        _lock.release()
@@ -0,0 +1,186 @@
+import asyncio
+import collections
+import heapq
+import itertools
+import logging
+import time
+from enum import IntEnum
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger("bot.send")
+
+
+class Lane(IntEnum):
+    """Классы исходящих запросов, меньшее значение — выше приоритет"""
+    INTERACTIVE = 0
+    ADMIN = 1
+    DIGEST = 2
+
+
+# Методы, которые не отправляют сообщений и не ограничиваются
+_UNLIMITED_ENDPOINTS = frozenset({"getUpdates", "getMe", "setMyCommands", "deleteWebhook", "close", "logOut"})
+
+_LANE_NAMES = {
+    Lane.INTERACTIVE: "ответы пользователям",
+    Lane.ADMIN: "рассылки администратора",
+    Lane.DIGEST: "плановые рассылки",
+}
+
+
+class PriorityRateLimiter(BaseRateLimiter):
+    """Ограничитель запросов к Bot API с приоритетными полосами.
+
+    Общий бюджет — rate запросов в секунду (корзина токенов). Фоновые полосы
+    (ADMIN, DIGEST) берут токен только если в корзине останется
+    interactive_reserve токенов, так что ответы пользователям не ждут
+    окончания рассылки. Полоса задается через rate_limit_args={"lane": Lane.X},
+    запросы без нее считаются интерактивными. Для фоновых полос
+    дополнительно соблюдается пауза между сообщениями в один чат.
+    """
+
+    def __init__(self, rate=30, interactive_reserve=5, chat_interval=1.0, group_interval=3.0,
+                 max_retries=2, history=500):
+        self.rate = rate
+        self.interactive_reserve = interactive_reserve
+        self.chat_interval = chat_interval
+        self.group_interval = group_interval
+        self.max_retries = max_retries
+        self._tokens = float(rate)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters = []
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._dispatcher = None
+        self._chat_next = {}
+        self._depth = collections.Counter()
+        self._waits = {lane: collections.deque(maxlen=history) for lane in Lane}
+        self._sent = collections.Counter()
+
+    async def initialize(self):
+        self._wakeup = asyncio.Event()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        for _, _, future in self._waiters:
+            if not future.done():
+                future.cancel()
+        self._waiters.clear()
+
+    # Корзина токенов
+    def _refill(self, now):
+        self._tokens = min(float(self.rate), self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def _dispatch(self):
+        while True:
+            if not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+
+            self._refill(now)
+            lane, _, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+
+            needed = 1.0 if lane == Lane.INTERACTIVE else 1.0 + self.interactive_reserve
+            if self._tokens >= needed:
+                heapq.heappop(self._waiters)
+                self._tokens -= 1.0
+                future.set_result(None)
+                continue
+
+            # Ждем пополнения или более приоритетного запроса
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), (needed - self._tokens) / self.rate)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _acquire(self, lane):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (lane, next(self._seq), future))
+        self._wakeup.set()
+        await future
+
+    async def _wait_for_chat(self, chat_id):
+        """Пауза между фоновыми сообщениями в один чат"""
+        try:
+            is_group = int(chat_id) < 0
+        except (TypeError, ValueError):
+            return
+        interval = self.group_interval if is_group else self.chat_interval
+        now = time.monotonic()
+        start = max(now, self._chat_next.get(chat_id, 0.0))
+        self._chat_next[chat_id] = start + interval
+        if start > now:
+            await asyncio.sleep(start - now)
+        if len(self._chat_next) > 10_000:
+            self._chat_next = {cid: t for cid, t in self._chat_next.items() if t > now}
+
+    # Точка входа PTB
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if endpoint in _UNLIMITED_ENDPOINTS:
+            return await callback(*args, **kwargs)
+
+        lane = Lane((rate_limit_args or {}).get("lane", Lane.INTERACTIVE))
+        chat_id = data.get("chat_id")
+        for attempt in range(self.max_retries + 1):
+            queued = time.monotonic()
+            self._depth[lane] += 1
+            try:
+                if lane != Lane.INTERACTIVE and chat_id is not None:
+                    await self._wait_for_chat(chat_id)
+                await self._acquire(lane)
+            finally:
+                self._depth[lane] -= 1
+            self._waits[lane].append(time.monotonic() - queued)
+
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                # Telegram просит паузу для всего бота: останавливаем все полосы
+                retry_after = float(e.retry_after)
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                logger.warning(f"Превышен лимит Bot API ({endpoint}), пауза {retry_after:.0f} сек")
+                continue
+            self._sent[lane] += 1
+            return result
+
+    # Статистика
+    def stats(self):
+        """По каждой полосе: (очередь, отправлено, среднее и p95 ожидания в секундах)"""
+        result = {}
+        for lane in Lane:
+            waits = sorted(self._waits[lane])
+            average = sum(waits) / len(waits) if waits else 0.0
+            p95 = waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0
+            result[lane] = (self._depth[lane], self._sent[lane], average, p95)
+        return result
+
+    def summary(self):
+        lines = [f"Исходящие запросы (лимит {self.rate}/сек, резерв для ответов {self.interactive_reserve}):"]
+        for lane, (depth, sent, average, p95) in self.stats().items():
+            lines.append(
+                f"{_LANE_NAMES[lane]}: в очереди {depth}, отправлено {sent}, "
+                f"ожидание среднее {average * 1000:.0f} мс, p95 {p95 * 1000:.0f} мс"
+            )
+        return "\n".join(lines)
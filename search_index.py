@@ -0,0 +1,93 @@
+import re
+from bisect import bisect_left, insort
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Окончания, которые отбрасываются у слов запроса, чтобы «комплекты»
+# находили «комплект» и «комплекта». Самые длинные проверяются первыми.
+_RU_ENDINGS = sorted((
+    "ами", "ями", "ого", "его", "ому", "ему", "ыми", "ими", "ой", "ей", "ий", "ый",
+    "ая", "яя", "ое", "ее", "ые", "ие", "ов", "ев", "ам", "ям", "ах", "ях", "ом", "ем",
+    "ую", "юю", "а", "я", "ы", "и", "у", "ю", "е", "о",
+), key=len, reverse=True)
+_MIN_STEM = 4
+
+
+def tokenize(text):
+    """Разбиение текста на слова в нижнем регистре (ё приравнивается к е)"""
+    return _TOKEN_RE.findall(text.lower().replace("ё", "е"))
+
+
+def stem(token):
+    """Грубое отбрасывание русского окончания у слова запроса"""
+    for ending in _RU_ENDINGS:
+        if token.endswith(ending) and len(token) - len(ending) >= _MIN_STEM:
+            return token[:-len(ending)]
+    return token
+
+
+class PromotionIndex:
+    """Инвертированный индекс названий акций с поиском по префиксам"""
+
+    def __init__(self):
+        self._postings = {}
+        self._tokens = []
+        self._by_promo = {}
+
+    def __len__(self):
+        return len(self._by_promo)
+
+    def add(self, promo_id, name):
+        self.remove(promo_id)
+        tokens = set(tokenize(name))
+        self._by_promo[promo_id] = tokens
+        for token in tokens:
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = set()
+                insort(self._tokens, token)
+            postings.add(promo_id)
+
+    def remove(self, promo_id):
+        for token in self._by_promo.pop(promo_id, ()):
+            postings = self._postings[token]
+            postings.discard(promo_id)
+            if not postings:
+                del self._postings[token]
+                del self._tokens[bisect_left(self._tokens, token)]
+
+    def rebuild(self, catalog):
+        self._postings, self._tokens, self._by_promo = {}, [], {}
+        for promo_id, promo in catalog.items():
+            self.add(promo_id, promo.get("name", ""))
+
+    def _prefix_matches(self, prefix):
+        result = set()
+        pos = bisect_left(self._tokens, prefix)
+        while pos < len(self._tokens) and self._tokens[pos].startswith(prefix):
+            result |= self._postings[self._tokens[pos]]
+            pos += 1
+        return result
+
+    def search(self, query):
+        """ID акций, в названии которых есть слова с префиксами из запроса"""
+        result = None
+        for token in tokenize(query):
+            matches = self._prefix_matches(stem(token))
+            result = matches if result is None else result & matches
+            if not result:
+                return set()
+        return result if result is not None else set(self._by_promo)
+
+    def apply(self, records):
+        """Инкрементальное обновление индекса по записям журнала каталога"""
+        for record in records:
+            op, promo_id, data = record["op"], record["id"], record.get("data")
+            if op == "put":
+                self.add(promo_id, data.get("name", ""))
+            elif op == "delete":
+                self.remove(promo_id)
+            elif op == "patch" and "name" in data:
+                self.add(promo_id, data["name"])
+            elif op == "reset":
+                self.rebuild(data)
@@ -0,0 +1,26 @@
+import hashlib
+
+
+def _stable_hash(value):
+    return int.from_bytes(hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def plan_offsets(chat_loads, window):
+    """Распределение отправок по окну рассылки.
+
+    chat_loads — словарь chat_id -> число сообщений. Порядок чатов задается
+    стабильным хэшем ID, поэтому каждый чат изо дня в день получает примерно
+    одно и то же время. Смещение чата пропорционально числу сообщений всех
+    чатов перед ним, так что нагрузка равномерна по всему окну.
+    Возвращает словарь chat_id -> смещение в секундах от начала окна.
+    """
+    total = sum(chat_loads.values())
+    if not total:
+        return {chat_id: 0.0 for chat_id in chat_loads}
+
+    offsets = {}
+    sent_before = 0
+    for chat_id in sorted(chat_loads, key=_stable_hash):
+        offsets[chat_id] = window * sent_before / total
+        sent_before += chat_loads[chat_id]
+    return offsets
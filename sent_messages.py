@@ -0,0 +1,75 @@
+import sqlite3
+import time
+
+# Виды рассылок хранятся номерами, чтобы строки индекса были короче
+KINDS = ("manual", "new", "digest", "expiring")
+_KIND_CODES = {kind: code for code, kind in enumerate(KINDS)}
+
+# Поля акции, от которых зависит подпись разосланного фото
+CAPTION_FIELDS = frozenset({"name", "start_date", "end_date"})
+
+
+class SentMessages:
+    """Индекс разосланных сообщений: акция -> [(чат, сообщение, вид рассылки)].
+
+    Нужен, чтобы после изменения акции исправить подписи уже отправленных фото,
+    а после удаления — удалить сами сообщения. Записи старше окна, в котором
+    Telegram позволяет боту удалять сообщения, удаляются (prune).
+
+    Подписчик журнала каталога (apply) только отмечает затронутые акции,
+    сами правки выполняет периодическая задача бота через pop_dirty.
+    """
+
+    def __init__(self, filepath):
+        self._conn = sqlite3.connect(filepath, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sent_messages ("
+            "chat_id INTEGER NOT NULL, message_id INTEGER NOT NULL, promo_id INTEGER NOT NULL, "
+            "kind INTEGER NOT NULL, sent_at INTEGER NOT NULL, "
+            "PRIMARY KEY (chat_id, message_id)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sent_messages_promo ON sent_messages (promo_id)")
+        self._dirty = set()
+
+    def add(self, promo_id, chat_id, message_id, kind):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO sent_messages (chat_id, message_id, promo_id, kind, sent_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (int(chat_id), message_id, int(promo_id), _KIND_CODES[kind], int(time.time()))
+        )
+
+    def messages(self, promo_id):
+        return [
+            (chat_id, message_id, KINDS[kind])
+            for chat_id, message_id, kind in self._conn.execute(
+                "SELECT chat_id, message_id, kind FROM sent_messages WHERE promo_id = ?", (int(promo_id),)
+            )
+        ]
+
+    def forget(self, chat_id, message_id):
+        self._conn.execute(
+            "DELETE FROM sent_messages WHERE chat_id = ? AND message_id = ?", (int(chat_id), message_id)
+        )
+
+    def prune(self, max_age, now=None):
+        """Удаление записей старше max_age секунд. Возвращает число удаленных"""
+        cutoff = int((now or time.time()) - max_age)
+        return self._conn.execute("DELETE FROM sent_messages WHERE sent_at < ?", (cutoff,)).rowcount
+
+    # Отслеживание изменений каталога
+    def apply(self, records):
+        """Подписчик журнала каталога"""
+        for record in records:
+            op, data = record["op"], record.get("data")
+            if op == "reset":
+                self._dirty.update(
+                    str(pid) for (pid,) in self._conn.execute("SELECT DISTINCT promo_id FROM sent_messages")
+                )
+            elif op in ("put", "delete") or (op == "patch" and CAPTION_FIELDS & data.keys()):
+                self._dirty.add(record["id"])
+
+    def pop_dirty(self):
+        """ID акций, измененных или удаленных с прошлого вызова"""
+        dirty, self._dirty = self._dirty, set()
+        return dirty
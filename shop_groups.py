@@ -0,0 +1,111 @@
+import json
+import os
+
+# Ссылки в списке магазинов акции вместо развернутых списков чатов.
+# "*" — все зарегистрированные магазины, включая зарегистрированные позже;
+# "group:<id>" — все магазины группы на момент рассылки.
+ALL_SHOPS = "*"
+GROUP_PREFIX = "group:"
+
+
+def group_ref(group_id):
+    return f"{GROUP_PREFIX}{group_id}"
+
+
+def is_ref(target):
+    return target == ALL_SHOPS or target.startswith(GROUP_PREFIX)
+
+
+class ShopGroups:
+    """Именованные группы магазинов (регион, город, формат).
+
+    Хранятся в JSON-файле {id: {"name": ..., "shops": [chat_id, ...]}}.
+    Состав групп предвычисляется в множества, а для каждого чата — набор
+    его групп, поэтому проверка «касается ли акция чата» не разворачивает ссылки.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.groups = {}
+        if os.path.exists(filepath):
+            with open(filepath, "r", encoding="utf-8") as f:
+                self.groups = json.load(f)
+        self._rebuild()
+
+    def _rebuild(self):
+        self._members = {group_ref(gid): frozenset(g["shops"]) for gid, g in self.groups.items()}
+        chat_refs = {}
+        for ref, members in self._members.items():
+            for chat_id in members:
+                chat_refs.setdefault(chat_id, set()).add(ref)
+        self._chat_refs = {chat_id: frozenset(refs) for chat_id, refs in chat_refs.items()}
+
+    def _save(self):
+        tmp_path = self.filepath + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.groups, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, self.filepath)
+        self._rebuild()
+
+    # Изменение групп
+    def find(self, name):
+        """ID группы по названию без учета регистра"""
+        name = name.strip().lower()
+        for gid, group in self.groups.items():
+            if group["name"].lower() == name:
+                return gid
+        return None
+
+    def add_shops(self, name, chat_ids):
+        """Добавление магазинов в группу, группа создается при необходимости"""
+        gid = self.find(name)
+        if gid is None:
+            gid = str(max((int(g) for g in self.groups), default=0) + 1)
+            self.groups[gid] = {"name": name.strip(), "shops": []}
+        shops = self.groups[gid]["shops"]
+        shops.extend(cid for cid in chat_ids if cid not in shops)
+        self._save()
+        return gid
+
+    def remove_shops(self, name, chat_ids):
+        gid = self.find(name)
+        if gid is None:
+            raise KeyError(name)
+        self.groups[gid]["shops"] = [cid for cid in self.groups[gid]["shops"] if cid not in chat_ids]
+        self._save()
+
+    def delete(self, name):
+        gid = self.find(name)
+        if gid is None:
+            raise KeyError(name)
+        del self.groups[gid]
+        self._save()
+
+    def migrate(self, old_chat_id, new_chat_id):
+        changed = False
+        for group in self.groups.values():
+            if old_chat_id in group["shops"]:
+                group["shops"] = [new_chat_id if cid == old_chat_id else cid for cid in group["shops"]]
+                changed = True
+        if changed:
+            self._save()
+
+    # Разрешение ссылок
+    def exists(self, ref):
+        return ref == ALL_SHOPS or ref in self._members
+
+    def members(self, ref):
+        return self._members.get(ref, frozenset())
+
+    def refs_for_chat(self, chat_id):
+        """Ссылки на группы, в которые входит чат"""
+        return self._chat_refs.get(chat_id, frozenset())
+
+    def label(self, target, chat_ids):
+        """Название магазина, группы или «все магазины» для показа администратору"""
+        if target == ALL_SHOPS:
+            return "📢 Все магазины"
+        if target.startswith(GROUP_PREFIX):
+            group = self.groups.get(target[len(GROUP_PREFIX):])
+            return f"👥 {group['name']}" if group else "👥 Удаленная группа"
+        return chat_ids.get(target, "Неизвестный магазин")
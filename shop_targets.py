@@ -0,0 +1,202 @@
+import base64
+import json
+import os
+
+from shop_groups import is_ref
+
+# Компактное хранение адресатов акций.
+#
+# Каждый чат один раз получает плотный номер в таблице интернирования
+# (chat_index.json, только дописывается). Магазины акции хранятся битовой
+# маской по этим номерам в поле targets: {"chats": <base64 маски>,
+# "refs": ["*", "group:<id>"]}. В памяти маски — обычные int, поэтому
+# объединение, пересечение и разность адресатов — одна битовая операция.
+
+
+def encode_mask(mask):
+    if not mask:
+        return ""
+    raw = mask.to_bytes((mask.bit_length() + 7) // 8, "little")
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def decode_mask(text):
+    if not text:
+        return 0
+    return int.from_bytes(base64.urlsafe_b64decode(text + "=" * (-len(text) % 4)), "little")
+
+
+def iter_bits(mask):
+    """Номера установленных битов по возрастанию"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class ChatIndex:
+    """Таблица интернирования: ID чата <-> плотный номер бита"""
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._chats = []
+        if os.path.exists(filepath):
+            with open(filepath, "r", encoding="utf-8") as f:
+                self._chats = json.load(f)
+        self._index = {chat_id: i for i, chat_id in enumerate(self._chats)}
+
+    def __len__(self):
+        return len(self._chats)
+
+    def _save(self):
+        tmp_path = self.filepath + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._chats, f)
+        os.replace(tmp_path, self.filepath)
+
+    def intern(self, chat_ids):
+        """Номера для чатов, новые чаты дописываются в таблицу"""
+        added = False
+        for chat_id in chat_ids:
+            if chat_id not in self._index:
+                self._index[chat_id] = len(self._chats)
+                self._chats.append(chat_id)
+                added = True
+        if added:
+            self._save()
+
+    def bit(self, chat_id):
+        index = self._index.get(chat_id)
+        return 0 if index is None else 1 << index
+
+    def mask(self, chat_ids):
+        """Маска уже известных чатов; неизвестные пропускаются"""
+        mask = 0
+        for chat_id in chat_ids:
+            index = self._index.get(chat_id)
+            if index is not None:
+                mask |= 1 << index
+        return mask
+
+    def chats(self, mask):
+        return [self._chats[i] for i in iter_bits(mask)]
+
+    def remap(self, old_chat_id, new_chat_id):
+        """Перенос номера на новый ID чата. False, если у нового чата уже есть свой номер"""
+        if new_chat_id in self._index or old_chat_id not in self._index:
+            return False
+        index = self._index.pop(old_chat_id)
+        self._chats[index] = new_chat_id
+        self._index[new_chat_id] = index
+        self._save()
+        return True
+
+
+class PromotionTargets:
+    """Раскодированные адресаты акций: promo_id -> (маска чатов, ссылки).
+
+    Обновляется по записям журнала каталога, как и поисковый индекс.
+    """
+
+    def __init__(self, chat_index):
+        self.chat_index = chat_index
+        self._masks = {}
+        self._refs = {}
+
+    # Кодирование
+    def pack(self, targets):
+        """Список ID чатов и ссылок -> значение поля targets"""
+        chat_ids = [t for t in targets if not is_ref(t)]
+        refs = sorted({t for t in targets if is_ref(t)})
+        self.chat_index.intern(chat_ids)
+        packed = {}
+        mask = encode_mask(self.chat_index.mask(chat_ids))
+        if mask:
+            packed["chats"] = mask
+        if refs:
+            packed["refs"] = refs
+        return packed
+
+    def unpack(self, promo_id):
+        """Адресаты акции списком: ID чатов, затем ссылки"""
+        return self.chat_index.chats(self._masks.get(promo_id, 0)) + sorted(self._refs.get(promo_id, ()))
+
+    # Обновление
+    def _set(self, promo_id, promo):
+        targets = (promo or {}).get("targets") or {}
+        self._masks[promo_id] = decode_mask(targets.get("chats", ""))
+        self._refs[promo_id] = frozenset(targets.get("refs", ()))
+
+    def _remove(self, promo_id):
+        self._masks.pop(promo_id, None)
+        self._refs.pop(promo_id, None)
+
+    def rebuild(self, catalog):
+        self._masks.clear()
+        self._refs.clear()
+        for promo_id, promo in catalog.items():
+            self._set(promo_id, promo)
+
+    def apply(self, records):
+        """Подписчик журнала каталога"""
+        for record in records:
+            op = record["op"]
+            if op == "reset":
+                self.rebuild(record["data"])
+            elif op == "delete":
+                self._remove(record["id"])
+            elif op == "put" or (op == "patch" and "targets" in record["data"]):
+                self._set(record["id"], record["data"])
+
+    def remap_bit(self, old_bit, new_bit):
+        """Перенос бита во всех масках. Возвращает ID измененных акций"""
+        changed = []
+        for promo_id, mask in self._masks.items():
+            if mask & old_bit:
+                self._masks[promo_id] = (mask & ~old_bit) | new_bit
+                changed.append(promo_id)
+        return changed
+
+    # Запросы
+    def mask(self, promo_id):
+        return self._masks.get(promo_id, 0)
+
+    def refs(self, promo_id):
+        return self._refs.get(promo_id, frozenset())
+
+    def encoded(self, promo_id):
+        packed = {}
+        if self._masks.get(promo_id):
+            packed["chats"] = encode_mask(self._masks[promo_id])
+        if self._refs.get(promo_id):
+            packed["refs"] = sorted(self._refs[promo_id])
+        return packed
+
+    def promotions_for_chat(self, chat_id, chat_refs=()):
+        """Акции, адресованные чату напрямую или через одну из ссылок chat_refs"""
+        bit = self.chat_index.bit(chat_id)
+        chat_refs = frozenset(chat_refs)
+        return [
+            promo_id for promo_id, mask in self._masks.items()
+            if mask & bit or self._refs[promo_id] & chat_refs
+        ]
+
+    def resolve(self, promo_id, ref_mask):
+        """Маска всех адресатов акции; ref_mask(ref) — маска чатов ссылки"""
+        mask = self._masks.get(promo_id, 0)
+        for ref in self._refs.get(promo_id, ()):
+            mask |= ref_mask(ref)
+        return mask
+
+    def union(self, promo_ids, ref_mask):
+        """Маска чатов, которым адресована хотя бы одна из акций"""
+        mask = 0
+        for promo_id in promo_ids:
+            mask |= self.resolve(promo_id, ref_mask)
+        return mask
+
+    def unreached(self, promo_id, reached_chat_ids, ref_mask):
+        """Адресаты акции, которым она еще не доставлена"""
+        return self.chat_index.chats(
+            self.resolve(promo_id, ref_mask) & ~self.chat_index.mask(reached_chat_ids)
+        )
@@ -0,0 +1,295 @@
+import json
+import logging
+import os
+
+from telegram.request import HTTPXRequest
+
+from config import (
+    DATA_FILE, CHAT_IDS_FILE, CHAT_SETTINGS_FILE, STATE_DB_FILE, HISTORY_DIR,
+    HISTORY_RETENTION_DAYS, LEDGER_RETENTION_DAYS, CHAT_RETRY_BASE_DELAY,
+    CHAT_MAX_FAILURES, DEFAULT_TIMEZONE, SHOP_GROUPS_FILE, CHAT_INDEX_FILE, DEFAULT_DIGEST_MODE,
+    THROTTLE_USER_RATE, THROTTLE_USER_BURST, THROTTLE_CHAT_RATE, THROTTLE_CHAT_BURST,
+    THROTTLE_REPEAT_WINDOW, THROTTLE_MAX_KEYS
+)
+from journal import CatalogJournal
+from delivery_ledger import DeliveryLedger
+from chat_health import ChatHealth
+from analytics import PromoAnalytics
+from sent_messages import SentMessages
+from throttle import Throttle
+from search_index import PromotionIndex
+from shop_groups import ALL_SHOPS, ShopGroups
+from shop_targets import ChatIndex, PromotionTargets
+from timezones import local_today
+
+logger = logging.getLogger(__name__)
+
+# Виды ежедневной рассылки: три фото акций или одна закрепленная подборка
+DIGEST_MODES = ("photos", "pinned")
+
+
+def _load_json(path, default):
+    """Чтение JSON-файла с запасной кодировкой cp1251"""
+    if not os.path.exists(path):
+        logger.error(f"Файл {path} не найден")
+        return default
+
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except UnicodeDecodeError:
+        try:
+            with open(path, 'r', encoding='cp1251') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"Не удалось прочитать файл {path} даже в cp1251: {e}")
+            return default
+    except Exception as e:
+        logger.error(f"Другая ошибка при чтении {path}: {e}")
+        return default
+
+
+def _save_json(path, data):
+    try:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении {path}: {e}")
+
+
+class Tenant:
+    """Отдельный бот в общем процессе: свой токен, админы, каталог и магазины.
+
+    Все файлы бота лежат в data_dir. Бот с data_dir="." использует
+    прежние файлы в корне проекта.
+    """
+
+    def __init__(self, name, token, admin_ids, data_dir="."):
+        self.name = name
+        self.token = token
+        self.admin_ids = list(admin_ids)
+        self.data_dir = data_dir
+
+        self.data_file = self.path(DATA_FILE)
+        self.chat_ids_file = self.path(CHAT_IDS_FILE)
+        self.chat_settings_file = self.path(CHAT_SETTINGS_FILE)
+        self.state_db_file = self.path(STATE_DB_FILE)
+        self.photos_dir = self.path("photos")
+        self._create_files()
+
+        # Снимок каталога плюс хвост журнала изменений
+        self.journal = CatalogJournal(
+            self.data_file, self.path(HISTORY_DIR),
+            photos_dir=self.photos_dir, retention_days=HISTORY_RETENTION_DAYS
+        )
+        self.promotions = self.journal.replay(_load_json(self.data_file, {}))
+        self.chat_ids = _load_json(self.chat_ids_file, {})
+        self.chat_settings = _load_json(self.chat_settings_file, {})
+        self.shop_groups = ShopGroups(self.path(SHOP_GROUPS_FILE))
+
+        # Адресаты акций: битовые маски по интернированным ID чатов
+        self.chat_index = ChatIndex(self.path(CHAT_INDEX_FILE))
+        self.targets = PromotionTargets(self.chat_index)
+        self._upgrade_catalog()
+        self.targets.rebuild(self.promotions)
+        self.journal.listeners.append(self.targets.apply)
+
+        # Журнал доставок для защиты от повторной отправки
+        self.delivery_ledger = DeliveryLedger(self.state_db_file, retention_days=LEDGER_RETENTION_DAYS)
+
+        # Доступность чатов: отложенные повторы и исключение недоступных чатов
+        self.chat_health = ChatHealth(
+            self.state_db_file, base_delay=CHAT_RETRY_BASE_DELAY, max_failures=CHAT_MAX_FAILURES
+        )
+
+        # Разосланные сообщения акций для правки подписей и отзыва
+        self.sent_messages = SentMessages(self.state_db_file)
+        self.journal.listeners.append(self.sent_messages.apply)
+
+        # Идущие фоновые рассылки: id -> Broadcast
+        self.broadcasts = {}
+
+        # Ограничение частоты запросов пользователей и чатов
+        self.throttle = Throttle(
+            THROTTLE_USER_RATE, THROTTLE_USER_BURST, THROTTLE_CHAT_RATE, THROTTLE_CHAT_BURST,
+            repeat_window=THROTTLE_REPEAT_WINDOW, max_keys=THROTTLE_MAX_KEYS
+        )
+
+        # Счетчики просмотров и доставок акций, сбрасываются в базу пачками
+        self.analytics = PromoAnalytics(self.state_db_file)
+
+        # Поисковый индекс названий акций обновляется по каждой записи журнала
+        self.search_index = PromotionIndex()
+        self.search_index.rebuild(self.promotions)
+        self.journal.listeners.append(self.search_index.apply)
+
+    def path(self, filename):
+        return os.path.normpath(os.path.join(self.data_dir, filename))
+
+    def _create_files(self):
+        os.makedirs(self.data_dir, exist_ok=True)
+        for path in (self.data_file, self.chat_ids_file, self.chat_settings_file):
+            if not os.path.exists(path):
+                with open(path, 'w', encoding='utf-8') as f:
+                    json.dump({}, f)
+                logger.info(f"Создан файл {path}")
+
+        if not os.path.exists(self.photos_dir):
+            os.makedirs(self.photos_dir)
+            logger.info(f"Создана директория {self.photos_dir}")
+
+    # Магазины и настройки чатов
+    def save_chat_ids(self):
+        _save_json(self.chat_ids_file, self.chat_ids)
+
+    def save_chat_settings(self):
+        _save_json(self.chat_settings_file, self.chat_settings)
+
+    # Адресаты акций
+    def upgrade_promotion(self, promo):
+        """Перевод старых списков shops/selected_shops в поле targets. True, если акция изменена"""
+        if "shops" not in promo and "selected_shops" not in promo:
+            return False
+        shops = promo.pop("shops", None) or promo.get("selected_shops") or []
+        promo.pop("selected_shops", None)
+        promo["targets"] = self.targets.pack([str(cid) for cid in shops])
+        return True
+
+    def _upgrade_catalog(self):
+        records = [
+            self.journal.record("put", pid, promo, reason="migrate")
+            for pid, promo in self.promotions.items()
+            if self.upgrade_promotion(promo)
+        ]
+        if records:
+            self.journal.append(records)
+            logger.info(f"[{self.name}] Списки магазинов переведены в битовые маски у акций: {len(records)}")
+
+    def set_targets(self, promo, targets):
+        """Запись адресатов (ID чатов и ссылок) в акцию"""
+        promo["targets"] = self.targets.pack(targets)
+        return promo["targets"]
+
+    def target_list(self, promo_id):
+        return self.targets.unpack(promo_id)
+
+    def ref_resolver(self):
+        """Функция ссылка -> маска зарегистрированных чатов с кэшем на время одной операции"""
+        cache = {}
+
+        def ref_mask(ref):
+            if ref not in cache:
+                if ref == ALL_SHOPS:
+                    chat_ids = list(self.chat_ids)
+                else:
+                    chat_ids = [cid for cid in self.shop_groups.members(ref) if cid in self.chat_ids]
+                # Магазины, зарегистрированные после последнего интернирования, получают номера здесь
+                self.chat_index.intern(chat_ids)
+                cache[ref] = self.chat_index.mask(chat_ids)
+            return cache[ref]
+        return ref_mask
+
+    def promo_chats(self, promo_id, ref_mask=None):
+        """Чаты, которым адресована акция, с разворачиванием групп и «всех магазинов»"""
+        return self.chat_index.chats(self.targets.resolve(promo_id, ref_mask or self.ref_resolver()))
+
+    def promotions_for_chat(self, chat_id):
+        """ID акций, адресованных чату напрямую, через группу или всем магазинам"""
+        refs = ()
+        if chat_id in self.chat_ids:
+            refs = self.shop_groups.refs_for_chat(chat_id) | {ALL_SHOPS}
+        return self.targets.promotions_for_chat(chat_id, refs)
+
+    def chat_timezone(self, chat_id):
+        """Часовой пояс чата"""
+        return self.chat_settings.get(str(chat_id), {}).get("timezone", DEFAULT_TIMEZONE)
+
+    def used_timezones(self):
+        """Часовые пояса зарегистрированных чатов"""
+        return {self.chat_timezone(cid) for cid in self.chat_ids} | {DEFAULT_TIMEZONE}
+
+    def digest_mode(self, chat_id):
+        """Вид ежедневной рассылки чата: photos или pinned"""
+        return self.chat_settings.get(str(chat_id), {}).get("digest", DEFAULT_DIGEST_MODE)
+
+    def pinned_digest(self, chat_id):
+        """Закрепленная подборка чата: {"message_id", "hash"} или пустой словарь"""
+        return self.chat_settings.get(str(chat_id), {}).get("pinned_digest", {})
+
+    def set_pinned_digest(self, chat_id, message_id, digest_hash):
+        self.chat_settings.setdefault(str(chat_id), {})["pinned_digest"] = {
+            "message_id": message_id, "hash": digest_hash
+        }
+        self.save_chat_settings()
+
+    def delivery_day(self, chat_id=None):
+        """Текущий день рассылок в часовом поясе чата"""
+        return local_today(self.chat_timezone(chat_id) if chat_id is not None else DEFAULT_TIMEZONE)
+
+    def next_promo_id(self):
+        """Следующий свободный ID акции"""
+        return str(max((int(pid) for pid in self.promotions), default=0) + 1)
+
+    def migrate_chat(self, old_chat_id, new_chat_id):
+        """Перенос чата на новый ID после преобразования группы в супергруппу"""
+        old_id, new_id = str(old_chat_id), str(new_chat_id)
+        name = self.chat_ids.pop(old_id, None)
+        if name is not None:
+            self.chat_ids[new_id] = name
+            self.save_chat_ids()
+        if old_id in self.chat_settings:
+            self.chat_settings[new_id] = self.chat_settings.pop(old_id)
+            self.save_chat_settings()
+
+        # Обычно номер бита просто переходит к новому ID и маски акций не меняются
+        records = []
+        if not self.chat_index.remap(old_id, new_id):
+            self.chat_index.intern([new_id])
+            old_bit, new_bit = self.chat_index.bit(old_id), self.chat_index.bit(new_id)
+            for pid in self.targets.remap_bit(old_bit, new_bit):
+                changes = {"targets": self.targets.encoded(pid)}
+                self.promotions[pid].update(changes)
+                records.append(self.journal.record("patch", pid, changes, reason="migrate"))
+        if records:
+            self.journal.append(records)
+
+        self.shop_groups.migrate(old_id, new_id)
+        self.chat_health.record_migration(old_id, new_id, name)
+        logger.warning(f"[{self.name}] Чат {old_id} перенесен в {new_id}, обновлено акций: {len(records)}")
+
+    def record_chat_failure(self, chat_id, error):
+        """Учет ошибки доступа к чату и исключение недоступного чата"""
+        chat_id = str(chat_id)
+        if self.chat_health.record_failure(chat_id, str(error), name=self.chat_ids.get(chat_id)):
+            if self.chat_ids.pop(chat_id, None) is not None:
+                self.save_chat_ids()
+            logger.warning(f"[{self.name}] Чат {chat_id} помечен недоступным и исключен из рассылок: {error}")
+        else:
+            logger.warning(f"[{self.name}] Чат {chat_id} временно исключен из рассылок: {error}")
+
+
+def get_tenant(context):
+    """Бот, к которому относится обновление или задача"""
+    return context.bot_data["tenant"]
+
+
+class SharedHTTPXRequest(HTTPXRequest):
+    """Общий пул HTTP-соединений для нескольких ботов.
+
+    Клиент создается при первой инициализации и закрывается, когда его
+    освободит последний бот.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._users = 0
+
+    async def initialize(self):
+        self._users += 1
+        if self._users == 1:
+            await super().initialize()
+
+    async def shutdown(self):
+        self._users -= 1
+        if self._users == 0:
+            await super().shutdown()
@@ -0,0 +1,83 @@
+import time
+from collections import OrderedDict
+
+# Результаты проверки Throttle.check
+ALLOW = "allow"
+REPEAT = "repeat"        # повтор того же нажатия в коротком окне — молча игнорируется
+THROTTLED = "throttled"  # лимит исчерпан, пользователь уже предупрежден
+NOTIFY = "notify"        # лимит исчерпан, нужно один раз ответить пользователю
+
+
+class TokenBuckets:
+    """Корзины токенов по ключу с вытеснением давно не использованных (LRU)"""
+
+    def __init__(self, rate, burst, max_keys=10_000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def allow(self, key, now=None):
+        now = now if now is not None else time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(self.burst), now]
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] < 1.0:
+            return False
+        bucket[0] -= 1.0
+        return True
+
+
+class _RecentKeys:
+    """Ключи, виденные за последние window секунд, с ограничением размера"""
+
+    def __init__(self, window, max_keys):
+        self.window = window
+        self.max_keys = max_keys
+        self._seen = OrderedDict()
+
+    def seen(self, key, now):
+        """True, если ключ уже встречался в окне. Отмечает ключ"""
+        last = self._seen.pop(key, None)
+        self._seen[key] = now
+        if len(self._seen) > self.max_keys:
+            self._seen.popitem(last=False)
+        return last is not None and now - last < self.window
+
+
+class Throttle:
+    """Ограничение частоты запросов пользователей к /promotions и кнопкам акций.
+
+    Каждый запрос расходует токен из корзины пользователя и из корзины чата,
+    так что один пользователь не съест общий бюджет отправки, а группа
+    пользователей — бюджет чата. Повтор того же нажатия кнопки в окне
+    repeat_window игнорируется без ответа. О превышении лимита пользователь
+    узнает один раз, повторно — после паузы дольше notice_interval секунд.
+    """
+
+    def __init__(self, user_rate, user_burst, chat_rate, chat_burst,
+                 repeat_window=3.0, notice_interval=30.0, max_keys=10_000):
+        self.users = TokenBuckets(user_rate, user_burst, max_keys)
+        self.chats = TokenBuckets(chat_rate, chat_burst, max_keys)
+        self._repeats = _RecentKeys(repeat_window, max_keys)
+        self._notices = _RecentKeys(notice_interval, max_keys)
+        self.throttled = 0
+
+    def check(self, user_id, chat_id, repeat_key=None, now=None):
+        now = now if now is not None else time.monotonic()
+        if repeat_key is not None and self._repeats.seen((user_id, repeat_key), now):
+            return REPEAT
+        # Корзина чата проверяется только если пропустила корзина пользователя
+        if self.users.allow(user_id, now) and self.chats.allow(chat_id, now):
+            return ALLOW
+        self.throttled += 1
+        return THROTTLED if self._notices.seen(user_id, now) else NOTIFY
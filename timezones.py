@@ -0,0 +1,26 @@
+import time as _time
+from datetime import datetime, timedelta
+
+import pytz
+
+# Кэш текущей даты по часовым поясам: пояс -> (дата, момент следующей полуночи).
+# Проверки активности акций берут дату отсюда, а не вычисляют ее для каждой акции.
+_day_cache = {}
+
+
+def is_valid_timezone(name):
+    return name in pytz.all_timezones_set
+
+
+def local_today(tz_name):
+    """Текущая дата в часовом поясе с кэшированием до ближайшей полуночи"""
+    now = _time.time()
+    cached = _day_cache.get(tz_name)
+    if cached and now < cached[1]:
+        return cached[0]
+
+    tz = pytz.timezone(tz_name)
+    today = datetime.fromtimestamp(now, tz).date()
+    next_midnight = tz.localize(datetime.combine(today + timedelta(days=1), datetime.min.time()))
+    _day_cache[tz_name] = (today, next_midnight.timestamp())
+    return today